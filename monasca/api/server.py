@@ -14,14 +14,21 @@
 # License for the specific language governing permissions and limitations
 # under the License.
 
+import multiprocessing
 import os
+import sys
 from wsgiref import simple_server
 
 from oslo.config import cfg
 import paste.deploy
 from stevedore import named
 
+try:
+    from gunicorn.app import base as gunicorn_base
+except ImportError:
+    gunicorn_base = None
 
+from monasca.common import instrument
 from monasca.common import resource_api
 from monasca.openstack.common import log
 
@@ -34,11 +41,49 @@ OPTS = [
 ]
 cfg.CONF.register_opts(OPTS)
 
+server_opts = [
+    cfg.StrOpt('host', default='0.0.0.0',
+               help='The address the api listens on.'),
+    cfg.IntOpt('port', default=9090,
+               help='The port the api listens on.'),
+    cfg.IntOpt('workers', default=0,
+               help=('The number of worker processes. 0 to size it from '
+                     'the CPU cores: (2 x cores) + 1 sync workers, or one '
+                     'eventlet or gevent worker per core.')),
+    cfg.StrOpt('worker_class', default='sync',
+               help=('The type of the workers, sync, eventlet or gevent. '
+                     'The async ones serve many requests at once from '
+                     'each worker.')),
+    cfg.IntOpt('worker_connections', default=1000,
+               help=('The maximum number of requests an eventlet or '
+                     'gevent worker serves at once.')),
+    cfg.IntOpt('timeout', default=30,
+               help='Workers silent for this many seconds are restarted.'),
+    cfg.StrOpt('paste_config', default='/etc/monasca/monasca.ini',
+               help='The paste deploy file of the api pipeline.'),
+]
+
+server_group = cfg.OptGroup(name='api_server', title='api_server')
+cfg.CONF.register_group(server_group)
+cfg.CONF.register_opts(server_opts, server_group)
+
 LOG = log.getLogger(__name__)
 
+# whether main parsed the command line already
+_conf_parsed = False
+
+
+def parse_config(args):
+    global _conf_parsed
+    cfg.CONF(args=args, project='monasca')
+    _conf_parsed = True
+
 
 def api_app(conf):
-    cfg.CONF(args=[], project='monasca')
+    # keep the command line of main, the pipeline is also served with
+    # gunicorn --paste, whose command line is not ours
+    if not _conf_parsed:
+        cfg.CONF(args=[], project='monasca')
     log_levels = (cfg.CONF.default_log_levels)
     cfg.set_defaults(log.log_opts, default_log_levels=log_levels)
     log.setup('monasca')
@@ -62,13 +107,68 @@ def api_app(conf):
     for driver in dispatcher_manager:
         app.add_route(None, driver.obj)
 
+    # serve the instrumentation of the api at /metrics
+    app.add_route(None, instrument.MetricsResource())
+
     LOG.debug('Dispatcher drivers have been added to the routes!')
     return app
 
 
+def get_workers(workers, worker_class):
+    """Get the number of workers, sized from the CPU cores when 0."""
+    if workers > 0:
+        return workers
+    cores = multiprocessing.cpu_count()
+    if worker_class == 'sync':
+        return cores * 2 + 1
+    return cores
+
+
+def load_app():
+    return paste.deploy.loadapp('config:' + cfg.CONF.api_server.paste_config,
+                                relative_to=os.getcwd())
+
+
+def main():
+    """Serve the api from pre-forked worker processes.
+
+    The application, and with it the dispatchers and their kafka and
+    ElasticSearch connections, is loaded by each worker after the fork, so
+    the workers share nothing and the api scales with the cores.
+    """
+    parse_config(sys.argv[1:])
+    conf = cfg.CONF.api_server
+
+    if gunicorn_base is None:
+        LOG.warn('gunicorn is not installed, serving the api from a single '
+                 'process.')
+        httpd = simple_server.make_server(conf.host, conf.port, load_app())
+        httpd.serve_forever()
+        return
+
+    class APIServer(gunicorn_base.BaseApplication):
+        def load_config(self):
+            options = {
+                'bind': '%s:%s' % (conf.host, conf.port),
+                'workers': get_workers(conf.workers, conf.worker_class),
+                'worker_class': conf.worker_class,
+                'worker_connections': conf.worker_connections,
+                'timeout': conf.timeout,
+                'proc_name': 'monasca-api',
+                # load the application in the workers, not in the master
+                'preload_app': False}
+            for key, value in options.items():
+                self.cfg.set(key, value)
+
+        def load(self):
+            # each worker writes its metrics for /metrics to serve the
+            # totals of all the workers
+            instrument.start_multiprocess()
+            return load_app()
+
+    instrument.clear_multiprocess()
+    APIServer().run()
+
+
 if __name__ == '__main__':
-    wsgi_app = (
-        paste.deploy.loadapp('config:etc/monasca.ini',
-                             relative_to=os.getcwd()))
-    httpd = simple_server.make_server('127.0.0.1', 9000, wsgi_app)
-    httpd.serve_forever()
+    main()
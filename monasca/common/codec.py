@@ -0,0 +1,78 @@
+# Copyright 2013 IBM Corp
+#
+# Author: Tong Li <litong01@us.ibm.com>
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+"""
+The codec used by all the services to encode and decode the messages they
+exchange through Kafka.
+
+A message is plain json. Optionally a message can be wrapped into an
+envelope which names the schema and the version of the payload, so that a
+consumer can reject messages it does not understand:
+
+    {"envelope": {"schema": "alarm", "version": 1},
+     "payload": {"the": "message"}}
+
+Messages written by older versions of the services as python literals, for
+example with single quotes, are still decoded.
+"""
+
+import ast
+
+try:
+    import ujson as json
+except ImportError:
+    import json
+
+
+ENVELOPE = 'envelope'
+PAYLOAD = 'payload'
+
+
+def encode(obj, schema=None, version=1):
+    """Encode a message, in an envelope when a schema is given."""
+    if schema:
+        obj = {ENVELOPE: {'schema': schema, 'version': version},
+               PAYLOAD: obj}
+    return json.dumps(obj)
+
+
+def decode(msg, schema=None, max_version=None):
+    """Decode a message and return its payload.
+
+    :param schema: if given, enveloped messages of another schema are
+        rejected.
+    :param max_version: if given, enveloped messages of a newer version
+        are rejected.
+    :raises ValueError: when the message can not be decoded or is rejected.
+    """
+    try:
+        obj = json.loads(msg)
+    except ValueError:
+        try:
+            obj = ast.literal_eval(msg)
+        except Exception:
+            raise ValueError('Message is not valid json: %s' % msg)
+
+    if isinstance(obj, dict) and ENVELOPE in obj and PAYLOAD in obj:
+        envelope = obj[ENVELOPE]
+        if schema and envelope.get('schema') != schema:
+            raise ValueError('Expected schema %s but got %s' %
+                             (schema, envelope.get('schema')))
+        if max_version and envelope.get('version', 1) > max_version:
+            raise ValueError('Version %s of schema %s is not supported' %
+                             (envelope.get('version'), envelope.get('schema')))
+        obj = obj[PAYLOAD]
+    return obj
@@ -0,0 +1,74 @@
+# Copyright 2015 Carnegie Mellon University
+#
+# Author: Han Chen <hanc@andrew.cmu.edu>
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+import time
+
+from monasca.openstack.common import log
+
+
+LOG = log.getLogger(__name__)
+
+
+class DocumentCache(object):
+    """Documents kept in memory for ttl seconds, by id.
+
+    Documents which are not cached yet are loaded from ElasticSearch with
+    one query no matter how many of them are requested. The label names
+    the documents in the log, for example notification methods.
+    """
+    def __init__(self, es_conn, ttl, label='documents'):
+        self._es_conn = es_conn
+        self.ttl = ttl
+        self.label = label
+        self._docs = {}
+
+    def _load(self, ids):
+        res = self._es_conn.get_messages_by_ids(ids)
+        if not res or res.status_code != 200:
+            LOG.error('Failed to load %s %s', self.label, ids)
+            return {}
+        obj = res.json() or {}
+        return dict((hit['_id'], hit['_source'])
+                    for hit in obj.get('hits', {}).get('hits', []))
+
+    def get(self, ids):
+        """Get the documents of the given ids as a dict.
+
+        Ids which do not exist are left out of the result.
+        """
+        now = time.time()
+        docs = {}
+        missing = []
+        for id in set(ids):
+            item = self._docs.get(id)
+            if item and item[0] > now:
+                docs[id] = item[1]
+            else:
+                missing.append(id)
+
+        if missing:
+            loaded = self._load(missing)
+            expire = now + self.ttl
+            for id in missing:
+                if id in loaded:
+                    self._docs[id] = (expire, loaded[id])
+                else:
+                    self._docs.pop(id, None)
+            docs.update(loaded)
+        return docs
+
+    def invalidate(self, id):
+        self._docs.pop(id, None)
@@ -1,43 +1,272 @@
-import smtplib
-import sys
+# Copyright 2015 Carnegie Mellon University
+#
+# Author: Han Chen <hanc@andrew.cmu.edu>
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+import collections
 import email.mime.text
+import Queue
+import smtplib
+import socket
+import threading
+import time
+
+from oslo.config import cfg
+
+from monasca.openstack.common import log
+
+
+email_opts = [
+    cfg.StrOpt('host', default='smtp.gmail.com',
+               help='The SMTP server to send emails through.'),
+    cfg.IntOpt('port', default=25,
+               help='The port of the SMTP server.'),
+    cfg.FloatOpt('timeout', default=30.0,
+                 help=('The seconds to wait for the SMTP server to connect '
+                       'and to answer each command.')),
+    cfg.BoolOpt('starttls', default=True,
+                help='If the connection should be secured with STARTTLS.'),
+    cfg.StrOpt('username', default='',
+               help='The user to login with, no login if not specified.'),
+    cfg.StrOpt('password', default='', secret=True,
+               help='The password of the user.'),
+    cfg.StrOpt('from_addr', default='monasca.notification@gmail.com',
+               help='The sender address of the emails.'),
+    cfg.IntOpt('workers', default=4,
+               help=('The number of threads sending emails, each one keeps '
+                     'its own connection to the SMTP server.')),
+    cfg.IntOpt('queue_size', default=10000,
+               help='The maximum number of emails waiting to be sent.'),
+    cfg.IntOpt('batch_size', default=100,
+               help=('The maximum number of queued emails a worker takes at '
+                     'a time. Emails taken together which go to the same '
+                     'recipient are sent as one email.')),
+    cfg.IntOpt('max_retry', default=3,
+               help='The number of retries when an email can not be sent.'),
+    cfg.FloatOpt('retry_interval', default=1.0,
+                 help=('The seconds to wait before the first retry, the wait '
+                       'doubles with each retry.')),
+]
+
+email_group = cfg.OptGroup(name='email', title='email')
+cfg.CONF.register_group(email_group)
+cfg.CONF.register_opts(email_opts, email_group)
+
+LOG = log.getLogger(__name__)
+
+
+class SMTPConnection(object):
+    """A connection to the SMTP server which is reused between emails.
+
+    The connection is opened on the first email and opened again when the
+    server has closed it.
+    """
+    def __init__(self):
+        self.host = cfg.CONF.email.host
+        self.port = cfg.CONF.email.port
+        self.timeout = cfg.CONF.email.timeout
+        self.starttls = cfg.CONF.email.starttls
+        self.username = cfg.CONF.email.username
+        self.password = cfg.CONF.email.password
+        self._smtp = None
+
+    def _connect(self):
+        smtp = smtplib.SMTP(self.host, self.port, timeout=self.timeout)
+        try:
+            if self.starttls:
+                smtp.starttls()
+            if self.username:
+                smtp.login(self.username, self.password)
+        except Exception:
+            smtp.close()
+            raise
+        self._smtp = smtp
+        LOG.debug('Connected to SMTP server %s:%s' % (self.host, self.port))
+
+    def sendmail(self, from_addr, to_addrs, msg):
+        if not self._smtp:
+            self._connect()
+        try:
+            self._smtp.sendmail(from_addr, to_addrs, msg)
+        except smtplib.SMTPRecipientsRefused:
+            raise
+        except (smtplib.SMTPException, socket.error):
+            # The connection may have gone stale, drop it so that the next
+            # try gets a new one.
+            self.close()
+            raise
+
+    def close(self):
+        if self._smtp:
+            try:
+                self._smtp.quit()
+            except Exception:
+                self._smtp.close()
+            self._smtp = None
+
+
+class EmailSender(object):
+    """Sends emails from a bounded queue with a pool of worker threads.
+
+    Queuing an email never waits on the SMTP server. Each worker takes up
+    to batch_size queued emails at a time, merges the ones which go to the
+    same recipient into one email and sends them over its own connection,
+    retrying with a growing wait when the server can not be reached.
+    """
+    def __init__(self):
+        self.from_addr = cfg.CONF.email.from_addr
+        self.workers = cfg.CONF.email.workers
+        self.batch_size = cfg.CONF.email.batch_size
+        self.max_retry = cfg.CONF.email.max_retry
+        self.retry_interval = cfg.CONF.email.retry_interval
+        self._queue = Queue.Queue(cfg.CONF.email.queue_size)
+        self._stopped = threading.Event()
+        self._threads = []
+
+    def start(self):
+        for i in range(self.workers):
+            thread = threading.Thread(target=self._run)
+            thread.daemon = True
+            thread.start()
+            self._threads.append(thread)
+
+    def stop(self):
+        self._stopped.set()
+        for thread in self._threads:
+            thread.join()
+        self._threads = []
+
+    def send(self, to_addrs, subject, content, callback=None):
+        """Queue an email, return False if the queue is full.
+
+        callback, if given, is called from a worker with True once the
+        email has been delivered to all the addresses, or with False once
+        sending it to any of them was given up. It is not called when the
+        email could not be queued.
+        """
+        if callback is not None:
+            callback = _Completion(callback, len(to_addrs))
+        try:
+            self._queue.put_nowait((to_addrs, subject, content, callback))
+            return True
+        except Queue.Full:
+            LOG.error('Email queue is full, dropping email "%s" to %s' %
+                      (subject, to_addrs))
+            return False
+
+    def _take(self):
+        """Take the next batch of queued emails, [] if there is none."""
+        try:
+            emails = [self._queue.get(timeout=1)]
+        except Queue.Empty:
+            return []
+        while len(emails) < self.batch_size:
+            try:
+                emails.append(self._queue.get_nowait())
+            except Queue.Empty:
+                break
+        return emails
+
+    @staticmethod
+    def _merge(emails):
+        """Merge the emails by recipient.
+
+        Returns {addr: (subject, body, callbacks)}, the callbacks are the
+        ones of the emails merged.
+        """
+        by_addr = collections.OrderedDict()
+        for to_addrs, subject, content, callback in emails:
+            for addr in to_addrs:
+                by_addr.setdefault(addr, []).append(
+                    (subject, content, callback))
+
+        merged = collections.OrderedDict()
+        for addr, items in by_addr.items():
+            callbacks = [item[2] for item in items if item[2] is not None]
+            if len(items) == 1:
+                merged[addr] = (items[0][0], items[0][1], callbacks)
+            else:
+                subject = '%s (and %d more)' % (items[0][0], len(items) - 1)
+                body = '\n\n'.join('%s\n%s' % item[:2] for item in items)
+                merged[addr] = (subject, body, callbacks)
+        return merged
+
+    def _deliver(self, conn, addr, subject, body):
+        msg = email.mime.text.MIMEText(body)
+        msg['From'] = self.from_addr
+        msg['To'] = addr
+        msg['Subject'] = subject
+        msg = msg.as_string()
+        for retry in range(self.max_retry + 1):
+            try:
+                conn.sendmail(self.from_addr, [addr], msg)
+                return True
+            except smtplib.SMTPRecipientsRefused:
+                break
+            except Exception:
+                LOG.exception('Failed to send email to %s' % addr)
+            if retry < self.max_retry and not self._stopped.is_set():
+                time.sleep(self.retry_interval * 2 ** retry)
+        LOG.error('Giving up sending email "%s" to %s' % (subject, addr))
+        return False
+
+    def _run(self):
+        conn = SMTPConnection()
+        try:
+            while not self._stopped.is_set():
+                emails = self._take()
+                for addr, (subject, body, callbacks) in self._merge(
+                        emails).items():
+                    delivered = self._deliver(conn, addr, subject, body)
+                    for callback in callbacks:
+                        callback(delivered)
+        finally:
+            conn.close()
+
+
+class _Completion(object):
+    """Calls back once an email has been handled for all its addresses."""
+    def __init__(self, callback, count):
+        self._callback = callback
+        self._count = count
+        self._delivered = True
+        self._lock = threading.Lock()
+
+    def __call__(self, delivered):
+        with self._lock:
+            self._count -= 1
+            self._delivered = self._delivered and delivered
+            if self._count:
+                return
+        try:
+            self._callback(self._delivered)
+        except Exception:
+            LOG.exception('Email callback failed.')
+
+
+_sender = None
+_sender_lock = threading.Lock()
+
+
+def send_emails(to_addrs, subject, content, callback=None):
+    """Queue an email to the given addresses, it is sent in the background.
 
-def send_emails(to_addrs, subject, content):
-    """Used for development and testing."""
-    mail_username='monasca.notification@gmail.com'
-    mail_password='notification'
-    from_addr = mail_username
-
-    # HOST & PORT
-    HOST = 'smtp.gmail.com'
-    PORT = 25
-
-    # Create SMTP Object
-    smtp = smtplib.SMTP()
-    print 'connecting ...'
-
-    # show the debug log
-    smtp.set_debuglevel(1)
-
-    # connect
-
-    try:
-        print smtp.connect(HOST,PORT)
-    except:
-        print 'CONNECT ERROR ****'
-    # gmail uses ssl
-    smtp.starttls()
-    # login with username & password
-    try:
-        print 'loginning ...'
-        smtp.login(mail_username,mail_password)
-    except:
-        print 'LOGIN ERROR ****'
-    # fill content with MIMEText's object
-    msg = email.mime.text.MIMEText(content)
-    msg['From'] = from_addr
-    msg['To'] = ';'.join(to_addrs)
-    msg['Subject'] = subject
-    print msg.as_string()
-    smtp.sendmail(from_addr,to_addrs,msg.as_string())
-    smtp.quit()
\ No newline at end of file
+    See EmailSender.send for the callback.
+    """
+    global _sender
+    with _sender_lock:
+        if _sender is None:
+            _sender = EmailSender()
+            _sender.start()
+    return _sender.send(to_addrs, subject, content, callback)
@@ -14,11 +14,15 @@
 # License for the specific language governing permissions and limitations
 # under the License.
 
+import collections
 import datetime
 from oslo.config import cfg
 import requests
+import time
 import ujson as json
 
+from monasca.common import codec
+from monasca.common import instrument
 from monasca.common import strategy
 from monasca.openstack.common import log
 
@@ -37,12 +41,126 @@ OPTS = [
                 default=False,
                 help=('Specify if received data should be simply dropped. '
                       'This parameter is only for testing purposes.')),
+    cfg.IntOpt('bulk_size',
+               default=500,
+               help=('The maximum number of messages written to '
+                     'ElasticSearch with one bulk request.')),
+    cfg.FloatOpt('bulk_timeout',
+                 default=1.0,
+                 help=('The seconds to wait for more messages before a '
+                       'bulk request which is not full is sent.')),
 ]
 
 cfg.CONF.register_opts(OPTS, group="es")
 
 LOG = log.getLogger(__name__)
 
+BULK_SIZE = instrument.histogram(
+    'monasca_es_bulk_actions',
+    'Actions written with one bulk request.', ['doc_type'],
+    buckets=(1, 5, 10, 50, 100, 500, 1000, 5000))
+RESPONSE_TIME = instrument.histogram(
+    'monasca_es_response_seconds',
+    'Time ElasticSearch took to respond.', ['doc_type', 'op'])
+ERRORS = instrument.counter(
+    'monasca_es_errors_total',
+    'Requests to ElasticSearch which failed.', ['doc_type', 'op'])
+
+# The bulk action for each request type of the messages sent by the api.
+REQUEST_ACTIONS = {'POST': 'index',
+                   'PUT': 'index',
+                   'PATCH': 'update',
+                   'DEL': 'delete'}
+
+
+def _merge(doc, update):
+    """Merge a partial update into a document the way ElasticSearch does.
+
+    Objects are merged key by key at any depth, other values are replaced.
+    """
+    merged = dict(doc)
+    for key, value in update.items():
+        if isinstance(value, dict) and isinstance(merged.get(key), dict):
+            merged[key] = _merge(merged[key], value)
+        else:
+            merged[key] = value
+    return merged
+
+
+class BulkBatch(object):
+    """Write actions collected to be sent with one _bulk request.
+
+    Successive actions on the same document collapse so that only the last
+    write is sent: an index or a delete replaces whatever came before it,
+    an update is merged into the document of an earlier index or update,
+    and an update of a deleted document is dropped, as it would fail.
+    """
+    def __init__(self):
+        self._actions = collections.OrderedDict()
+
+    def __len__(self):
+        return len(self._actions)
+
+    def index(self, id, doc):
+        self._actions[id] = ('index', doc)
+
+    def update(self, id, doc):
+        prev = self._actions.get(id)
+        if prev and prev[0] == 'delete':
+            return
+        if prev:
+            self._actions[id] = (prev[0], _merge(prev[1], doc))
+        else:
+            self._actions[id] = ('update', doc)
+
+    def delete(self, id):
+        self._actions[id] = ('delete', None)
+
+    def add_request(self, msg):
+        """Add a message sent by the api, return its request type and id.
+
+        The message is a dict with the id of the document and the request
+        type, the rest of it is the document.
+        """
+        request_type = msg.pop('request', None)
+        id = msg.get('id')
+        action = REQUEST_ACTIONS.get(request_type)
+        if action is None or id is None:
+            LOG.error('Unknown request %s of document %s' %
+                      (request_type, id))
+            return None, None
+        if action == 'delete':
+            self.delete(id)
+        else:
+            getattr(self, action)(id, msg)
+        return request_type, id
+
+    def add_message(self, value):
+        """Decode a kafka message sent by the api and add its request.
+
+        A message which can not be decoded is logged and skipped, so that
+        it does not keep the rest of the batch from being written.
+        """
+        try:
+            msg = codec.decode(value)
+            if not isinstance(msg, dict):
+                raise ValueError('not a document')
+        except Exception:
+            LOG.exception('Invalid message %s' % value)
+            return None, None
+        return self.add_request(msg)
+
+    def body(self):
+        """Get the body of the _bulk request."""
+        lines = []
+        for id, (action, doc) in self._actions.items():
+            lines.append(json.dumps({action: {'_id': id}}))
+            if action == 'index':
+                lines.append(json.dumps(doc))
+            elif action == 'update':
+                lines.append(json.dumps({'doc': doc}))
+        return '\n'.join(lines) + '\n'
+
 
 class ESConnection(object):
 
@@ -60,6 +178,8 @@ class ESConnection(object):
         self.doc_type = doc_type
         self.time_id = cfg.CONF.es.time_id
         self.drop_data = cfg.CONF.es.drop_data
+        self.bulk_size = cfg.CONF.es.bulk_size
+        self.bulk_timeout = cfg.CONF.es.bulk_timeout
 
         self._index_strategy = strategy.IndexStrategy()
 
@@ -76,8 +196,14 @@ class ESConnection(object):
         if self.drop_data:
             return
         else:
+            start = time.time()
             res = requests.post(self.post_path, data=msg)
+            RESPONSE_TIME.labels(doc_type=self.doc_type, op='send').observe(
+                time.time() - start)
+            if res.status_code >= 300:
+                ERRORS.labels(doc_type=self.doc_type, op='send').inc()
             LOG.debug('Msg posted with response code: %s' % res.status_code)
+            return res
 
     def get_messages(self, cond):
         LOG.debug('Prepare to get messages.')
@@ -87,6 +213,65 @@ class ESConnection(object):
             LOG.debug('Search path:', path)
             requests.post(path, data=json.dumps(cond))
 
+    def scan(self, query, size, scroll='1m'):
+        """Get all the documents matching a query, page by page.
+
+        The documents are read with a scrolled search over all the indices
+        of the doc type, size documents per request.
+        """
+        if self.drop_data:
+            return
+        path = '%s%s*/%s/_search?scroll=%s&size=%d' % (
+            self.uri, self.index_prefix, self.doc_type, scroll, size)
+        scroll_id = None
+        try:
+            res = requests.post(path, data=json.dumps({'query': query}))
+            while True:
+                if res.status_code != 200:
+                    ERRORS.labels(doc_type=self.doc_type, op='scan').inc()
+                    LOG.error('Scan of %s failed with response code: %s' %
+                              (self.doc_type, res.status_code))
+                    return
+                obj = res.json() or {}
+                scroll_id = obj.get('_scroll_id', scroll_id)
+                hits = obj.get('hits', {}).get('hits', [])
+                if not hits:
+                    return
+                for hit in hits:
+                    yield hit
+                res = requests.post('%s_search/scroll?scroll=%s' %
+                                    (self.uri, scroll), data=scroll_id)
+        finally:
+            # the search context is kept until it times out otherwise
+            if scroll_id:
+                self._clear_scroll(scroll_id)
+
+    def _clear_scroll(self, scroll_id):
+        try:
+            requests.delete(self.uri + '_search/scroll', data=scroll_id)
+        except requests.RequestException:
+            LOG.exception('Failed to clear the scroll of %s', self.doc_type)
+
+    def search(self, body):
+        """Run a search without hits over all the indices of the doc type.
+
+        Returns the parsed response, None if the search failed.
+        """
+        if self.drop_data:
+            return None
+        path = '%s%s*/%s/_search?search_type=count' % (
+            self.uri, self.index_prefix, self.doc_type)
+        start = time.time()
+        res = requests.post(path, data=json.dumps(body))
+        RESPONSE_TIME.labels(doc_type=self.doc_type, op='search').observe(
+            time.time() - start)
+        if res.status_code != 200:
+            ERRORS.labels(doc_type=self.doc_type, op='search').inc()
+            LOG.error('Search of %s failed with response code: %s' %
+                      (self.doc_type, res.status_code))
+            return None
+        return res.json()
+
     def get_message_by_id(self, id):
         LOG.debug('Prepare to get messages by id.')
         if self.drop_data:
@@ -98,6 +283,22 @@ class ESConnection(object):
             LOG.debug('Msg get with response code: %s' % res.status_code)
             return res
 
+    def get_messages_by_ids(self, ids):
+        LOG.debug('Prepare to get messages by ids.')
+        if self.drop_data:
+            return ''
+        else:
+            # search all the indices, the documents may have been saved
+            # into an index other than the current one.
+            path = '%s%s*/%s/_search' % (self.uri, self.index_prefix,
+                                         self.doc_type)
+            body = {'query': {'ids': {'values': list(ids)}},
+                    'size': len(ids)}
+            LOG.debug('Search path:' + path)
+            res = requests.post(path, data=json.dumps(body))
+            LOG.debug('Msg get with response code: %s' % res.status_code)
+            return res
+
     def post_messages(self, msg, id):
         LOG.debug('Prepare to post messages.')
         if self.drop_data:
@@ -120,4 +321,29 @@ class ESConnection(object):
             return
         else:
             res = requests.delete(self.base_path + '/' + id)
-            LOG.debug('Msg delete with response code: %s' % res.status_code)
\ No newline at end of file
+            LOG.debug('Msg delete with response code: %s' % res.status_code)
+
+    def bulk_messages(self, batch):
+        LOG.debug('Prepare to send %d bulk actions.' % len(batch))
+        if self.drop_data or not len(batch):
+            return
+        else:
+            BULK_SIZE.labels(doc_type=self.doc_type).observe(len(batch))
+            start = time.time()
+            res = requests.post(self.base_path + '/_bulk', data=batch.body())
+            RESPONSE_TIME.labels(doc_type=self.doc_type, op='bulk').observe(
+                time.time() - start)
+            LOG.debug('Bulk post with response code: %s' % res.status_code)
+            if res.status_code != 200:
+                ERRORS.labels(doc_type=self.doc_type, op='bulk').inc()
+                LOG.error('Bulk request failed with response code: %s' %
+                          res.status_code)
+            elif (res.json() or {}).get('errors'):
+                ERRORS.labels(doc_type=self.doc_type, op='bulk').inc()
+                for item in res.json().get('items', []):
+                    for action, result in item.items():
+                        if result.get('error'):
+                            LOG.error('Failed to %s document %s: %s' %
+                                      (action, result.get('_id'),
+                                       result.get('error')))
+            return res
@@ -0,0 +1,474 @@
+# Copyright 2013 IBM Corp
+#
+# Author: Tong Li <litong01@us.ibm.com>
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+"""
+In process instrumentation of the services.
+
+Counters, gauges and histograms are registered by name and rendered in the
+prometheus text format, which every service serves at /metrics:
+
+    SENT = instrument.counter('monasca_kafka_messages_sent_total',
+                              'Messages sent to kafka.', ['topic'])
+    SENT.labels(topic='metrics').inc(10)
+
+Each process keeps its own metrics. The api serves requests from several
+pre-forked workers, so with multiprocess_dir set each worker writes its
+metrics to a file of that directory and /metrics serves the totals of all
+the workers, whichever of them answers.
+"""
+
+import bisect
+import contextlib
+import errno
+import functools
+import glob
+import json
+import os
+import threading
+import time
+from wsgiref import simple_server
+
+import falcon
+from oslo.config import cfg
+
+from monasca.common import resource_api
+from monasca.openstack.common import log
+
+
+instrument_opts = [
+    cfg.StrOpt('host', default='0.0.0.0',
+               help='The address the /metrics endpoint listens on.'),
+    cfg.IntOpt('port', default=0,
+               help=('The port of the /metrics endpoint of a micro '
+                     'service, 0 to not serve it.')),
+    cfg.StrOpt('multiprocess_dir', default='',
+               help=('A directory each worker process of the api writes '
+                     'its metrics to, so that /metrics serves the totals '
+                     'of all the workers. If not specified, /metrics only '
+                     'serves the metrics of the worker which answers.')),
+    cfg.FloatOpt('multiprocess_interval', default=1.0,
+                 help=('The seconds between two writes of the metrics of a '
+                       'worker to multiprocess_dir.')),
+]
+
+instrument_group = cfg.OptGroup(name='instrument', title='instrument')
+cfg.CONF.register_group(instrument_group)
+cfg.CONF.register_opts(instrument_opts, instrument_group)
+
+LOG = log.getLogger(__name__)
+
+CONTENT_TYPE = 'text/plain; version=0.0.4'
+
+# Upper bounds in seconds of the default histogram buckets.
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1,
+                   0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value))
+
+
+def _format_labels(names, values, extra=None):
+    pairs = zip(names, values)
+    if extra:
+        pairs.append(extra)
+    if not pairs:
+        return ''
+    return '{%s}' % ','.join(
+        '%s="%s"' % (k, str(v).replace('\\', '\\\\').replace('"', '\\"'))
+        for k, v in pairs)
+
+
+class _Metric(object):
+    """A named metric, one child holds the value of each set of labels."""
+    type = None
+
+    def __init__(self, name, help, labels=()):
+        self.name = name
+        self.help = help
+        self.label_names = tuple(labels)
+        self._lock = threading.Lock()
+        self._children = {}
+
+    def _label_values(self, values, kwargs):
+        if kwargs:
+            values = tuple(kwargs[name] for name in self.label_names)
+        if len(values) != len(self.label_names):
+            raise ValueError('Expected labels %s' % (self.label_names,))
+        return tuple(str(v) for v in values)
+
+    def labels(self, *values, **kwargs):
+        values = self._label_values(values, kwargs)
+        child = self._children.get(values)
+        if child is None:
+            with self._lock:
+                child = self._children.setdefault(values, self._new_child())
+        return child
+
+    def remove(self, *values, **kwargs):
+        """Remove the child of a set of labels which is no longer used."""
+        values = self._label_values(values, kwargs)
+        with self._lock:
+            self._children.pop(values, None)
+
+    def _default(self):
+        if self.label_names:
+            raise ValueError('Metric %s has labels %s' %
+                             (self.name, self.label_names))
+        return self.labels()
+
+    def _new_child(self):
+        raise NotImplementedError()
+
+    def render(self):
+        lines = ['# HELP %s %s' % (self.name, self.help),
+                 '# TYPE %s %s' % (self.name, self.type)]
+        for values, child in sorted(self._children.items()):
+            lines.extend(child.render(self.name, self.label_names, values))
+        return lines
+
+
+class _Value(object):
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.value = 0.0
+
+    def inc(self, amount=1):
+        with self._lock:
+            self.value += amount
+
+    def dec(self, amount=1):
+        with self._lock:
+            self.value -= amount
+
+    def set(self, value):
+        self.value = float(value)
+
+    def state(self):
+        return self.value
+
+    def merge(self, state):
+        self.inc(state)
+
+    def render(self, name, names, values):
+        return ['%s%s %s' % (name, _format_labels(names, values),
+                             _format_value(self.value))]
+
+
+class Counter(_Metric):
+    """A value which only goes up."""
+    type = 'counter'
+
+    def _new_child(self):
+        return _Value()
+
+    def inc(self, amount=1):
+        self._default().inc(amount)
+
+
+class Gauge(_Metric):
+    """A value which goes up and down."""
+    type = 'gauge'
+
+    def _new_child(self):
+        return _Value()
+
+    def inc(self, amount=1):
+        self._default().inc(amount)
+
+    def dec(self, amount=1):
+        self._default().dec(amount)
+
+    def set(self, value):
+        self._default().set(value)
+
+
+class _HistogramValue(object):
+    def __init__(self, buckets):
+        self._lock = threading.Lock()
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+
+    def observe(self, value):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            self.counts[index] += 1
+            self.sum += value
+
+    def state(self):
+        with self._lock:
+            return {'counts': list(self.counts), 'sum': self.sum}
+
+    def merge(self, state):
+        counts = state['counts']
+        if len(counts) != len(self.counts):
+            return
+        with self._lock:
+            self.counts = [a + b for a, b in zip(self.counts, counts)]
+            self.sum += state['sum']
+
+    @contextlib.contextmanager
+    def time(self):
+        start = time.time()
+        try:
+            yield
+        finally:
+            self.observe(time.time() - start)
+
+    def render(self, name, names, values):
+        lines = []
+        total = 0
+        bounds = self.buckets + (float('inf'),)
+        for bound, count in zip(bounds, self.counts):
+            total += count
+            lines.append('%s_bucket%s %d' % (
+                name, _format_labels(names, values,
+                                     ('le', _format_value(bound))),
+                total))
+        labels = _format_labels(names, values)
+        lines.append('%s_sum%s %s' % (name, labels, _format_value(self.sum)))
+        lines.append('%s_count%s %d' % (name, labels, total))
+        return lines
+
+
+class Histogram(_Metric):
+    """Counts of observed values in fixed buckets, plus their sum."""
+    type = 'histogram'
+
+    def __init__(self, name, help, labels=(), buckets=DEFAULT_BUCKETS):
+        super(Histogram, self).__init__(name, help, labels)
+        self.buckets = tuple(sorted(buckets))
+
+    def _new_child(self):
+        return _HistogramValue(self.buckets)
+
+    def observe(self, value):
+        self._default().observe(value)
+
+    def time(self):
+        return self._default().time()
+
+
+class Registry(object):
+    """The metrics of a process, registering a name twice returns the
+    metric registered first.
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._metrics = {}
+
+    def register(self, cls, name, help, labels=(), **kwargs):
+        with self._lock:
+            metric = self._metrics.get(name)
+            if metric is None:
+                metric = cls(name, help, labels, **kwargs)
+                self._metrics[name] = metric
+            elif not isinstance(metric, cls):
+                raise ValueError('Metric %s is a %s' % (name, metric.type))
+            return metric
+
+    def render(self):
+        lines = []
+        for name in sorted(self._metrics):
+            lines.extend(self._metrics[name].render())
+        return '\n'.join(lines) + '\n'
+
+    def snapshot(self):
+        """Get the state of all the metrics, for another registry to merge.
+        """
+        metrics = []
+        for name, metric in sorted(self._metrics.items()):
+            with metric._lock:
+                children = list(metric._children.items())
+            metrics.append({
+                'name': name, 'type': metric.type, 'help': metric.help,
+                'labels': list(metric.label_names),
+                'buckets': list(getattr(metric, 'buckets', ())),
+                'children': [[list(values), child.state()]
+                             for values, child in children]})
+        return metrics
+
+    def merge(self, snapshot, gauges=True):
+        """Add the values of a snapshot to the metrics of the registry.
+
+        With gauges False, the gauges of the snapshot are left out.
+        """
+        for item in snapshot:
+            cls = _TYPES.get(item['type'])
+            if cls is None or (cls is Gauge and not gauges):
+                continue
+            kwargs = {}
+            if cls is Histogram:
+                kwargs['buckets'] = item['buckets']
+            try:
+                metric = self.register(cls, item['name'], item['help'],
+                                       item['labels'], **kwargs)
+            except ValueError:
+                LOG.error('Metric %s is of another type', item['name'])
+                continue
+            for values, state in item['children']:
+                metric.labels(*values).merge(state)
+
+
+_TYPES = {'counter': Counter, 'gauge': Gauge, 'histogram': Histogram}
+
+REGISTRY = Registry()
+
+# the process which writes its metrics to multiprocess_dir
+_multiprocess_pid = None
+
+
+def counter(name, help, labels=()):
+    return REGISTRY.register(Counter, name, help, labels)
+
+
+def gauge(name, help, labels=()):
+    return REGISTRY.register(Gauge, name, help, labels)
+
+
+def histogram(name, help, labels=(), buckets=DEFAULT_BUCKETS):
+    return REGISTRY.register(Histogram, name, help, labels, buckets=buckets)
+
+
+def timed(metric, **labels):
+    """Decorator which observes the run time of a function."""
+    def decorator(func):
+        child = metric.labels(**labels)
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with child.time():
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def _alive(pid):
+    try:
+        os.kill(pid, 0)
+    except OSError as e:
+        return e.errno == errno.EPERM
+    return True
+
+
+def write_snapshot(directory):
+    """Write the metrics of this process to its file in a directory."""
+    path = os.path.join(directory, '%d.json' % os.getpid())
+    with open(path + '.tmp', 'w') as f:
+        json.dump(REGISTRY.snapshot(), f)
+    os.rename(path + '.tmp', path)
+
+
+def clear_multiprocess():
+    """Delete the metrics written by the processes of an earlier run."""
+    directory = cfg.CONF.instrument.multiprocess_dir
+    if not directory:
+        return
+    for path in glob.glob(os.path.join(directory, '*.json')):
+        os.remove(path)
+
+
+def start_multiprocess():
+    """Write the metrics of this process to multiprocess_dir periodically.
+
+    It is called by each worker after the fork. The files of the workers
+    which exited are kept, so that the totals of the counters do not go
+    down, their gauges are left out.
+    """
+    global _multiprocess_pid
+    directory = cfg.CONF.instrument.multiprocess_dir
+    if not directory or _multiprocess_pid == os.getpid():
+        return
+    _multiprocess_pid = os.getpid()
+    interval = cfg.CONF.instrument.multiprocess_interval
+
+    def _run():
+        while True:
+            try:
+                write_snapshot(directory)
+            except Exception:
+                LOG.exception('Failed to write the metrics to %s', directory)
+            time.sleep(interval)
+    thread = threading.Thread(target=_run)
+    thread.daemon = True
+    thread.start()
+
+
+def render():
+    """Render the metrics of this process, or of all the processes which
+    write their metrics to multiprocess_dir.
+    """
+    directory = cfg.CONF.instrument.multiprocess_dir
+    if not directory or _multiprocess_pid != os.getpid():
+        return REGISTRY.render()
+    write_snapshot(directory)
+    merged = Registry()
+    for path in sorted(glob.glob(os.path.join(directory, '*.json'))):
+        try:
+            pid = int(os.path.basename(path)[:-len('.json')])
+            with open(path) as f:
+                snapshot = json.load(f)
+        except (IOError, ValueError):
+            LOG.exception('Failed to read the metrics of %s', path)
+            continue
+        merged.merge(snapshot, gauges=_alive(pid))
+    return merged.render()
+
+
+class MetricsResource(object):
+    """Serves the metrics of the process from the api."""
+    @resource_api.Restify('/metrics', method='get')
+    def do_get_metrics(self, req, res):
+        res.body = render()
+        res.content_type = CONTENT_TYPE
+        res.status = falcon.HTTP_200
+
+
+def metrics_app(environ, start_response):
+    """A wsgi application which serves the metrics at /metrics."""
+    if environ.get('PATH_INFO', '/') not in ('/', '/metrics'):
+        start_response('404 Not Found', [('Content-Type', 'text/plain')])
+        return ['Not Found\n']
+    body = render()
+    start_response('200 OK', [('Content-Type', CONTENT_TYPE),
+                              ('Content-Length', str(len(body)))])
+    return [body]
+
+
+class _QuietHandler(simple_server.WSGIRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+
+def start_server(host=None, port=None):
+    """Serve /metrics from a background thread.
+
+    :returns: the server, or None if no port is configured.
+    """
+    host = host or cfg.CONF.instrument.host
+    port = cfg.CONF.instrument.port if port is None else port
+    if not port:
+        return None
+    httpd = simple_server.make_server(host, port, metrics_app,
+                                      handler_class=_QuietHandler)
+    thread = threading.Thread(target=httpd.serve_forever)
+    thread.daemon = True
+    thread.start()
+    LOG.info('Serving /metrics at %s:%s' % (host, httpd.server_port))
+    return httpd
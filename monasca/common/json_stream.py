@@ -0,0 +1,127 @@
+# Copyright 2013 IBM Corp
+#
+# Author: Tong Li <litong01@us.ibm.com>
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+import json
+
+
+WHITESPACE = ' \t\n\r'
+
+
+class TooLarge(Exception):
+    """The stream is larger than the allowed size."""
+    pass
+
+
+class ItemReader(object):
+    """Reads the items of a json array from a stream one by one.
+
+    Only the bytes of the item being decoded are held in memory, so a large
+    array of small items can be consumed without loading the whole body. If
+    the stream holds a single json object instead of an array, that object
+    is the only item.
+
+    :param stream: file like object which supports read(size).
+    :param length: number of bytes to read from the stream, None to read
+        until the stream is exhausted.
+    :param max_size: maximum number of bytes allowed, 0 for no limit.
+    :param read_size: number of bytes to read from the stream at a time.
+    """
+    def __init__(self, stream, length=None, max_size=0, read_size=65536):
+        if max_size and length and length > max_size:
+            raise TooLarge('Body of %d bytes is larger than %d bytes.' %
+                           (length, max_size))
+        self.stream = stream
+        self.remaining = length
+        self.max_size = max_size
+        self.read_size = read_size
+        self.total = 0
+        self.eof = False
+        self.buf = ''
+        self.pos = 0
+        self._decoder = json.JSONDecoder()
+
+    def _read(self):
+        """Append the next piece of the stream to the buffer."""
+        size = self.read_size
+        if self.remaining is not None:
+            size = min(size, self.remaining)
+        data = self.stream.read(size) if size > 0 else ''
+        if not data:
+            self.eof = True
+            return False
+
+        self.total += len(data)
+        if self.remaining is not None:
+            self.remaining -= len(data)
+        if self.max_size and self.total > self.max_size:
+            raise TooLarge('Body is larger than %d bytes.' % self.max_size)
+
+        # drop what has been consumed before growing the buffer
+        self.buf = self.buf[self.pos:] + data
+        self.pos = 0
+        return True
+
+    def _next_char(self):
+        """Skip whitespaces and return the next char, '' at the end."""
+        while True:
+            while (self.pos < len(self.buf) and
+                    self.buf[self.pos] in WHITESPACE):
+                self.pos += 1
+            if self.pos < len(self.buf):
+                return self.buf[self.pos]
+            if not self._read():
+                return ''
+
+    def _decode(self):
+        """Decode the json value which starts at the next position."""
+        if not self._next_char():
+            raise ValueError('No json object could be decoded')
+        while True:
+            try:
+                value, end = self._decoder.raw_decode(self.buf, self.pos)
+                # a number at the end of the buffer may continue in the
+                # next piece of the stream
+                if (end < len(self.buf) or self.eof or
+                        isinstance(value, (dict, list)) or
+                        not self._read()):
+                    self.pos = end
+                    return value
+            except ValueError:
+                if not self._read():
+                    raise
+
+    def __iter__(self):
+        char = self._next_char()
+        if char != '[':
+            yield self._decode()
+            if self._next_char():
+                raise ValueError('Extra data after json object')
+            return
+
+        self.pos += 1
+        if self._next_char() == ']':
+            self.pos += 1
+        else:
+            while True:
+                yield self._decode()
+                char = self._next_char()
+                self.pos += 1
+                if char == ']':
+                    break
+                if char != ',':
+                    raise ValueError('Expecting , delimiter')
+        if self._next_char():
+            raise ValueError('Extra data after json array')
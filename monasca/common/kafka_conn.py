@@ -14,6 +14,9 @@
 # License for the specific language governing permissions and limitations
 # under the License.
 
+import logging
+import os
+import threading
 import time
 
 from kafka import client
@@ -28,12 +31,15 @@ try:
 except ImportError:
     import json
 
+from monasca.common import instrument
+from monasca.common import memory_kafka
 from monasca.openstack.common import log
 
 
 kafka_opts = [
     cfg.StrOpt('uri', help='Address to kafka server. For example: '
-               'uri=192.168.1.191:9092'),
+               'uri=192.168.1.191:9092. Use memory://<name> to keep the '
+               'messages in process instead, for testing purposes.'),
     cfg.StrOpt('group', default='api',
                help='The group name that this service belongs to.'),
     cfg.IntOpt('wait_time', default=1,
@@ -63,10 +69,23 @@ cfg.CONF.register_opts(kafka_opts, kafka_group)
 
 LOG = log.getLogger(__name__)
 
+MESSAGES_IN = instrument.counter(
+    'monasca_kafka_messages_received_total',
+    'Messages received from kafka.', ['topic'])
+MESSAGES_OUT = instrument.counter(
+    'monasca_kafka_messages_sent_total',
+    'Messages sent to kafka.', ['topic'])
+SEND_TIME = instrument.histogram(
+    'monasca_kafka_send_seconds',
+    'Time spent sending messages to kafka.', ['topic'])
+SEND_ERRORS = instrument.counter(
+    'monasca_kafka_send_errors_total',
+    'Requests to send messages to kafka which failed.', ['topic'])
+
 
 class KafkaConnection(object):
 
-    def __init__(self, topic):
+    def __init__(self, topic, group=None, auto_commit=None):
         if not cfg.CONF.kafka_opts.uri:
             raise Exception('Kafka is not configured correctly! '
                             'Use configuration file to specify Kafka '
@@ -75,22 +94,52 @@ class KafkaConnection(object):
 
         self.uri = cfg.CONF.kafka_opts.uri
         self.topic = topic
-        self.group = cfg.CONF.kafka_opts.group
+        self.group = group or cfg.CONF.kafka_opts.group
         self.wait_time = cfg.CONF.kafka_opts.wait_time
         self.async = cfg.CONF.kafka_opts.async
         self.ack_time = cfg.CONF.kafka_opts.ack_time
         self.max_retry = cfg.CONF.kafka_opts.max_retry
-        self.auto_commit = cfg.CONF.kafka_opts.auto_commit
+        self.auto_commit = (cfg.CONF.kafka_opts.auto_commit
+                            if auto_commit is None else auto_commit)
         self.compact = cfg.CONF.kafka_opts.compact
         self.partitions = cfg.CONF.kafka_opts.partitions
         self.drop_data = cfg.CONF.kafka_opts.drop_data
 
+        # memory:// uris are served by the in process stand-in of kafka
+        if memory_kafka.is_memory_uri(self.uri):
+            self._client_cls = memory_kafka.MemoryClient
+            self._consumer_cls = memory_kafka.MemoryConsumer
+            self._producer_cls = memory_kafka.MemoryProducer
+            self.wait_time = 0
+        else:
+            self._client_cls = client.KafkaClient
+            self._consumer_cls = consumer.SimpleConsumer
+            self._producer_cls = producer.SimpleProducer
+
         self._client = None
         self._consumer = None
         self._producer = None
+        self._pid = os.getpid()
+        # offsets handed in by other threads, committed by the one consuming
+        self._lock = threading.Lock()
+        self._pending_offsets = {}
+
+        self._messages_in = MESSAGES_IN.labels(topic=topic)
+        self._messages_out = MESSAGES_OUT.labels(topic=topic)
+        self._send_time = SEND_TIME.labels(topic=topic)
+        self._send_errors = SEND_ERRORS.labels(topic=topic)
 
         LOG.debug('Kafka Connection initialized successfully!')
 
+    def _check_fork(self):
+        # the sockets of a client created before a fork are shared with the
+        # parent process, a forked process connects on its own instead.
+        if self._pid != os.getpid():
+            self._pid = os.getpid()
+            self._client = None
+            self._consumer = None
+            self._producer = None
+
     def _init_client(self, wait_time=None):
         for i in range(self.max_retry):
             try:
@@ -104,7 +153,7 @@ class KafkaConnection(object):
                     wait_time = self.wait_time
                 time.sleep(wait_time)
 
-                self._client = client.KafkaClient(self.uri)
+                self._client = self._client_cls(self.uri)
 
                 # when a client is re-initialized, existing consumer should be
                 # reset as well.
@@ -127,7 +176,7 @@ class KafkaConnection(object):
         try:
             if not self._client:
                 self._init_client()
-            self._consumer = consumer.SimpleConsumer(
+            self._consumer = self._consumer_cls(
                 self._client, self.group, self.topic,
                 auto_commit=self.auto_commit,
                 partitions=self.partitions)
@@ -141,7 +190,7 @@ class KafkaConnection(object):
         try:
             if not self._client:
                 self._init_client()
-            self._producer = producer.SimpleProducer(
+            self._producer = self._producer_cls(
                 self._client, async=self.async, ack_timeout=self.ack_time)
             LOG.debug('Producer was created successfully.')
         except Exception:
@@ -149,10 +198,58 @@ class KafkaConnection(object):
             LOG.exception('Kafka (%s) producer can not be created.' %
                           self.uri)
 
+    def seek(self, offset, whence):
+        """Move the consumer offset messages from whence.
+
+        whence is 0 for the oldest message kept, 1 for the current position
+        and 2 for the end of the topic.
+        """
+        self._check_fork()
+        if not self._consumer:
+            self._init_consumer()
+        if self._consumer:
+            self._consumer.seek(offset, whence)
+
     def commit(self):
-        if self._consumer and self.auto_commit:
+        """Commit the offsets of the messages consumed so far.
+
+        The consumer is not thread safe, this is only called from the
+        thread consuming the messages, other threads use commit_offsets.
+        """
+        if self._consumer:
             self._consumer.commit()
 
+    def offsets(self):
+        """Get the offsets of the messages consumed so far by partition."""
+        if self._consumer:
+            return dict(self._consumer.offsets)
+        return {}
+
+    def commit_offsets(self, offsets):
+        """Commit offsets by partition, from any thread.
+
+        The offsets are committed by the thread consuming the messages
+        before it fetches the next batch.
+        """
+        with self._lock:
+            self._pending_offsets.update(offsets)
+
+    def _commit_pending(self):
+        with self._lock:
+            offsets, self._pending_offsets = self._pending_offsets, {}
+        if not offsets or not self._client:
+            return
+        reqs = [common.OffsetCommitRequest(self.topic, partition, offset,
+                                           None)
+                for partition, offset in sorted(offsets.items())]
+        try:
+            for resp in self._client.send_offset_commit_request(self.group,
+                                                                reqs):
+                common.check_error(resp)
+        except Exception:
+            LOG.exception('Failed to commit offsets %s of topic %s.',
+                          offsets, self.topic)
+
     def close(self):
         if self._client:
             self._consumer = None
@@ -160,13 +257,17 @@ class KafkaConnection(object):
             self._client.close()
 
     def get_messages(self):
+        self._check_fork()
         try:
             if not self._consumer:
                 self._init_consumer()
 
+            debug = LOG.isEnabledFor(logging.DEBUG)
             for msg in self._consumer:
                 if msg.message:
-                    LOG.debug(msg.message.value)
+                    self._messages_in.inc()
+                    if debug:
+                        LOG.debug('Message received: %s', msg.message.value)
                     yield msg
         except common.OffsetOutOfRangeError:
             self._consumer.seek(0, 0)
@@ -177,23 +278,59 @@ class KafkaConnection(object):
             self._consumer = None
             yield None
 
+    def get_message_batches(self, size, timeout):
+        """Get messages in lists of at most size messages.
+
+        A list is returned as soon as it is full or when no more messages
+        arrive within timeout seconds, an empty list is returned when there
+        were no messages at all.
+        """
+        self._check_fork()
+        try:
+            if not self._consumer:
+                self._init_consumer()
+
+            while True:
+                self._commit_pending()
+                msgs = self._consumer.get_messages(count=size, block=True,
+                                                   timeout=timeout)
+                self._messages_in.inc(len(msgs))
+                yield msgs
+        except common.OffsetOutOfRangeError:
+            self._consumer.seek(0, 0)
+            LOG.error('Seems consumer has been down for a long time.')
+            yield []
+        except Exception:
+            LOG.exception('Error occurred while getting messages.')
+            self._consumer = None
+            yield []
+
     def send_messages(self, messages):
         LOG.debug('Prepare to send messages.')
         if not messages or self.drop_data:
             return 204
 
         code = 400
+        start = time.time()
+        sent = 1
+        self._check_fork()
         try:
             if not self._producer:
                 self._init_producer()
 
             LOG.debug('Start sending messages to kafka.')
-            if self.compact:
+            if isinstance(messages, list):
+                # A list holds messages which have been serialized already,
+                # send them all in one request.
+                self._producer.send_messages(self.topic, *messages)
+                sent = len(messages)
+            elif self.compact:
                 self._producer.send_messages(self.topic, messages)
             else:
                 data = json.loads(messages)
                 LOG.debug('Msg parsed successfully.')
                 if isinstance(data, list):
+                    sent = len(data)
                     for item in data:
                         self._producer.send_messages(
                             self.topic, json.dumps(item))
@@ -201,6 +338,7 @@ class KafkaConnection(object):
                     self._producer.send_messages(self.topic, messages)
             LOG.debug('Message posted successfully.')
             code = 204
+            self._messages_out.inc(sent)
         except (common.KafkaUnavailableError,
                 common.LeaderNotAvailableError):
             self._client = None
@@ -213,4 +351,7 @@ class KafkaConnection(object):
             code = 500
             LOG.exception('Unknown error.')
 
+        self._send_time.observe(time.time() - start)
+        if code != 204:
+            self._send_errors.inc()
         return code
\ No newline at end of file
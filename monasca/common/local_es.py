@@ -0,0 +1,663 @@
+# Copyright 2013 IBM Corp
+#
+# Author: Tong Li <litong01@us.ibm.com>
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+"""
+A local stand-in of ElasticSearch which keeps the documents in memory.
+
+It serves the subset of the ElasticSearch http api the services use, so
+that they can be run and load tested without an ElasticSearch server:
+
+* index, get and delete of single documents
+* _bulk with index, create, update and delete actions
+* _mget
+* _search with the match_all, match, term, terms, ids, range, wildcard,
+  regexp and bool queries, q=field:value, sort, size and the filter, terms,
+  top_hits, date_histogram, stats, min, max, avg, sum and value_count
+  aggregations
+* _mapping(s) derived from the documents, index and template creation
+
+Index names of searches may end with *. It can be started on its own:
+
+    python -m monasca.common.local_es --port 9200
+
+or in process with LocalES().start(), which returns its uri.
+"""
+
+import argparse
+import BaseHTTPServer
+import collections
+import fnmatch
+import re
+import SocketServer
+import threading
+import urlparse
+import uuid
+
+try:
+    import ujson as json
+except ImportError:
+    import json
+
+from monasca.openstack.common import log
+
+
+LOG = log.getLogger(__name__)
+
+DEFAULT_SIZE = 10
+
+
+class NotFound(Exception):
+    pass
+
+
+def _get_field(source, field):
+    """Get the value of a dotted field of a document, None if missing."""
+    value = source
+    for key in field.split('.'):
+        if not isinstance(value, dict) or key not in value:
+            return None
+        value = value[key]
+    return value
+
+
+def _values(source, field):
+    value = _get_field(source, field)
+    if value is None:
+        return []
+    return value if isinstance(value, list) else [value]
+
+
+def _same(a, b, analyzed):
+    if analyzed and isinstance(a, basestring) and isinstance(b, basestring):
+        return a.lower() == b.lower()
+    if isinstance(a, basestring) != isinstance(b, basestring):
+        try:
+            return float(a) == float(b)
+        except (TypeError, ValueError):
+            return False
+    return a == b
+
+
+def _interval(interval):
+    """Get the seconds of a date_histogram interval like 300s or 1h."""
+    units = {'s': 1, 'm': 60, 'h': 3600, 'd': 86400, 'w': 604800}
+    if isinstance(interval, (int, long, float)):
+        return float(interval) / 1000
+    interval = interval.strip()
+    names = {'second': '1s', 'minute': '1m', 'hour': '1h', 'day': '1d',
+             'week': '1w'}
+    interval = names.get(interval, interval)
+    if interval[-1] in units:
+        return float(interval[:-1]) * units[interval[-1]]
+    return float(interval) / 1000
+
+
+class Store(object):
+    """The documents, by index, type and id."""
+    def __init__(self):
+        self.lock = threading.RLock()
+        self.indices = collections.OrderedDict()
+        self.templates = {}
+
+    def _docs(self, index, doc_type):
+        types = self.indices.setdefault(index, collections.OrderedDict())
+        return types.setdefault(doc_type, collections.OrderedDict())
+
+    def index(self, index, doc_type, id, source):
+        with self.lock:
+            id = id or uuid.uuid4().hex
+            docs = self._docs(index, doc_type)
+            created = id not in docs
+            docs[id] = source
+            return id, created
+
+    def update(self, index, doc_type, id, doc, upsert=None):
+        with self.lock:
+            docs = self._docs(index, doc_type)
+            if id not in docs:
+                if upsert is None:
+                    raise NotFound(id)
+                docs[id] = dict(upsert)
+            else:
+                docs[id] = dict(docs[id], **doc)
+            return docs[id]
+
+    def get(self, index, doc_type, id):
+        with self.lock:
+            return self.indices.get(index, {}).get(doc_type, {}).get(id)
+
+    def delete(self, index, doc_type, id):
+        with self.lock:
+            docs = self.indices.get(index, {}).get(doc_type, {})
+            return docs.pop(id, None) is not None
+
+    def create_index(self, index):
+        with self.lock:
+            self.indices.setdefault(index, collections.OrderedDict())
+
+    def _match_indices(self, patterns):
+        names = []
+        for pattern in patterns.split(','):
+            if pattern in ('_all', '*', ''):
+                names.extend(self.indices)
+            elif pattern.endswith('*'):
+                names.extend(i for i in self.indices
+                             if i.startswith(pattern[:-1]))
+            elif pattern in self.indices:
+                names.append(pattern)
+        return names
+
+    def docs(self, patterns, doc_type=None):
+        """Get (index, type, id, source) of the documents to search."""
+        with self.lock:
+            result = []
+            for index in self._match_indices(patterns):
+                for t, docs in self.indices[index].items():
+                    if doc_type in (None, '', '_all') or t in \
+                            doc_type.split(','):
+                        result.extend((index, t, id, source)
+                                      for id, source in docs.items())
+            return result
+
+    def mapping(self, patterns, doc_type=None):
+        def _props(value):
+            if isinstance(value, dict):
+                return {'properties': dict((k, _props(v))
+                                           for k, v in value.items())}
+            if isinstance(value, bool):
+                return {'type': 'boolean'}
+            if isinstance(value, (int, long)):
+                return {'type': 'long'}
+            if isinstance(value, float):
+                return {'type': 'double'}
+            return {'type': 'string'}
+
+        def _merge(a, b):
+            for k, v in b.items():
+                if k in a and 'properties' in a[k] and 'properties' in v:
+                    _merge(a[k]['properties'], v['properties'])
+                else:
+                    a.setdefault(k, v)
+
+        with self.lock:
+            result = {}
+            for index in self._match_indices(patterns):
+                mappings = {}
+                for t, docs in self.indices[index].items():
+                    if doc_type and t not in doc_type.split(','):
+                        continue
+                    props = {}
+                    for source in docs.values():
+                        _merge(props, _props(source)['properties'])
+                    mappings[t] = {'properties': props}
+                result[index] = {'mappings': mappings}
+            return result
+
+
+class Search(object):
+    """Runs a search request body over a list of documents."""
+
+    def __init__(self, docs):
+        self.docs = docs
+
+    def match(self, query, hit):
+        index, doc_type, id, source = hit
+        if not query or 'match_all' in query:
+            return True
+        if 'bool' in query:
+            q = query['bool']
+
+            def _list(clauses):
+                if clauses is None:
+                    return []
+                return clauses if isinstance(clauses, list) else [clauses]
+            if not all(self.match(c, hit) for c in
+                       _list(q.get('must')) + _list(q.get('filter'))):
+                return False
+            if any(self.match(c, hit) for c in _list(q.get('must_not'))):
+                return False
+            should = _list(q.get('should'))
+            return not should or any(self.match(c, hit) for c in should)
+        if 'ids' in query:
+            return id in query['ids'].get('values', [])
+        for kind in ('match', 'term', 'terms'):
+            if kind in query:
+                (field, expected), = query[kind].items()
+                if isinstance(expected, dict):
+                    expected = expected.get('query', expected.get('value'))
+                if kind != 'terms':
+                    expected = [expected]
+                values = [id] if field == '_id' else _values(source, field)
+                return any(_same(v, e, kind == 'match')
+                           for v in values for e in expected)
+        if 'wildcard' in query:
+            (field, pattern), = query['wildcard'].items()
+            if isinstance(pattern, dict):
+                pattern = pattern.get('value', pattern.get('wildcard'))
+            # the strings are not analyzed, the match is case sensitive
+            return any(isinstance(v, basestring) and
+                       fnmatch.fnmatchcase(v, pattern)
+                       for v in _values(source, field))
+        if 'regexp' in query:
+            (field, pattern), = query['regexp'].items()
+            if isinstance(pattern, dict):
+                pattern = pattern.get('value')
+            # the regexp has to match the whole string
+            regexp = re.compile(u'(?:%s)\\Z' % pattern, re.UNICODE)
+            return any(isinstance(v, basestring) and regexp.match(v)
+                       for v in _values(source, field))
+        if 'range' in query:
+            (field, bounds), = query['range'].items()
+            for value in _values(source, field):
+                if all(self._in_bound(value, op, bound)
+                       for op, bound in bounds.items()):
+                    return True
+            return False
+        if 'query_string' in query:
+            return self.match_q(query['query_string'].get('query', ''), hit)
+        LOG.error('Query %s is not supported' % query)
+        return False
+
+    @staticmethod
+    def _in_bound(value, op, bound):
+        checks = {'gt': lambda a, b: a > b, 'gte': lambda a, b: a >= b,
+                  'lt': lambda a, b: a < b, 'lte': lambda a, b: a <= b}
+        check = checks.get(op)
+        return check is None or check(value, bound)
+
+    def match_q(self, q, hit):
+        """Match the field:value terms of q, all of them have to match."""
+        for term in q.replace(' AND ', ' ').split():
+            if ':' not in term:
+                continue
+            field, value = term.split(':', 1)
+            if not self.match({'match': {field: value}}, hit):
+                return False
+        return True
+
+    @staticmethod
+    def render_hit(hit, source_filter=None):
+        index, doc_type, id, source = hit
+        if isinstance(source_filter, dict):
+            include = source_filter.get('include') or source_filter.get(
+                'includes')
+            exclude = source_filter.get('exclude') or source_filter.get(
+                'excludes') or []
+            if include:
+                source = dict((k, v) for k, v in source.items()
+                              if k in include)
+            source = dict((k, v) for k, v in source.items()
+                          if k not in exclude)
+        elif source_filter is False:
+            source = None
+        rendered = {'_index': index, '_type': doc_type, '_id': id,
+                    '_score': 1.0}
+        if source is not None:
+            rendered['_source'] = source
+        return rendered
+
+    @staticmethod
+    def sort(hits, sort):
+        if not sort:
+            return hits
+        if not isinstance(sort, list):
+            sort = [sort]
+        for clause in reversed(sort):
+            if isinstance(clause, basestring):
+                field, order = clause, 'asc'
+            else:
+                (field, order), = clause.items()
+                if isinstance(order, dict):
+                    order = order.get('order', 'asc')
+            hits = sorted(hits, key=lambda h: _get_field(h[3], field),
+                          reverse=(order == 'desc'))
+        return hits
+
+    def aggregate(self, aggs, hits):
+        result = {}
+        for name, agg in (aggs or {}).items():
+            sub = agg.get('aggs') or agg.get('aggregations')
+            if 'filter' in agg:
+                matched = [h for h in hits if self.match(agg['filter'], h)]
+                result[name] = {'doc_count': len(matched)}
+                result[name].update(self.aggregate(sub, matched))
+            elif 'terms' in agg:
+                result[name] = self._terms(agg['terms'], sub, hits)
+            elif 'date_histogram' in agg:
+                result[name] = self._histogram(agg['date_histogram'], sub,
+                                               hits)
+            elif 'top_hits' in agg:
+                top = agg['top_hits']
+                sorted_hits = self.sort(hits, top.get('sort'))
+                result[name] = {'hits': {
+                    'total': len(hits),
+                    'hits': [self.render_hit(h, top.get('_source'))
+                             for h in sorted_hits[:top.get('size', 3)]]}}
+            else:
+                (kind, params), = agg.items()
+                values = [v for h in hits
+                          for v in _values(h[3], params['field'])]
+                result[name] = self._metric(kind, values)
+        return result
+
+    def _bucket(self, key, hits, sub):
+        bucket = {'key': key, 'doc_count': len(hits)}
+        bucket.update(self.aggregate(sub, hits))
+        return bucket
+
+    def _terms(self, params, sub, hits):
+        groups = collections.OrderedDict()
+        for hit in hits:
+            for value in set(_values(hit[3], params['field'])):
+                groups.setdefault(value, []).append(hit)
+        keys = sorted(groups, key=lambda k: (-len(groups[k]), k))
+        size = params.get('size', DEFAULT_SIZE) or len(keys)
+        return {'buckets': [self._bucket(k, groups[k], sub)
+                            for k in keys[:size]]}
+
+    def _histogram(self, params, sub, hits):
+        interval = _interval(params.get('interval', '1h'))
+        offset = _interval(params.get('offset', 0))
+        groups = collections.defaultdict(list)
+        for hit in hits:
+            for value in _values(hit[3], params['field']):
+                key = (value - offset) // interval * interval + offset
+                groups[key].append(hit)
+        return {'buckets': [self._bucket(k, groups[k], sub)
+                            for k in sorted(groups)]}
+
+    @staticmethod
+    def _metric(kind, values):
+        values = [float(v) for v in values
+                  if isinstance(v, (int, long, float))]
+        count = len(values)
+        stats = {'count': count,
+                 'min': min(values) if values else None,
+                 'max': max(values) if values else None,
+                 'sum': sum(values) if values else 0.0,
+                 'avg': sum(values) / count if values else None}
+        if kind in ('stats', 'extended_stats'):
+            return stats
+        if kind == 'value_count':
+            return {'value': count}
+        return {'value': stats.get(kind)}
+
+    def run(self, body, params):
+        body = body or {}
+        hits = self.docs
+        if params.get('q'):
+            hits = [h for h in hits if self.match_q(params['q'], h)]
+        query = body.get('query')
+        if query:
+            hits = [h for h in hits if self.match(query, h)]
+
+        size = int(params.get('size', body.get('size', DEFAULT_SIZE)))
+        if params.get('search_type') == 'count':
+            size = 0
+        start = int(params.get('from', body.get('from', 0)))
+        sorted_hits = self.sort(hits, body.get('sort'))
+        result = {'took': 0, 'timed_out': False,
+                  '_shards': {'total': 1, 'successful': 1, 'failed': 0},
+                  'hits': {'total': len(hits), 'max_score': 1.0,
+                           'hits': [self.render_hit(h, body.get('_source'))
+                                    for h in sorted_hits[start:start + size]]
+                           }}
+        aggs = body.get('aggs') or body.get('aggregations')
+        if aggs:
+            result['aggregations'] = self.aggregate(aggs, hits)
+        return result
+
+
+class LocalESHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def _body(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        return self.rfile.read(length) if length else ''
+
+    def _reply(self, code, obj):
+        body = json.dumps(obj) if obj is not None else ''
+        self.send_response(code)
+        self.send_header('Content-Type', 'application/json; charset=UTF-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        if self.command != 'HEAD':
+            self.wfile.write(body)
+
+    def _handle(self):
+        url = urlparse.urlparse(self.path)
+        params = dict(urlparse.parse_qsl(url.query))
+        parts = [p for p in url.path.split('/') if p]
+        body = self._body()
+        try:
+            code, obj = self.server.app.handle(self.command, parts, params,
+                                               body)
+        except ValueError as e:
+            code, obj = 400, {'error': str(e), 'status': 400}
+        except Exception as e:
+            LOG.exception('Failed to handle %s %s' % (self.command,
+                                                      self.path))
+            code, obj = 500, {'error': str(e), 'status': 500}
+        self._reply(code, obj)
+
+    do_GET = do_POST = do_PUT = do_DELETE = do_HEAD = _handle
+
+    def log_message(self, format, *args):
+        pass
+
+
+class LocalESApp(object):
+    """Dispatches the requests to the store."""
+
+    def __init__(self, store=None):
+        self.store = store or Store()
+        # the hits left of each scrolled search
+        self._scrolls = {}
+
+    def handle(self, method, parts, params, body):
+        endpoint = next((p for p in parts if p.startswith('_')), None)
+        if endpoint:
+            prefix = parts[:parts.index(endpoint)]
+            index = prefix[0] if prefix else ''
+            doc_type = prefix[1] if len(prefix) > 1 else None
+            suffix = parts[parts.index(endpoint) + 1:]
+            if endpoint == '_bulk':
+                return self.bulk(index, doc_type, body)
+            if endpoint == '_search' and suffix == ['scroll']:
+                return self.scroll(method, params, body)
+            if endpoint == '_search':
+                return self.search(index, doc_type, params, body)
+            if endpoint == '_mget':
+                return self.mget(index, doc_type, body)
+            if endpoint in ('_mapping', '_mappings'):
+                doc_type = suffix[0] if suffix else doc_type
+                return 200, self.store.mapping(index or '_all', doc_type)
+            if endpoint == '_template' and method in ('PUT', 'POST'):
+                self.store.templates[suffix[0]] = json.loads(body or '{}')
+                return 200, {'acknowledged': True}
+            if endpoint == '_template' and method == 'GET':
+                return 200, self.store.templates
+            if endpoint in ('_refresh', '_flush'):
+                return 200, {'_shards': {'total': 1, 'successful': 1}}
+            return 400, {'error': 'Unsupported endpoint %s' % endpoint}
+
+        if not parts:
+            return 200, {'status': 200, 'version': {'number': '1.4.4'},
+                         'tagline': 'You Know, for Search'}
+        if len(parts) == 1:
+            if method in ('PUT', 'POST'):
+                self.store.create_index(parts[0])
+                return 200, {'acknowledged': True}
+            if method == 'DELETE':
+                with self.store.lock:
+                    self.store.indices.pop(parts[0], None)
+                return 200, {'acknowledged': True}
+            found = parts[0] in self.store.indices
+            return (200 if found else 404), {}
+        if len(parts) == 2 and method == 'POST':
+            parts = parts + [None]
+        if len(parts) != 3:
+            return 400, {'error': 'Unsupported path %s' % '/'.join(parts)}
+
+        index, doc_type, id = parts
+        if method in ('PUT', 'POST'):
+            id, created = self.store.index(index, doc_type, id,
+                                           json.loads(body))
+            return (201 if created else 200), {
+                '_index': index, '_type': doc_type, '_id': id,
+                'created': created}
+        if method == 'DELETE':
+            found = self.store.delete(index, doc_type, id)
+            return (200 if found else 404), {
+                '_index': index, '_type': doc_type, '_id': id,
+                'found': found}
+        source = self.store.get(index, doc_type, id)
+        if source is None:
+            return 404, {'_index': index, '_type': doc_type, '_id': id,
+                         'found': False}
+        return 200, {'_index': index, '_type': doc_type, '_id': id,
+                     'found': True, '_source': source}
+
+    def bulk(self, index, doc_type, body):
+        items = []
+        lines = iter(body.splitlines())
+        for line in lines:
+            if not line.strip():
+                continue
+            (action, meta), = json.loads(line).items()
+            i = meta.get('_index', index)
+            t = meta.get('_type', doc_type)
+            id = meta.get('_id')
+            result = {'_index': i, '_type': t, '_id': id, 'status': 200}
+            try:
+                if action in ('index', 'create'):
+                    id, created = self.store.index(i, t, id,
+                                                   json.loads(next(lines)))
+                    result.update(_id=id, status=201 if created else 200)
+                elif action == 'update':
+                    doc = json.loads(next(lines))
+                    self.store.update(i, t, id, doc.get('doc', {}),
+                                      doc.get('upsert'))
+                elif action == 'delete':
+                    if not self.store.delete(i, t, id):
+                        result.update(status=404, found=False)
+                else:
+                    raise ValueError('Unknown bulk action %s' % action)
+            except NotFound:
+                result.update(status=404, error='DocumentMissingException')
+            items.append({action: result})
+        errors = any('error' in r for item in items for r in item.values())
+        return 200, {'took': 0, 'errors': errors, 'items': items}
+
+    def search(self, index, doc_type, params, body):
+        body = json.loads(body) if body.strip() else {}
+        docs = self.store.docs(index or '_all', doc_type)
+        if not params.get('scroll'):
+            return 200, Search(docs).run(body, params)
+
+        # search all the hits at once and hand them out page by page
+        size = int(params.get('size', body.get('size', DEFAULT_SIZE)))
+        params = dict((k, v) for k, v in params.items() if k != 'size')
+        body = dict(body, size=len(docs))
+        body['from'] = 0
+        result = Search(docs).run(body, params)
+        hits = result['hits']['hits']
+        scroll_id = uuid.uuid4().hex
+        self._scrolls[scroll_id] = (hits[size:], size)
+        result['hits']['hits'] = hits[:size]
+        result['_scroll_id'] = scroll_id
+        return 200, result
+
+    def scroll(self, method, params, body):
+        scroll_id = params.get('scroll_id') or body.strip()
+        if scroll_id.startswith('{'):
+            scroll_id = json.loads(scroll_id).get('scroll_id')
+        if method == 'DELETE':
+            self._scrolls.pop(scroll_id, None)
+            return 200, {'succeeded': True}
+        if scroll_id not in self._scrolls:
+            return 404, {'error': 'SearchContextMissingException'}
+        hits, size = self._scrolls[scroll_id]
+        if hits:
+            self._scrolls[scroll_id] = (hits[size:], size)
+        else:
+            del self._scrolls[scroll_id]
+        return 200, {'_scroll_id': scroll_id, 'took': 0,
+                     'hits': {'total': len(hits), 'hits': hits[:size]}}
+
+    def mget(self, index, doc_type, body):
+        body = json.loads(body or '{}')
+        requests = body.get('docs') or [{'_id': id}
+                                        for id in body.get('ids', [])]
+        docs = []
+        for r in requests:
+            i = r.get('_index', index)
+            t = r.get('_type', doc_type)
+            source = self.store.get(i, t, r['_id'])
+            doc = {'_index': i, '_type': t, '_id': r['_id'],
+                   'found': source is not None}
+            if source is not None:
+                doc['_source'] = source
+            docs.append(doc)
+        return 200, {'docs': docs}
+
+
+class _Server(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+class LocalES(object):
+    """Serves a store over http from a background thread."""
+    def __init__(self, host='127.0.0.1', port=0, store=None):
+        self.app = LocalESApp(store)
+        self.store = self.app.store
+        self._server = _Server((host, port), LocalESHandler)
+        self._server.app = self.app
+        self._thread = None
+
+    @property
+    def uri(self):
+        host, port = self._server.server_address
+        return 'http://%s:%d/' % (host, port)
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever)
+        self._thread.daemon = True
+        self._thread.start()
+        return self.uri
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def count(self, patterns='_all', doc_type=None):
+        return len(self.store.docs(patterns, doc_type))
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Serve an in memory stand-in of ElasticSearch.')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=9200)
+    args = parser.parse_args()
+    server = LocalES(args.host, args.port)
+    print('Serving at %s' % server.uri)
+    server._server.serve_forever()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,231 @@
+# Copyright 2013 IBM Corp
+#
+# Author: Tong Li <litong01@us.ibm.com>
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+"""
+An in process stand-in of kafka.
+
+When the kafka uri is memory://<name>, KafkaConnection uses the client,
+consumer and producer of this module instead of the ones of kafka-python.
+All the connections of a process which use the same name share a broker
+which keeps a partitioned log of each topic in memory, so that the services
+and the api can be run and load tested without a kafka server:
+
+    [kafka_opts]
+    uri = memory://benchmark
+"""
+
+import collections
+import itertools
+import threading
+import time
+
+from kafka import common
+
+
+SCHEME = 'memory://'
+
+# The number of messages kept for each partition, older ones are dropped.
+RETENTION = 1000000
+
+_brokers = {}
+_brokers_lock = threading.Lock()
+
+
+def is_memory_uri(uri):
+    return bool(uri) and uri.startswith(SCHEME)
+
+
+def get_broker(uri):
+    """Get the broker of a memory:// uri, created on first use."""
+    with _brokers_lock:
+        broker = _brokers.get(uri)
+        if broker is None:
+            broker = _brokers[uri] = Broker()
+        return broker
+
+
+def reset():
+    """Drop all the brokers and their messages."""
+    with _brokers_lock:
+        _brokers.clear()
+
+
+class _Partition(object):
+    def __init__(self, retention):
+        self.messages = collections.deque(maxlen=retention)
+        self.next_offset = 0
+
+    @property
+    def first_offset(self):
+        return self.next_offset - len(self.messages)
+
+
+class Broker(object):
+    """The topics of a memory:// uri.
+
+    Each topic is a list of partitions and each partition an append only log
+    of messages. The committed offsets are kept per consumer group.
+    """
+    def __init__(self, partitions=1, retention=RETENTION):
+        self.partitions = partitions
+        self.retention = retention
+        self._cond = threading.Condition()
+        self._topics = {}
+        self._offsets = {}
+        self._round_robin = {}
+
+    def _topic(self, topic, partitions=0):
+        parts = self._topics.setdefault(topic, [])
+        while len(parts) < max(partitions, self.partitions):
+            parts.append(_Partition(self.retention))
+        return parts
+
+    def ensure_partitions(self, topic, partitions):
+        with self._cond:
+            self._topic(topic, max(partitions) + 1 if partitions else 0)
+
+    def append(self, topic, msgs):
+        """Append messages to a topic, spread over its partitions."""
+        with self._cond:
+            parts = self._topic(topic)
+            counter = self._round_robin.setdefault(topic, itertools.count())
+            offsets = []
+            for msg in msgs:
+                part = parts[next(counter) % len(parts)]
+                part.messages.append(msg)
+                offsets.append(part.next_offset)
+                part.next_offset += 1
+            self._cond.notify_all()
+            return offsets
+
+    def fetch(self, topic, positions, count, timeout):
+        """Get up to count messages from the positions of the partitions.
+
+        :param positions: {partition: offset}, updated with the offsets of
+            the messages returned.
+        :param timeout: the seconds to wait for a first message, None to
+            wait forever and 0 to not wait at all.
+        """
+        deadline = None if timeout is None else time.time() + timeout
+        with self._cond:
+            while True:
+                result = []
+                parts = self._topic(topic)
+                for partition in sorted(positions):
+                    part = parts[partition]
+                    # messages older than the retention are gone, move on
+                    # to the oldest one kept
+                    offset = max(positions[partition], part.first_offset)
+                    while offset < part.next_offset and len(result) < count:
+                        value = part.messages[offset - part.first_offset]
+                        result.append(common.OffsetAndMessage(
+                            offset, common.Message(0, 0, None, value)))
+                        offset += 1
+                    positions[partition] = offset
+                if result:
+                    return result
+                if deadline is None:
+                    self._cond.wait()
+                else:
+                    remaining = deadline - time.time()
+                    if remaining <= 0:
+                        return []
+                    self._cond.wait(remaining)
+
+    def committed(self, group, topic, partition):
+        with self._cond:
+            return self._offsets.get((group, topic, partition), 0)
+
+    def commit(self, group, topic, positions):
+        with self._cond:
+            for partition, offset in positions.items():
+                self._offsets[(group, topic, partition)] = offset
+
+    def end_offsets(self, topic, partitions):
+        with self._cond:
+            parts = self._topic(topic)
+            return dict((p, parts[p].next_offset) for p in partitions)
+
+    def begin_offsets(self, topic, partitions):
+        with self._cond:
+            parts = self._topic(topic)
+            return dict((p, parts[p].first_offset) for p in partitions)
+
+
+class MemoryClient(object):
+    """Stands in for kafka.client.KafkaClient."""
+    def __init__(self, uri):
+        self.uri = uri
+        self.broker = get_broker(uri)
+
+    def close(self):
+        pass
+
+    def send_offset_commit_request(self, group, payloads):
+        for payload in payloads:
+            self.broker.commit(group, payload.topic,
+                               {payload.partition: payload.offset})
+        return [common.OffsetCommitResponse(p.topic, p.partition, 0)
+                for p in payloads]
+
+
+class MemoryConsumer(object):
+    """Stands in for kafka.consumer.SimpleConsumer."""
+    def __init__(self, client, group, topic, auto_commit=True,
+                 partitions=None, iter_timeout=None):
+        self.broker = client.broker
+        self.group = group
+        self.topic = topic
+        self.auto_commit = auto_commit
+        self.iter_timeout = iter_timeout
+        partitions = list(partitions or [0])
+        self.broker.ensure_partitions(topic, partitions)
+        self.offsets = dict(
+            (p, self.broker.committed(group, topic, p)) for p in partitions)
+
+    def get_messages(self, count=1, block=True, timeout=0.1):
+        return self.broker.fetch(self.topic, self.offsets, count,
+                                 timeout if block else 0)
+
+    def __iter__(self):
+        while True:
+            msgs = self.broker.fetch(self.topic, self.offsets, 1,
+                                     self.iter_timeout)
+            if not msgs:
+                return
+            yield msgs[0]
+
+    def commit(self):
+        self.broker.commit(self.group, self.topic, self.offsets)
+
+    def seek(self, offset, whence):
+        if whence == 0:
+            base = self.broker.begin_offsets(self.topic, self.offsets)
+        elif whence == 2:
+            base = self.broker.end_offsets(self.topic, self.offsets)
+        else:
+            base = self.offsets
+        for partition in self.offsets:
+            self.offsets[partition] = base[partition] + offset
+
+
+class MemoryProducer(object):
+    """Stands in for kafka.producer.SimpleProducer."""
+    def __init__(self, client, **kwargs):
+        self.broker = client.broker
+
+    def send_messages(self, topic, *msgs):
+        return self.broker.append(topic, msgs)
@@ -0,0 +1,76 @@
+# Copyright 2013 IBM Corp
+#
+# Author: Tong Li <litong01@us.ibm.com>
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+import calendar
+import hashlib
+import json
+import time
+
+from monasca.openstack.common import timeutils as tu
+
+
+# The key in the wsgi environment under which the metric validator leaves
+# the metrics it has already parsed, validated and normalized.
+ENV_METRICS = 'monasca.metrics'
+
+# Every metric normalized by serialize() starts with this prefix, so the
+# consumers can tell a normalized message apart without parsing it.
+NORMALIZED_PREFIX = '{"dimensions_hash":"'
+
+
+def dimensions_hash(dimensions):
+    """Get the hash which identifies a set of dimensions."""
+    key_str = json.dumps(dimensions, sort_keys=True, indent=None,
+                         separators=(',', ':'))
+    return hashlib.md5(key_str).hexdigest()
+
+
+def normalize(metric):
+    """Fix up the timestamp and the dimensions_hash of a metric in place.
+
+    A missing timestamp becomes the current time and an ISO 8601 timestamp
+    becomes seconds since epoch.
+    """
+    timestamp = metric.get('timestamp')
+    if not timestamp:
+        metric['timestamp'] = time.time()
+    elif isinstance(timestamp, basestring):
+        the_time = tu.normalize_time(tu.parse_isotime(timestamp))
+        metric['timestamp'] = (calendar.timegm(the_time.timetuple()) +
+                               the_time.microsecond / 1000000.0)
+
+    if not metric.get('dimensions_hash') and metric.get('dimensions'):
+        metric['dimensions_hash'] = dimensions_hash(metric['dimensions'])
+
+    return metric
+
+
+def is_normalized(msg):
+    """Check if a serialized metric was produced by serialize()."""
+    return msg.startswith(NORMALIZED_PREFIX)
+
+
+def serialize(metric):
+    """Serialize a normalized metric with its dimensions_hash first."""
+    metric = dict(metric)
+    the_hash = metric.pop('dimensions_hash', None)
+    body = json.dumps(metric, sort_keys=False, indent=None,
+                      separators=(',', ':'))
+    if not the_hash:
+        return body
+    if body == '{}':
+        return NORMALIZED_PREFIX + the_hash + '"}'
+    return NORMALIZED_PREFIX + the_hash + '",' + body[1:]
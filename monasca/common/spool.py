@@ -0,0 +1,175 @@
+# Copyright 2013 IBM Corp
+#
+# Author: Tong Li <litong01@us.ibm.com>
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+import mmap
+import os
+import struct
+import time
+
+from monasca.openstack.common import log
+
+
+LOG = log.getLogger(__name__)
+
+# Each record of a segment is the length of the payload followed by the
+# payload itself.
+HEADER = struct.Struct('>I')
+SEGMENT_SUFFIX = '.seg'
+CURSOR_FILE = 'cursor'
+
+
+class Spool(object):
+    """An append only queue of payloads kept on local disk.
+
+    The payloads are appended to segment files of about segment_size bytes.
+    A segment is memory mapped when it is replayed, and deleted once all
+    its payloads have been replayed. The position of the replay is saved
+    after each payload so that a restart does not replay them again.
+
+    :param path: the directory of the segments.
+    :param segment_size: the size in bytes after which a new segment starts.
+    :param max_size: the maximum size in bytes of all the segments, payloads
+        which do not fit are dropped. 0 for no limit.
+    """
+    def __init__(self, path, segment_size=16777216, max_size=0):
+        self.path = path
+        self.segment_size = segment_size
+        self.max_size = max_size
+        if not os.path.isdir(path):
+            os.makedirs(path)
+
+        self._segments = sorted(
+            int(name[:-len(SEGMENT_SUFFIX)]) for name in os.listdir(path)
+            if name.endswith(SEGMENT_SUFFIX))
+        self.size = sum(os.path.getsize(self._segment_path(seq))
+                        for seq in self._segments)
+        self._writer = None
+        self._cursor = self._load_cursor()
+
+    def _segment_path(self, seq):
+        return os.path.join(self.path, '%020d%s' % (seq, SEGMENT_SUFFIX))
+
+    def _load_cursor(self):
+        try:
+            with open(os.path.join(self.path, CURSOR_FILE)) as f:
+                seq, offset = f.read().split()
+                seq, offset = int(seq), int(offset)
+            if seq in self._segments:
+                return seq, offset
+        except (IOError, ValueError):
+            pass
+        return (self._segments[0] if self._segments else 0), 0
+
+    def _save_cursor(self):
+        tmp = os.path.join(self.path, CURSOR_FILE + '.tmp')
+        with open(tmp, 'w') as f:
+            f.write('%d %d' % self._cursor)
+        os.rename(tmp, os.path.join(self.path, CURSOR_FILE))
+
+    def __len__(self):
+        return len(self._segments)
+
+    def empty(self):
+        return not self._segments
+
+    def append(self, payload):
+        """Append a payload, return False if the spool is full."""
+        record_size = HEADER.size + len(payload)
+        if self.max_size and self.size + record_size > self.max_size:
+            LOG.error('Spool %s is full, dropping %d bytes.' %
+                      (self.path, len(payload)))
+            return False
+
+        if (not self._writer or
+                self._writer.tell() + record_size > self.segment_size):
+            self._roll()
+        self._writer.write(HEADER.pack(len(payload)))
+        self._writer.write(payload)
+        self._writer.flush()
+        self.size += record_size
+        return True
+
+    def _roll(self):
+        if self._writer:
+            self._writer.close()
+        seq = self._segments[-1] + 1 if self._segments else 0
+        self._segments.append(seq)
+        self._writer = open(self._segment_path(seq), 'ab')
+        if len(self._segments) == 1:
+            self._cursor = (seq, 0)
+
+    def _drop_segment(self, seq):
+        if self._writer and self._segments[-1] == seq:
+            # the replay has caught up with the writer, the next payload
+            # goes into a new segment
+            self._writer.close()
+            self._writer = None
+        path = self._segment_path(seq)
+        self.size -= os.path.getsize(path)
+        os.remove(path)
+        self._segments.remove(seq)
+        self._cursor = (self._segments[0] if self._segments else 0), 0
+        self._save_cursor()
+
+    def replay(self, send, rate=0, limit=0):
+        """Send the payloads in the order they were appended.
+
+        :param send: called with each payload, returns False if it could
+            not be sent, in which case the replay stops at that payload.
+        :param rate: the maximum number of payloads sent per second, 0 for
+            no limit.
+        :param limit: the maximum number of payloads to send, 0 for all.
+        :returns: the number of payloads sent.
+        """
+        sent = 0
+        interval = 1.0 / rate if rate else 0
+        next_time = time.time()
+        while self._segments:
+            seq, offset = self._cursor
+            path = self._segment_path(seq)
+            if os.path.getsize(path) <= offset:
+                self._drop_segment(seq)
+                continue
+
+            with open(path, 'rb') as f:
+                mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            try:
+                while offset < len(mm):
+                    if limit and sent >= limit:
+                        return sent
+                    if interval:
+                        wait = next_time - time.time()
+                        if wait > 0:
+                            time.sleep(wait)
+                        next_time = max(next_time, time.time()) + interval
+
+                    length, = HEADER.unpack_from(mm, offset)
+                    start = offset + HEADER.size
+                    if start + length > len(mm):
+                        # the last payload was not completely written
+                        LOG.error('Dropping truncated payload of spool '
+                                  'segment %s.' % path)
+                        self._cursor = (seq, len(mm))
+                        break
+                    if not send(mm[start:start + length]):
+                        return sent
+                    offset = start + length
+                    self._cursor = (seq, offset)
+                    self._save_cursor()
+                    sent += 1
+            finally:
+                mm.close()
+        return sent
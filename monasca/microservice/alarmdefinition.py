@@ -15,8 +15,6 @@
 # under the License.
 
 
-import ast
-import json
 from oslo.config import cfg
 
 from monasca.common import es_conn
@@ -64,38 +62,29 @@ class AlarmDefinition(os_service.Service):
             self._es_conn = es_conn.ESConnection(
                 cfg.CONF.alarmdefinitions.topic)
 
+    def handle_msgs(self, msgs):
+        """Write a batch of messages to ElasticSearch with one request."""
+        batch = es_conn.BulkBatch()
+        for msg in msgs:
+            if msg and msg.message and msg.message.value:
+                LOG.debug("Message received for Alarm Definition methods: %s",
+                          msg.message.value)
+                batch.add_message(msg.message.value)
+        self._es_conn.bulk_messages(batch)
+
     def start(self):
         while True:
             try:
-                for msg in self._kafka_conn.get_messages():
-                    if msg and msg.message:
-                        LOG.debug(
-                            "Message received for Alarm Definition methods: " + msg.message.value)
-                        value = msg.message.value
-                        if value:
-                            alarmdefmessage = ast.literal_eval(value)
-                            request_type = alarmdefmessage.pop("request", None)
-                            id = alarmdefmessage["id"]
-
-                            if request_type is not None and id is not None:
-                                # post
-                                if request_type == 'POST':
-                                    self._es_conn.post_messages(
-                                        json.dumps(alarmdefmessage), id)
-
-                                # put
-                                if request_type == 'PUT':
-                                    self._es_conn.put_messages(
-                                        json.dumps(alarmdefmessage), id)
-
-                                # delete
-                                if request_type == 'DEL':
-                                    self._es_conn.del_messages(id)
+                for msgs in self._kafka_conn.get_message_batches(
+                        self._es_conn.bulk_size, self._es_conn.bulk_timeout):
+                    if msgs:
+                        self.handle_msgs(msgs)
 
-                # if autocommit is set, this will be a no-op call.
-                self._kafka_conn.commit()
+                        # the batch has been handled, commit its offsets.
+                        self._kafka_conn.commit()
             except Exception:
-                LOG.exception('Error occurred while handling kafka messages.')
+                LOG.exception(
+                    'Error occurred while handling kafka messages.')
 
     def stop(self):
         self._kafka_conn.close()
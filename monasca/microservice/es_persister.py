@@ -16,10 +16,13 @@
 # under the License.
 
 from oslo.config import cfg
+import requests
 from stevedore import driver
+import time
 
 from monasca.common import es_conn
 from monasca.common import kafka_conn
+from monasca.common import spool
 from monasca.openstack.common import log
 from monasca.openstack.common import service as os_service
 
@@ -42,6 +45,33 @@ es_opts = [
                help=('The message processer to load to process the message.'
                      'If the message does not need to be process anyway,'
                      'leave the default')),
+    cfg.StrOpt('spool_dir',
+               default='',
+               help=('The directory where messages are kept when '
+                     'ElasticSearch is unavailable, until they can be '
+                     'written. If not specified, the messages are dropped.')),
+    cfg.IntOpt('spool_segment_size',
+               default=16777216,
+               help='The size in bytes of each file of the spool.'),
+    cfg.IntOpt('spool_max_size',
+               default=1073741824,
+               help=('The maximum size in bytes of the spool, messages are '
+                     'dropped once it is full. 0 for no limit.')),
+    cfg.FloatOpt('spool_replay_rate',
+                 default=10,
+                 help=('The maximum number of bulk requests per second '
+                       'replayed from the spool once ElasticSearch is '
+                       'back, 0 for no limit.')),
+    cfg.IntOpt('spool_replay_limit',
+               default=10,
+               help=('The maximum number of bulk requests replayed from the '
+                     'spool between two batches of messages, so that '
+                     'consuming goes on while the spool drains. 0 for no '
+                     'limit.')),
+    cfg.IntOpt('spool_retry_interval',
+               default=10,
+               help=('The seconds to wait before ElasticSearch is tried '
+                     'again after it failed.')),
 ]
 
 es_group = cfg.OptGroup(name='es_persister', title='es_persister')
@@ -76,21 +106,79 @@ class ESPersister(os_service.Service):
         else:
             self.msg_processor = None
 
+        if cfg.CONF.es_persister.spool_dir:
+            self._spool = spool.Spool(
+                cfg.CONF.es_persister.spool_dir,
+                cfg.CONF.es_persister.spool_segment_size,
+                cfg.CONF.es_persister.spool_max_size)
+        else:
+            self._spool = None
+        self._retry_time = 0
+
+    def _write(self, payload):
+        """Write a bulk payload, return False if ES is unavailable."""
+        try:
+            res = self._es_conn.send_messages(payload)
+        except requests.RequestException:
+            LOG.exception('ElasticSearch is unavailable.')
+            return False
+        return res is None or res.status_code < 500
+
+    def _persist(self, payload):
+        if self._spool is None:
+            self._write(payload)
+        # while there are spooled messages, new ones go after them so that
+        # the messages are written in order
+        elif not (self._spool.empty() and self._write(payload)):
+            if self._spool.append(payload):
+                LOG.warn('Spooled %d bytes.' % len(payload))
+            self._retry_time = max(
+                self._retry_time,
+                time.time() + cfg.CONF.es_persister.spool_retry_interval)
+
+    def _replay(self):
+        if (self._spool is None or self._spool.empty() or
+                time.time() < self._retry_time):
+            return
+        limit = cfg.CONF.es_persister.spool_replay_limit
+        sent = self._spool.replay(self._write,
+                                  cfg.CONF.es_persister.spool_replay_rate,
+                                  limit)
+        LOG.info('Replayed %d bulk requests from the spool.' % sent)
+        # the replay stops early only when ElasticSearch failed, else the
+        # rest is replayed with the next batch
+        if not self._spool.empty() and (not limit or sent < limit):
+            self._retry_time = (
+                time.time() + cfg.CONF.es_persister.spool_retry_interval)
+
+    def handle_msgs(self, msgs):
+        """Write a batch of messages with one bulk request."""
+        values = []
+        for msg in msgs:
+            if msg and msg.message:
+                # the message has been logged by the kafka connection
+                if self.msg_processor:
+                    value = self.msg_processor.process_msg(
+                        msg.message.value)
+                else:
+                    value = msg.message.value
+                if value:
+                    values.append(value if value.endswith('\n')
+                                  else value + '\n')
+        if values:
+            self._persist(''.join(values))
+
     def start(self):
         while True:
             try:
-                for msg in self._kafka_conn.get_messages():
-                    if msg and msg.message:
-                        LOG.debug(msg.message.value)
-                        if self.msg_processor:
-                            value = self.msg_processor.process_msg(
-                                msg.message.value)
-                        else:
-                            value = msg.message.value
-                        if value:
-                            self._es_conn.send_messages(value)
-                # if autocommit is set, this will be a no-op call.
-                self._kafka_conn.commit()
+                for msgs in self._kafka_conn.get_message_batches(
+                        self._es_conn.bulk_size, self._es_conn.bulk_timeout):
+                    self._replay()
+                    if msgs:
+                        self.handle_msgs(msgs)
+
+                        # the batch has been handled, commit its offsets.
+                        self._kafka_conn.commit()
             except Exception:
                 LOG.exception('Error occurred while handling kafka messages.')
 
@@ -15,10 +15,9 @@
 # under the License.
 
 
-import hashlib
 import json
-import time
 
+from monasca.common import metric_util
 from monasca.openstack.common import log
 
 LOG = log.getLogger(__name__)
@@ -31,22 +30,15 @@ class MetricsFixer(object):
 
     @staticmethod
     def _add_hash(message):
-        # If there is no timestamp, we need to fix that up
-        if not message.get('timestamp'):
-            message['timestamp'] = time.time()
-
-        # fixup the dimensions_hash
-        if not message.get('dimensions_hash') and message.get('dimensions'):
-            key_str = json.dumps(message['dimensions'],
-                                 sort_keys=True, indent=None,
-                                 separators=(',', ':'))
-            message['dimensions_hash'] = hashlib.md5(key_str).hexdigest()
-
-        return json.dumps(message, sort_keys=False, indent=None,
-                          separators=(',', ':'))
+        return metric_util.serialize(metric_util.normalize(message))
 
     def process_msg(self, msg):
         try:
+            # The api has already normalized this metric, no need to parse
+            # and serialize it again.
+            if metric_util.is_normalized(msg):
+                return '{"index":{}}\n' + msg + '\n'
+
             data = json.loads(msg)
             if not isinstance(data, list):
                 data = [data]
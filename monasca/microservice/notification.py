@@ -14,10 +14,7 @@
 # License for the specific language governing permissions and limitations
 # under the License.
 
-import ast
-import json
 from oslo.config import cfg
-from stevedore import driver
 
 from monasca.common import es_conn
 from monasca.common import kafka_conn
@@ -64,50 +61,39 @@ class Notification(os_service.Service):
             self._es_conn = es_conn.ESConnection(
                 cfg.CONF.notification.topic)
 
-    def handle_notification_msg(self, msg):
-        if msg and msg.message:
-            LOG.debug("Message received for Notification methods: " + msg.message.value)
-            value = msg.message.value
-            if value:
+    def handle_notification_msgs(self, msgs):
+        """Write a batch of notification methods with one request."""
+        batch = es_conn.BulkBatch()
+        for msg in msgs:
+            if msg and msg.message and msg.message.value:
+                LOG.debug("Message received for Notification methods: %s",
+                          msg.message.value)
                 # value's format is:
                 # {"id":"c60ec47e-5038-4bf1-9f95-4046c6e9a759",
                 # "request":"POST",
                 # "name":"TheName",
                 # "type":"TheType",
                 # "Address":"TheAddress"}
-                # We add the POS/PUT/DEL in the message to indicate the request type
-
-                # Get the notification id from the message,
-                # this id will be used as _id for elasticsearch,
-                # and also stored as id in the notification_methods document type
-
-                # convert to dict, pop request, and get id
-                # after request is removed, the dict can be converted to request body for elasticsearch
-                dict_msg = ast.literal_eval(value)
-                request_type = dict_msg.pop("request", None)
-                id = dict_msg["id"]
+                # We add the POS/PUT/DEL in the message to indicate the
+                # request type. The id is used as _id for elasticsearch, and
+                # also stored as id in the notification_methods document.
+                batch.add_message(msg.message.value)
 
-                if request_type != None and id != None:
-                    # post
-                    if request_type == 'POST':
-                        self._es_conn.post_messages(json.dumps(dict_msg), id)
+        self._es_conn.bulk_messages(batch)
 
-                    # put
-                    if request_type == 'PUT':
-                        self._es_conn.put_messages(json.dumps(dict_msg), id)
-
-                    # delete
-                    if request_type == 'DEL':
-                        self._es_conn.del_messages(id)
+    def handle_notification_msg(self, msg):
+        self.handle_notification_msgs([msg])
 
     def start(self):
         while True:
             try:
-                for msg in self._kafka_conn.get_messages():
-                    self.handle_notification_msg(msg)
+                for msgs in self._kafka_conn.get_message_batches(
+                        self._es_conn.bulk_size, self._es_conn.bulk_timeout):
+                    if msgs:
+                        self.handle_notification_msgs(msgs)
 
-                # if autocommit is set, this will be a no-op call.
-                self._kafka_conn.commit()
+                        # the batch has been handled, commit its offsets.
+                        self._kafka_conn.commit()
             except Exception:
                 LOG.exception('Error occurred while handling kafka messages.')
 
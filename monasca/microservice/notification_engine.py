@@ -14,11 +14,14 @@
 # License for the specific language governing permissions and limitations
 # under the License.
 
-import ast
-import json
+import collections
+import functools
 from oslo.config import cfg
-from stevedore import driver
+import threading
+import time
 
+from monasca.common import codec
+from monasca.common import doc_cache
 from monasca.common import es_conn
 from monasca.common import email_sender
 from monasca.common import kafka_conn
@@ -48,6 +51,48 @@ es_opts = [
                help=('The message processer to load to process the message.'
                      'If the message does not need to be process anyway,'
                      'leave the default')),
+    cfg.StrOpt('definition_doc_type',
+               default='alarmdefinitions',
+               help=('The document type of the alarm definitions, which '
+                     'are looked up for the alarms referring to them by '
+                     'id.')),
+    cfg.StrOpt('cache_group',
+               default='notification_cache',
+               help=('The kafka consumer group the topics of the cached '
+                     'documents are watched with for changes. It has to '
+                     'differ from the group of the services saving the '
+                     'documents, so that both get every change.')),
+    cfg.StrOpt('definition_topic',
+               default='alarmdefinitions',
+               help=('The topic of the changes of the alarm definitions, '
+                     'which are dropped from the cache when they change.')),
+    cfg.IntOpt('cache_ttl',
+               default=300,
+               help=('The number of seconds a notification method or an '
+                     'alarm definition is cached before it is loaded '
+                     'again.')),
+    cfg.IntOpt('batch_size',
+               default=100,
+               help=('The maximum number of alarm messages whose '
+                     'notification methods are resolved together.')),
+    cfg.FloatOpt('batch_timeout',
+                 default=0.5,
+                 help=('The number of seconds to wait for more alarm '
+                       'messages before a batch is handled.')),
+    cfg.FloatOpt('coalesce_window',
+                 default=0,
+                 help=('The number of seconds alarms of the same alarm '
+                       'definition and state are collected before one '
+                       'notification is sent for all of them through each '
+                       'notification method. 0 sends them right away. The '
+                       'offsets of the alarms are committed once they are '
+                       'sent, a longer window holds back the commits.')),
+    cfg.IntOpt('rate_limit',
+               default=0,
+               help=('The maximum number of notifications per minute sent '
+                     'through one notification method, the alarms held back '
+                     'are added to the next notification. 0 means no '
+                     'limit.')),
 ]
 
 es_group = cfg.OptGroup(name='notification', title='notification')
@@ -57,11 +102,101 @@ cfg.CONF.register_opts(es_opts, es_group)
 LOG = log.getLogger(__name__)
 
 
+class Delivery(object):
+    """Tracks the notifications of a batch of alarm messages.
+
+    A batch is delivered once each of its alarms which is notified has
+    been sent, or given up on, through all of its notification methods.
+    Its offsets can be committed then.
+    """
+    def __init__(self, offsets):
+        self.offsets = offsets
+        self._pending = 0
+        self._lock = threading.Lock()
+
+    def add(self):
+        with self._lock:
+            self._pending += 1
+
+    def done(self):
+        with self._lock:
+            self._pending -= 1
+
+    def delivered(self):
+        with self._lock:
+            return self._pending == 0
+
+
+class Coalescer(object):
+    """Groups alarms into digests and limits the rate of each method.
+
+    Alarms are grouped by alarm definition id, new state and notification
+    method. A group is due window seconds after its first alarm, and it is
+    only released when its notification method has not used up its rate
+    limit. Alarms arriving in the meantime join the pending group.
+    """
+    def __init__(self, window, rate_limit):
+        self.window = window
+        self.rate_limit = rate_limit
+        self._groups = {}
+        self._buckets = {}
+
+    def add(self, def_id, state, action_id, method, alarm, now=None,
+            delivery=None):
+        now = now or time.time()
+        key = (def_id, state, action_id)
+        group = self._groups.get(key)
+        if group is None:
+            group = {'created': now, 'method': method, 'alarms': [],
+                     'deliveries': []}
+            self._groups[key] = group
+        group['alarms'].append(alarm)
+        if delivery is not None:
+            delivery.add()
+            group['deliveries'].append(delivery)
+
+    def _take_token(self, action_id, now):
+        """Token bucket holding up to rate_limit tokens per method."""
+        if not self.rate_limit:
+            return True
+        tokens, last = self._buckets.get(action_id, (self.rate_limit, now))
+        tokens = min(self.rate_limit,
+                     tokens + (now - last) * self.rate_limit / 60.0)
+        if tokens < 1:
+            self._buckets[action_id] = (tokens, now)
+            return False
+        self._buckets[action_id] = (tokens - 1, now)
+        return True
+
+    def flush(self, now=None):
+        """Remove and return the due groups.
+
+        Each group is returned as (key, method, alarms, deliveries), with
+        the Delivery of each alarm added with one.
+        """
+        now = now or time.time()
+        due = []
+        for key, group in sorted(self._groups.items(),
+                                 key=lambda item: (item[1]['created'],
+                                                   item[0])):
+            if (group['created'] + self.window <= now and
+                    self._take_token(key[2], now)):
+                del self._groups[key]
+                due.append((key, group['method'], group['alarms'],
+                            group['deliveries']))
+        return due
+
+    def __len__(self):
+        return len(self._groups)
+
+
 class NotificationEngine(os_service.Service):
     def __init__(self, threads=1000):
         super(NotificationEngine, self).__init__(threads)
+        # the offsets are committed by the engine once the alarms consumed
+        # have been sent, not when they are fetched
         self._kafka_conn = kafka_conn.KafkaConnection(
-            cfg.CONF.notification.topic)
+            cfg.CONF.notification.topic, auto_commit=False)
 
         # Use doc_type if it is defined.
         if cfg.CONF.notification.doc_type:
@@ -71,113 +206,258 @@ class NotificationEngine(os_service.Service):
             self._es_conn = es_conn.ESConnection(
                 cfg.CONF.notification.topic2)
 
-    def handle_alarm_msg(self, msg):
-        if msg and msg.message:
-            LOG.debug("Message received for alarm: " + msg.message.value)
-            value = msg.message.value
-            if value:
-                # value's format is:
-                # {
-                #   "metrics": {
-                #     "timestamp": 1432672915.409,
-                #     "name": "biz",
-                #     "value": 1500,
-                #     "dimensions": {
-                #       "key2": "value2",
-                #       "key1": "value1"
-                #     }
-                #   },
-                #   "state_updated_timestamp": 1432672915,
-                #   "state": "ALARM",
-                #   "alarm-definition": {
-                #     "alarm_actions": [
-                #       "c60ec47e-5038-4bf1-9f95-4046c6e9a759"
-                #     ],
-                #     "undetermined_actions": [
-                #       "c60ec47e-5038-4bf1-9f95-4046c6e9a759"
-                #     ],
-                #     "name": "Average CPU percent greater than 10",
-                #     "match_by": [
-                #       "hostname"
-                #     ],
-                #     "description": "The average CPU percent is greater than 10",
-                #     "ok_actions": [
-                #       "c60ec47e-5038-4bf1-9f95-4046c6e9a759"
-                #     ],
-                #     "expression": "max(foo{hostname=mini-mon,mu=na}, 120) > 1100
-                #                   and max(bar { asd = asd} )>1200 or avg(biz)>1300",
-                #     "id": "c60ec47e-5038-4bf1-9f95-4046c6e91111",
-                #     "severity": "LOW"
-                #   }
-                # }
-
-                # convert to dict, and get state to determine the actions(notification method id) needed.
-                # the method id can be used to match the notification method in elasticSearch
-                # Then an email will be sent (TODO: phone txt msg are not dealt with for now)
-                dict_msg = ast.literal_eval(value)
-                state = dict_msg["state"]
-                if state not in ["ALARM","OK","UNDETERMINED"]:
-                    LOG.error("state of alarm is not defined as expected")
+        self._method_cache = doc_cache.DocumentCache(
+            self._es_conn, cfg.CONF.notification.cache_ttl,
+            'notification methods')
+        self._definition_cache = doc_cache.DocumentCache(
+            es_conn.ESConnection(cfg.CONF.notification.definition_doc_type),
+            cfg.CONF.notification.cache_ttl, 'alarm definitions')
+        self._coalescer = Coalescer(cfg.CONF.notification.coalesce_window,
+                                    cfg.CONF.notification.rate_limit)
+        # the batches consumed whose offsets are not committed yet, in order
+        self._deliveries = collections.deque()
+
+        # the topics of the cached documents, with the cache each of them
+        # invalidates. The services saving the documents run in their own
+        # processes, the changes reach the caches through kafka.
+        self._watched = {}
+        self.watch(cfg.CONF.notification.topic2, self._method_cache)
+        self.watch(cfg.CONF.notification.definition_topic,
+                   self._definition_cache)
+        self._watchers = []
+        self._stopped = threading.Event()
+
+    def watch(self, topic, cache):
+        """Invalidate the documents of a cache changed on a topic."""
+        conn = kafka_conn.KafkaConnection(
+            topic, group=cfg.CONF.notification.cache_group)
+        self._watched[topic] = (conn, cache)
+
+    def handle_change_msgs(self, msgs, cache):
+        """Drop the documents changed by the messages from a cache."""
+        for msg in msgs:
+            if not (msg and msg.message and msg.message.value):
+                continue
+            try:
+                id = codec.decode(msg.message.value).get('id')
+            except Exception:
+                LOG.exception('Invalid message %s' % msg.message.value)
+                continue
+            if id is not None:
+                cache.invalidate(id)
+
+    def _watch(self, topic):
+        conn, cache = self._watched[topic]
+        while not self._stopped.is_set():
+            for msgs in conn.get_message_batches(
+                    cfg.CONF.notification.batch_size,
+                    cfg.CONF.notification.batch_timeout):
+                if self._stopped.is_set():
                     return
+                if msgs:
+                    self.handle_change_msgs(msgs, cache)
+                    conn.commit()
+            # the batches end after an error, wait before watching again
+            self._stopped.wait(conn.wait_time)
+
+    def start_watchers(self):
+        """Watch each topic of the cached documents from its own thread."""
+        for topic, (conn, cache) in self._watched.items():
+            # the caches start empty, only the changes from now on matter
+            conn.seek(0, 2)
+            watcher = threading.Thread(target=self._watch, args=(topic,),
+                                       name='watch-%s' % topic)
+            watcher.daemon = True
+            watcher.start()
+            self._watchers.append(watcher)
+
+    def handle_alarm_msg(self, msg):
+        self.handle_alarm_msgs([msg])
+
+    def _decode_alarm(self, msg):
+        """Decode an alarm message, None if it is not valid."""
+        if not (msg and msg.message and msg.message.value):
+            return None
+        LOG.debug("Message received for alarm: %s", msg.message.value)
+        # value's format is:
+        # {
+        #   "id": "0f4e1a2b-8a41-4b67-a6a3-3f0d2f3a5f0e",
+        #   "alarm_definition_id": "c60ec47e-5038-4bf1-9f95-4046c6e91111",
+        #   "alarm_definition_version": null,
+        #   "dimensions": {"hostname": "h1"},
+        #   "state": "ALARM",
+        #   "old_state": "OK",
+        #   "sub_alarms": [
+        #     {"sub_expression": "max(biz) > 1300",
+        #      "state": "ALARM",
+        #      "values": [1500]}
+        #   ],
+        #   "state_updated_timestamp": 1432672915,
+        #   "updated_timestamp": 1432672915,
+        #   "created_timestamp": 1432672855
+        # }
+        # older alarms carry the whole alarm definition in "alarm-definition"
+        # and the metrics in "metrics" instead.
+        dict_msg = codec.decode(msg.message.value)
+        if dict_msg.get("state") not in ["ALARM", "OK", "UNDETERMINED"]:
+            LOG.error("state of alarm is not defined as expected")
+            return None
+        return dict_msg
+
+    def _get_actions(self, dict_msg):
+        """Get the notification method ids for the state of an alarm."""
+        # the state is used to determine the actions (notification method
+        # id) needed. the method id can be used to match the notification
+        # method in elasticSearch
+        state = dict_msg["state"]
+        if state == 'ALARM':
+            return dict_msg["alarm-definition"].get("alarm_actions", [])
+        elif state == 'OK':
+            return dict_msg["alarm-definition"].get("ok_actions", [])
+        else:
+            return dict_msg["alarm-definition"].get(
+                "undetermined_actions", [])
+
+    def handle_alarm_msgs(self, msgs, delivery=None):
+        """Notify about a batch of alarm messages.
 
-                actions = []
-                if state == 'ALARM':
-                    actions = dict_msg["alarm-definition"]["alarm_actions"]
-                if state == 'OK':
-                    actions = dict_msg["alarm-definition"]["ok_actions"]
-                if state == 'UNDETERMINED':
-                    actions = dict_msg["alarm-definition"]["undetermined_actions"]
+        The alarm definitions and then the notification methods of all the
+        messages are resolved together, the ones which are not cached yet
+        with a single ElasticSearch query each. The alarms are then handed
+        to the coalescer, which sends them as digests once their window has
+        passed. The delivery, if given, tracks the notifications sent.
+        """
+        decoded = []
+        for msg in msgs:
+            try:
+                dict_msg = self._decode_alarm(msg)
+                if dict_msg:
+                    decoded.append(dict_msg)
+            except Exception:
+                LOG.exception('Failed to decode alarm message.')
 
-                addresses = []
-                types = []
-                # the action_id is an id of notification method
-                # there can be multiple ids in one alarm message with different types
-                for action_id in actions:
+        def_ids = set(dict_msg.get("alarm_definition_id")
+                      for dict_msg in decoded
+                      if "alarm-definition" not in dict_msg)
+        definitions = {}
+        if def_ids:
+            definitions = self._definition_cache.get(def_ids)
 
-                    es_res = self._es_conn.get_message_by_id(action_id)
+        alarms = []
+        for dict_msg in decoded:
+            if "alarm-definition" not in dict_msg:
+                def_id = dict_msg.get("alarm_definition_id")
+                alarm_def = definitions.get(def_id)
+                if alarm_def is None:
+                    LOG.error("Alarm definition %s is not defined" % def_id)
+                    continue
+                dict_msg["alarm-definition"] = alarm_def
+            alarms.append((dict_msg, self._get_actions(dict_msg)))
 
-                    def _get_notification_method_response(res):
-                        if res and res.status_code == 200:
-                            obj = res.json()
-                            if obj:
-                                return obj.get('hits')
-                            return None
-                        else:
-                            return None
+        # the action_id is an id of notification method
+        # there can be multiple ids in one alarm message with different types
+        action_ids = set()
+        for dict_msg, actions in alarms:
+            action_ids.update(actions)
+        methods = {}
+        if action_ids:
+            methods = self._method_cache.get(action_ids)
 
-                    es_res = _get_notification_method_response(es_res)
+        for dict_msg, actions in alarms:
+            alarm_def = dict_msg["alarm-definition"]
+            for action_id in actions:
+                method = methods.get(action_id)
+                if method is None:
+                    LOG.error("Notification method %s is not defined" %
+                              action_id)
+                    continue
+                self._coalescer.add(alarm_def.get("id"), dict_msg["state"],
+                                    action_id, method, dict_msg,
+                                    delivery=delivery)
 
-                    LOG.debug('Query to ElasticSearch returned: %s' % es_res)
+        self.flush_notifications()
 
-                    if es_res is None:
-                        LOG.error("The provided is not defined as expected")
-                        return
+    @staticmethod
+    def _delivered(deliveries, sent):
+        for delivery in deliveries:
+            delivery.done()
 
-                    name = es_res["hits"][0]["_source"]["name"]
-                    type = es_res["hits"][0]["_source"]["type"]
-                    address = es_res["hits"][0]["_source"]["address"]
+    def flush_notifications(self):
+        """Send a digest for each group of alarms which is due."""
+        for key, method, alarms, deliveries in self._coalescer.flush():
+            callback = functools.partial(self._delivered, deliveries)
+            queued = False
+            try:
+                queued = self.send_notification(key, method, alarms,
+                                                callback)
+            except Exception:
+                LOG.exception('Failed to notify %s of %d alarms' %
+                              (key[2], len(alarms)))
+            if not queued:
+                callback(False)
 
-                    types.append(type)
-                    addresses.append(address)
+    def send_notification(self, key, method, alarms, callback=None):
+        """Send a digest of a group of alarms through its method.
 
-                email_addresses = []
-                for i in range(len(types)):
-                    if types[i] == "EMAIL":
-                        email_addresses.append(addresses[i])
+        Returns True if the digest was queued, callback is called once it
+        has been sent then.
+        """
+        # Then an email will be sent
+        # (TODO: phone txt msg are not dealt with for now)
+        if method["type"] != "EMAIL":
+            return False
+        alarm_def = alarms[0]["alarm-definition"]
+        if len(alarms) == 1:
+            subject = "Alarm to User"
+            content = alarm_def["description"]
+        else:
+            subject = "%d alarms of %s are %s" % (
+                len(alarms), alarm_def.get("name"), key[1])
+            content = alarm_def["description"] + "\n\n" + "\n".join(
+                codec.encode(alarm.get("metrics", alarm.get("dimensions")))
+                for alarm in alarms)
+        return email_sender.send_emails([method["address"]], subject,
+                                        content, callback)
 
-                email_sender.send_emails(email_addresses, "Alarm to User", dict_msg["alarm-definition"]["description"])
+    def handle_batch(self, msgs):
+        """Handle a batch of alarm messages, an empty one flushes only.
+
+        The offsets of the batches are committed in order, once the
+        notifications of their alarms have been sent or given up on by the
+        email sender. The alarms which were consumed but not sent yet are
+        consumed again after a restart, and some of the notifications of
+        the batches which were not committed may be sent twice.
+        """
+        if msgs:
+            delivery = Delivery(self._kafka_conn.offsets())
+            self._deliveries.append(delivery)
+            self.handle_alarm_msgs(msgs, delivery)
+        else:
+            self.flush_notifications()
+        self.commit_delivered()
+
+    def commit_delivered(self):
+        """Commit the offsets of the batches delivered so far."""
+        offsets = None
+        while self._deliveries and self._deliveries[0].delivered():
+            offsets = self._deliveries.popleft().offsets
+        if offsets:
+            self._kafka_conn.commit_offsets(offsets)
 
     def start(self):
+        self.start_watchers()
         while True:
             try:
-                for msg in self._kafka_conn.get_messages():
-                    self.handle_alarm_msg(msg)
-
-                # if autocommit is set, this will be a no-op call.
-                self._kafka_conn.commit()
+                for msgs in self._kafka_conn.get_message_batches(
+                        cfg.CONF.notification.batch_size,
+                        cfg.CONF.notification.batch_timeout):
+                    self.handle_batch(msgs)
             except Exception:
                 LOG.exception('Error occurred while handling kafka messages.')
 
     def stop(self):
+        self._stopped.set()
         self._kafka_conn.close()
+        for conn, cache in self._watched.values():
+            conn.close()
         super(NotificationEngine, self).stop()
@@ -18,6 +18,7 @@
 from oslo.config import cfg
 from stevedore import driver
 
+from monasca.common import instrument
 from monasca.openstack.common import log
 from monasca.openstack.common import service as os_service
 from monasca import service
@@ -59,6 +60,9 @@ def main():
     LOG.debug("Micro service %s is now loaded." %
               service_driver.driver.__class__.__name__)
 
+    # serve the instrumentation of the service if a port is configured
+    instrument.start_server()
+
     # now launch the service
     launcher.launch_service(service_driver.driver)
     launcher.wait()
\ No newline at end of file
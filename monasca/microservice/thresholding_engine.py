@@ -14,25 +14,72 @@
 # WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
 # License for the specific language governing permissions and limitations
 # under the License.
+import collections
 from oslo.config import types
 from oslo.config import cfg
-from stevedore import driver
-import json
+import threading
+import time
+
+from monasca.common import codec
 from monasca.common import es_conn
+from monasca.common import instrument
 from monasca.common import kafka_conn
+from monasca.microservice import thresholding_processor as processor
 from monasca.openstack.common import log
 from monasca.openstack.common import service as os_service
 
 
-PROCESSOR_NAMESPACE = 'monasca.message.processor'
-
 th_opts = [
     cfg.MultiOpt('consume_topic', item_type=types.String(),
                  default=['event','metrics','alarmdefinitions'],
                  help='input topics'),
     cfg.MultiOpt('publish_topic', item_type=types.String(),
                  default=['event', 'alarmdefinitions', 'alarm'],
-                 help='output topics')
+                 help='output topics'),
+    cfg.IntOpt('series_idle_windows', default=3,
+               help=('Evict the series of an alarm definition which got no '
+                     'metrics for this many windows of the definition, 0 '
+                     'to keep them forever.')),
+    cfg.StrOpt('series_evict_state', default='',
+               help=('The state, for example UNDETERMINED, of a last alarm '
+                     'sent for an evicted series. Empty to evict series '
+                     'without an alarm.')),
+    cfg.IntOpt('max_series_per_definition', default=0,
+               help=('The maximum number of series of an alarm definition, '
+                     'the least recently updated ones are evicted beyond '
+                     'it. 0 for no limit.')),
+    cfg.IntOpt('max_series', default=0,
+               help=('The maximum number of series of all the alarm '
+                     'definitions, the least recently updated ones are '
+                     'evicted beyond it. 0 for no limit.')),
+    cfg.IntOpt('fetch_size', default=1000,
+               help='The maximum number of messages fetched at once.'),
+    cfg.FloatOpt('fetch_timeout', default=0.1,
+                 help=('The seconds to wait for more messages before a '
+                       'batch which is not full is handed on.')),
+    cfg.IntOpt('max_pending_batches', default=10,
+               help=('The maximum number of batches fetched from a topic '
+                     'and not handled yet, the fetching of the topic waits '
+                     'beyond it.')),
+    cfg.FloatOpt('evaluation_interval', default=60,
+                 help='The seconds between two evaluations of the alarms.'),
+    cfg.BoolOpt('bootstrap', default=True,
+                help=('Load the alarm definitions from ElasticSearch on '
+                      'start, before the alarmdefinitions topic is '
+                      'consumed from the last committed offset.')),
+    cfg.StrOpt('definition_doc_type', default='alarmdefinitions',
+               help='The document type of the alarm definitions.'),
+    cfg.IntOpt('bootstrap_page_size', default=1000,
+               help=('The number of alarm definitions read from '
+                     'ElasticSearch with one request.')),
+    cfg.IntOpt('remote_window_seconds', default=0,
+               help=('Evaluate the sub expressions whose window, the '
+                     'period times the periods, is at least this many '
+                     'seconds with aggregations of the metrics saved in '
+                     'ElasticSearch instead of keeping their metrics in '
+                     'memory. 0 keeps all the windows in memory.')),
+    cfg.StrOpt('metrics_doc_type', default='metrics',
+               help='The document type of the metrics in ElasticSearch.'),
 ]
 
 th_group = cfg.OptGroup(name='thresholding_engine', title='thresholding_engine')
@@ -41,54 +88,441 @@ cfg.CONF.register_opts(th_opts, th_group)
 
 LOG = log.getLogger(__name__)
 
+ACTIVE_SERIES = instrument.gauge(
+    'monasca_thresholding_active_series',
+    'Series of all the alarm definitions.')
+
+
+# The characters with a meaning in the regular expressions of ElasticSearch.
+_REGEXP_RESERVED = frozenset(u'.?+*|{}[]()"\\#@&<>~^$')
+
+
+def _char_regexp(c):
+    """Match a character in either case."""
+    if c.lower() != c.upper():
+        return u'[%s%s]' % (c.lower(), c.upper())
+    if c in _REGEXP_RESERVED:
+        return u'\\' + c
+    return c
+
+
+def es_regexp(value, glob=False):
+    """Translate a normalized name or dimension value into a regexp query.
+
+    The strings are saved as they were posted and are not analyzed, the
+    regexp matches them in any case the way the metrics are matched in
+    memory. With glob, * ? and [] are translated as glob patterns.
+    """
+    if isinstance(value, str):
+        value = value.decode('utf8')
+    elif not isinstance(value, unicode):
+        value = unicode(value)
+    result = []
+    i = 0
+    while i < len(value):
+        c = value[i]
+        i += 1
+        if glob and c == u'*':
+            result.append(u'.*')
+        elif glob and c == u'?':
+            result.append(u'.')
+        elif glob and c == u'[':
+            # a ] right after [ or [! is part of the set, as with fnmatch
+            start = i + 1 if value[i:i + 1] == u'!' else i
+            end = value.find(u']', start + 1)
+            if end < 0:
+                result.append(_char_regexp(c))
+                continue
+            chars = value[start:end]
+            expanded = u''.join(
+                ch.lower() + ch.upper() if ch.lower() != ch.upper() else
+                u'\\' + ch if ch in _REGEXP_RESERVED else ch
+                for ch in chars)
+            result.append(u'[%s%s]' % (u'^' if start > i else u'',
+                                       expanded))
+            i = end + 1
+        else:
+            result.append(_char_regexp(c))
+    return u''.join(result)
+
+
+# The topics whose messages are handled before the ones of other topics,
+# so that a change of an alarm definition does not wait behind metrics.
+CONTROL_TOPICS = ('alarmdefinitions', 'event')
+
+
+class PriorityQueues(object):
+    """Bounded queues of batches, the lowest priority is taken first.
+
+    Each topic is fetched by its own thread which puts the batches into the
+    queue of the priority of the topic, waiting while that queue is full.
+    """
+    def __init__(self, maxlen=0):
+        self.maxlen = maxlen
+        self._cond = threading.Condition()
+        self._queues = {}
+
+    def __len__(self):
+        with self._cond:
+            return sum(len(q) for q in self._queues.values())
+
+    def put(self, priority, item, stopped=None):
+        with self._cond:
+            queue = self._queues.setdefault(priority, collections.deque())
+            while (self.maxlen and len(queue) >= self.maxlen and
+                   not (stopped and stopped.is_set())):
+                self._cond.wait(1)
+            queue.append(item)
+            self._cond.notify_all()
+
+    def get(self, timeout=None):
+        """Get the oldest item of the lowest priority, None on timeout."""
+        deadline = None if timeout is None else time.time() + timeout
+        with self._cond:
+            while True:
+                for priority in sorted(self._queues):
+                    queue = self._queues[priority]
+                    if queue:
+                        item = queue.popleft()
+                        self._cond.notify_all()
+                        return item
+                if deadline is None:
+                    self._cond.wait()
+                else:
+                    remaining = deadline - time.time()
+                    if remaining <= 0:
+                        return None
+                    self._cond.wait(remaining)
+
 
 class ThresholdingEngine(os_service.Service):
 
-    def __init__(self, threads=1000):
+    def __init__(self, threads=1000, clock=time.time):
         super(ThresholdingEngine, self).__init__(threads)
+        # the time of the processors, replays use the time of the metrics
+        self.clock = clock
         self._consume_kafka_conn = {}
         self._publish_kafka_conn = {}
-        for topic in self.cfg.CONF.thresholding_engine.consume_topic:
-            self._consume_kafka_conn[topic] = kafka_conn.KafkaConnection(topic)
+        for topic in cfg.CONF.thresholding_engine.consume_topic:
+            # the offsets are committed once the batches are handled
+            self._consume_kafka_conn[topic] = kafka_conn.KafkaConnection(
+                topic, auto_commit=False)
 
-        for topic in self.cfg.CONF.thresholding_engine.publish_topic:
+        for topic in cfg.CONF.thresholding_engine.publish_topic:
             self._publish_kafka_conn[topic] = kafka_conn.KafkaConnection(topic)
 
         self.thresholding_processors={}
+        # the windows shared by the sub expressions of all the processors
+        self.window_store = processor.WindowStore()
+        # the processors of the alarm definitions which use a metric name
+        self._processors_by_name = {}
+        self._queues = PriorityQueues(
+            cfg.CONF.thresholding_engine.max_pending_batches)
+        self._fetchers = []
+        self._stopped = threading.Event()
+        self._next_evaluation = 0
+        self._metrics_es_conn = None
 
-    def start(self):
-        while True:
+    def add_processor(self, name, alarm_def):
+        """Add or replace the processor of an alarm definition."""
+        old = self.thresholding_processors.get(name)
+        conf = cfg.CONF.thresholding_engine
+        self.thresholding_processors[name] = (
+            processor.ThresholdingProcessor(
+                alarm_def, self.window_store,
+                idle_windows=conf.series_idle_windows,
+                max_series=conf.max_series_per_definition,
+                evict_state=conf.series_evict_state or None,
+                clock=self.clock,
+                remote_window_seconds=self._remote_window_seconds()))
+        if old:
+            old.close()
+
+    def _remote_window_seconds(self):
+        conf = cfg.CONF.thresholding_engine
+        if conf.remote_window_seconds and cfg.CONF.es.uri:
+            return conf.remote_window_seconds
+        return 0
+
+    def _remote_filter(self, key, t_now):
+        """The query of the metrics of the windows of a key.
+
+        The name and the dimension values of the key are lower cased, they
+        are matched in any case with regexp queries.
+        """
+        name, dimensions, period, periods, match_by = key
+        must = [{'range': {'timestamp': {'gte': t_now - period * periods,
+                                         'lte': t_now}}},
+                {'regexp': {'name': es_regexp(name)}}]
+        for k, v in dimensions:
+            must.append({'regexp': {'dimensions.' + k: es_regexp(
+                v, glob=processor.is_pattern(v))}})
+        return {'bool': {'must': must}}
+
+    def _remote_aggs(self, key, t_now):
+        """Aggregate the metrics of a key per series and period.
+
+        The periods are aligned with the start of the windows, one terms
+        aggregation is nested per match_by dimension.
+        """
+        name, dimensions, period, periods, match_by = key
+        start = int(t_now - period * periods)
+        aggs = {'periods': {
+            'date_histogram': {'field': 'timestamp',
+                               'interval': '%ds' % period,
+                               'offset': '%ds' % (start % int(period))},
+            'aggs': {'statistics': {'stats': {'field': 'value'}}}}}
+        for m in reversed(match_by):
+            aggs = {'series': {'terms': {'field': 'dimensions.' + m,
+                                         'size': 0},
+                               'aggs': aggs}}
+        return aggs
+
+    def _set_remote_stats(self, key, windows, result, t_now):
+        """Set the statistics of the windows from their aggregation."""
+        name, dimensions, period, periods, match_by = key
+        start = int(t_now - period * periods)
+
+        def _series(agg, values):
+            if len(values) == len(match_by):
+                yield values, agg
+                return
+            for bucket in agg.get('series', {}).get('buckets', []):
+                for item in _series(bucket, values + (bucket['key'],)):
+                    yield item
+
+        found = set()
+        for values, agg in _series(result, ()):
+            series = (None if not values else
+                      values[0] if len(values) == 1 else values)
+            window = windows.get(series)
+            if window is None:
+                continue
+            stats = [None] * int(periods)
+            for bucket in agg['periods']['buckets']:
+                index = int(periods) - 1 - int(
+                    round((bucket['key'] - start) / period))
+                if 0 <= index < len(stats):
+                    stats[index] = bucket['statistics']
+            window.set_stats(stats)
+            found.add(series)
+        for series, window in windows.items():
+            if series not in found:
+                window.set_stats([])
+
+    def query_remote_windows(self, t_now):
+        """Set the statistics of all the remote windows.
+
+        The metrics of all of them are aggregated by a single search, with
+        a filter aggregation per sub expression and match_by. The windows
+        keep their statistics when the search fails.
+        """
+        groups = self.window_store.remote_windows()
+        if not groups:
+            return
+        keys = sorted(groups)
+        aggs = {}
+        for i, key in enumerate(keys):
+            aggs['w%d' % i] = {'filter': self._remote_filter(key, t_now),
+                               'aggs': self._remote_aggs(key, t_now)}
+        longest = max(period * periods for n, d, period, periods, m in keys)
+        body = {'query': {'range': {'timestamp': {'gte': t_now - longest,
+                                                  'lte': t_now}}},
+                'aggs': aggs}
+        if self._metrics_es_conn is None:
+            self._metrics_es_conn = es_conn.ESConnection(
+                cfg.CONF.thresholding_engine.metrics_doc_type)
+        res = self._metrics_es_conn.search(body)
+        if res is None:
+            return
+        for i, key in enumerate(keys):
+            result = res.get('aggregations', {}).get('w%d' % i, {})
+            self._set_remote_stats(key, groups[key], result, t_now)
+
+    def enforce_series_limit(self):
+        """Evict the least recently updated series beyond max_series."""
+        max_series = cfg.CONF.thresholding_engine.max_series
+        tps = self.thresholding_processors.values()
+        active = sum(len(tp.expr_data_queue) for tp in tps)
+        if max_series and active > max_series:
+            series = sorted(((item['last_seen'], tp, name)
+                             for tp in tps
+                             for name, item in tp.expr_data_queue.items()),
+                            key=lambda s: s[0])
+            # evict a tenth more than needed, so that the series are not
+            # sorted again for every new one
+            count = active - max_series + max_series // 10
+            for last_seen, tp, name in series[:count]:
+                tp.evict(name, 'limit')
+            active -= count
+        ACTIVE_SERIES.set(active)
+
+    def index_processors(self):
+        """Index the processors by the metric names they use."""
+        index = {}
+        for tp in self.thresholding_processors.values():
+            for name in tp.metric_names:
+                index.setdefault(name, []).append(tp)
+        self._processors_by_name = index
+
+    def process_metrics_msg(self, value):
+        """Decode a metrics message once and hand it to the processors.
+
+        The message holds one metric or a list of them. Each metric goes
+        only to the processors of the alarm definitions using its name.
+        An invalid message or metric is logged and skipped.
+        """
+        try:
+            metrics = processor.decode_metrics(value)
+        except Exception:
+            LOG.exception('Invalid metrics message %s' % value)
+            return
+        for metric in metrics:
+            self.process_metric(metric)
+
+    def process_metric(self, metric):
+        """Hand a decoded metric to the processors using its name."""
+        try:
+            for tp in self._processors_by_name.get(metric.match_name, ()):
+                tp.add_expr_metrics(metric)
+        except Exception:
+            LOG.exception('Failed to process metric %s' % metric)
+
+    def handle_alarm_definition_msgs(self, msgs):
+        for msg in msgs:
+            if msg and msg.message:
+                LOG.debug('Alarm definition received: %s', msg.message.value)
+                try:
+                    temp_admin = codec.decode(msg.message.value)
+                    self.add_processor(temp_admin['name'], msg.message.value)
+                except Exception:
+                    LOG.exception('Invalid alarm definition %s' %
+                                  msg.message.value)
+        self.index_processors()
+
+    def handle_metrics_msgs(self, msgs):
+        for msg in msgs:
+            if msg and msg.message:
+                self.process_metrics_msg(msg.message.value)
+
+    def evaluate(self, t_now=None):
+        """Evaluate the alarms of all the processors and send them.
+
+        Returns the alarms sent.
+        """
+        self.enforce_series_limit()
+        t_now = t_now or self.clock()
+        if self._remote_window_seconds():
+            try:
+                self.query_remote_windows(t_now)
+            except Exception:
+                LOG.exception('Failed to query the remote windows.')
+        sent = []
+        for tp in self.thresholding_processors.values():
+            alarms = tp.process_alarms(t_now)
+            if alarms and self._publish_kafka_conn.get('alarm'):
+                self._publish_kafka_conn['alarm'].send_messages(alarms)
+            sent.extend(alarms)
+        return sent
+
+    def _fetch(self, topic):
+        """Put the batches of a topic into its queue until stopped."""
+        conf = cfg.CONF.thresholding_engine
+        conn = self._consume_kafka_conn[topic]
+        priority = 0 if topic in CONTROL_TOPICS else 1
+        while not self._stopped.is_set():
+            for msgs in conn.get_message_batches(conf.fetch_size,
+                                                 conf.fetch_timeout):
+                if self._stopped.is_set():
+                    return
+                if msgs:
+                    # the offsets after the batch, committed once handled
+                    self._queues.put(priority, (topic, msgs, conn.offsets()),
+                                     self._stopped)
+            # the batches end after an error, wait before fetching again
+            self._stopped.wait(conn.wait_time)
+
+    def bootstrap(self):
+        """Load all the current alarm definitions from ElasticSearch.
+
+        The alarmdefinitions topic is consumed afterwards from its last
+        committed offset. The definitions which are in kafka but were not
+        written to ElasticSearch yet are applied again then, which does no
+        harm since adding a processor replaces the one of the same name.
+        Returns the number of definitions loaded.
+        """
+        conf = cfg.CONF.thresholding_engine
+        if not conf.bootstrap or not cfg.CONF.es.uri:
+            return 0
+        start = time.time()
+        definitions = es_conn.ESConnection(conf.definition_doc_type)
+        count = 0
+        for hit in definitions.scan({'match_all': {}},
+                                    conf.bootstrap_page_size):
+            alarm_def = hit.get('_source') or {}
             try:
+                self.add_processor(alarm_def['name'], alarm_def)
+                count += 1
+            except Exception:
+                LOG.exception('Invalid alarm definition %s' % hit.get('_id'))
+        self.index_processors()
+        LOG.info('Loaded %d alarm definitions in %.2f seconds.',
+                 count, time.time() - start)
+        return count
+
+    def start_fetchers(self):
+        """Fetch each consumed topic from its own thread."""
+        for topic in self._consume_kafka_conn:
+            fetcher = threading.Thread(target=self._fetch, args=(topic,),
+                                       name='fetch-%s' % topic)
+            fetcher.daemon = True
+            fetcher.start()
+            self._fetchers.append(fetcher)
+
+    def run_once(self, timeout=None):
+        """Handle the next batch, the ones of control topics first.
 
-                if self._consume_kafka_conn.has_key('alarmdefinitions'):
-                    for msg in self._consume_kafka_conn['alarmdefinitions'].get_messages():
-                        if msg and msg.message:
-                            LOG.debug(msg.message.value)
-                            temp_admin = json.loads(msg.message.value)
-                            self.thresholding_processors[temp_admin['name']] = driver.DriverManager(
-                                PROCESSOR_NAMESPACE,
-                                cfg.CONF.thresholding_engine.processor,
-                                invoke_on_load=True,
-                                invoke_kwds=(msg.message.value)).driver
-                            LOG.debug(dir(self.thresholding_processors[temp_admin['name']]))
-                    self._consume_kafka_conn['alarmdefinitions'].commit()
-
-                if self._consume_kafka_conn.has_key('metrics'):
-                    for msg in self._consume_kafka_conn['metrics'].get_messages():
-                        if msg and msg.message:
-                            LOG.debug(msg.message.value)
-                            for alarm_def in self.thresholding_processors.keys():
-                                alarm = self.thresholding_processors[alarm_def].process_msg(
-                                    msg.message.value)
-                                if alarm and self._publish_kafka_conn['alarm']:
-                                    self._publish_kafka_conn['alarm'].send_messages(alarm)
-
-                    self._publish_kafka_conn['alarm'].commit()
+        The alarms are evaluated when evaluation_interval has passed.
+        """
+        interval = cfg.CONF.thresholding_engine.evaluation_interval
+        now = self.clock()
+        if now >= self._next_evaluation:
+            if self._next_evaluation:
+                self.evaluate(now)
+            self._next_evaluation = now + interval
+        wait = self._next_evaluation - now
+        if timeout is not None:
+            wait = min(wait, timeout)
 
+        item = self._queues.get(wait)
+        if item is None:
+            return None
+        topic, msgs, offsets = item
+        if topic == 'alarmdefinitions':
+            self.handle_alarm_definition_msgs(msgs)
+        elif topic == 'metrics':
+            self.handle_metrics_msgs(msgs)
+        else:
+            LOG.debug('%d messages of topic %s ignored', len(msgs), topic)
+        # the fetcher may have queued later batches, only the offsets of
+        # this one are committed
+        self._consume_kafka_conn[topic].commit_offsets(offsets)
+        return topic
+
+    def start(self):
+        try:
+            self.bootstrap()
+        except Exception:
+            LOG.exception('Failed to load the alarm definitions.')
+        self.start_fetchers()
+        while not self._stopped.is_set():
+            try:
+                self.run_once()
             except Exception:
                 LOG.exception('Error occurred while handling kafka messages.')
 
     def stop(self):
+        self._stopped.set()
         for topic in self._consume_kafka_conn.keys():
             self._consume_kafka_conn[topic].close()
         for topic in self._publish_kafka_conn.keys():
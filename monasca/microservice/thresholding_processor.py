@@ -14,55 +14,451 @@
 # under the License.
 
 import collections
-import json
+import fnmatch
 from monasca.common import alarm_expr_calculator as calculator
 from monasca.common import alarm_expr_parser as parser
+from monasca.common import codec
+from monasca.common import instrument
 from monasca.openstack.common import log
+import operator
+import re
 import time
 import uuid
 
 
 LOG = log.getLogger(__name__)
 
+# The schema and version of the envelope of the alarms sent by the processor.
+ALARM_SCHEMA = 'alarm'
+ALARM_VERSION = 2
+
+SERIES = instrument.gauge(
+    'monasca_thresholding_series',
+    'Series evaluated for an alarm definition.', ['alarm_definition'])
+EVAL_TIME = instrument.histogram(
+    'monasca_thresholding_eval_seconds',
+    'Time spent evaluating the alarms of an alarm definition.')
+EVICTED = instrument.counter(
+    'monasca_thresholding_series_evicted_total',
+    'Series evicted, because they were idle or over the limit.', ['reason'])
+
+
+# The parsed expressions of the alarm definitions, so that an expression
+# used by many definitions is parsed once.
+_PARSED = {}
+MAX_PARSED = 10000
+
+
+def parse_expression(expression):
+    """Parse an alarm expression, or get it parsed before."""
+    result = _PARSED.get(expression)
+    if result is None:
+        result = parser.AlarmExprParser(expression).parse_result
+        if len(_PARSED) >= MAX_PARSED:
+            _PARSED.clear()
+        _PARSED[expression] = result
+    return result
+
+
+def _normalize(value):
+    """Lower case a name or a dimension value the way they are matched."""
+    if isinstance(value, unicode):
+        return value.lower().encode('utf8')
+    if isinstance(value, str):
+        return value.lower()
+    return value
+
+
+# The characters which make a dimension value of an expression a pattern.
+_GLOB_CHARS = frozenset('*?[')
+# The compiled patterns of dimension values, shared by the definitions.
+_PATTERNS = {}
+
+
+def is_pattern(value):
+    """Check if a dimension value of an expression is a glob pattern."""
+    return isinstance(value, str) and bool(_GLOB_CHARS.intersection(value))
+
+
+def _compile_pattern(pattern):
+    """Compile a normalized glob pattern into a function matching values.
+
+    A pattern ending with its only * matches by prefix, other patterns are
+    translated into a regular expression.
+    """
+    match = _PATTERNS.get(pattern)
+    if match is None:
+        prefix = pattern[:-1]
+        if pattern.endswith('*') and not _GLOB_CHARS.intersection(prefix):
+            match = operator.methodcaller('startswith', prefix)
+        else:
+            match = re.compile(fnmatch.translate(pattern)).match
+        if len(_PATTERNS) >= MAX_PARSED:
+            _PATTERNS.clear()
+        _PATTERNS[pattern] = match
+    return match
+
+
+class DimensionMatcher(object):
+    """The dimension constraints of a sub expression, compiled once.
+
+    The values are normalized when the alarm definition is loaded. A value
+    holding *, ? or [ is a glob pattern, for example hostname=web-*, which
+    matches the metrics of every host it covers, so that a definition using
+    match_by does not need a copy per host.
+    """
+    __slots__ = ('key', '_exact', '_patterns')
+
+    def __init__(self, dimensions):
+        dimensions = dict((k, _normalize(v)) for k, v in dimensions.items())
+        # the canonical form of the constraints, used to share windows
+        self.key = tuple(sorted(dimensions.items()))
+        self._exact = []
+        self._patterns = []
+        for k, v in self.key:
+            if is_pattern(v):
+                self._patterns.append((k, _compile_pattern(v)))
+            else:
+                self._exact.append((k, v))
+
+    def __call__(self, match_dimensions):
+        """Check the normalized dimensions of a metric."""
+        for k, v in self._exact:
+            if match_dimensions.get(k) != v:
+                return False
+        for k, match in self._patterns:
+            value = match_dimensions.get(k)
+            if not isinstance(value, str) or not match(value):
+                return False
+        return True
+
+
+class Metric(dict):
+    """A decoded metric with its name and dimensions normalized for matching.
+
+    The metric is normalized once when it is decoded and then shared by all
+    the processors, it is stored and encoded like the plain dict it is.
+    """
+    __slots__ = ('match_name', 'match_dimensions', '_series_keys',
+                 '_sample_key')
+
+    def __init__(self, data):
+        super(Metric, self).__init__(data)
+        self.match_name = _normalize(self.get('name', ''))
+        self.match_dimensions = dict(
+            (k, _normalize(v))
+            for k, v in (self.get('dimensions') or {}).items())
+        self._series_keys = {}
+        self._sample_key = None
+
+    def sample_key(self):
+        """Get the key of the sample, its timestamp, name and dimensions.
+
+        Copies of a metric decoded more than once have the same key. A
+        metric with dimensions which can not be hashed is its own key.
+        """
+        if self._sample_key is None:
+            key = (self.get('timestamp'), self.match_name,
+                   tuple(sorted(self.match_dimensions.items())))
+            try:
+                hash(key)
+            except TypeError:
+                key = id(self)
+            self._sample_key = key
+        return self._sample_key
+
+    def series_key(self, match_by):
+        """Get the key of the series of the metric for match_by.
+
+        The key is the value of the dimension when match_by has one, and
+        the tuple of the values otherwise. None if the metric misses one of
+        the dimensions. The key is computed once per match_by and metric,
+        the definitions with the same match_by share it.
+        """
+        try:
+            return self._series_keys[match_by]
+        except KeyError:
+            pass
+        dimensions = self.get('dimensions') or {}
+        try:
+            values = tuple([dimensions[m] for m in match_by])
+        except KeyError:
+            key = None
+        else:
+            key = values[0] if len(values) == 1 else values
+        self._series_keys[match_by] = key
+        return key
+
+
+def decode_metrics(msg):
+    """Decode a message of one metric or a list of metrics into Metrics."""
+    data = codec.decode(msg)
+    if isinstance(data, dict):
+        data = [data]
+    return [Metric(item) for item in data]
+
+
+class Window(object):
+    """The metrics of one series of a sub expression.
+
+    A window is shared by all the alarm definitions with the same sub
+    expression apart from the function, the operator and the threshold.
+    The value of a function in each period is computed at most once per
+    evaluation time and set of metrics, however many definitions use it.
+    """
+    def __init__(self, period, periods):
+        self.period = float(period)
+        self.periods = int(periods)
+        self.metrics = collections.deque()
+        self.refs = 0
+        self._values = {}
+        self._sample_keys = set()
+
+    def append(self, metric):
+        # a sample added by several definitions is only kept once, even
+        # when each of them decoded its own copy
+        key = metric.sample_key()
+        if key in self._sample_keys:
+            return
+        self._sample_keys.add(key)
+        self.metrics.append(metric)
+        self._values.clear()
+
+    def expire(self, t_now):
+        """Delete metrics not in period."""
+        start_time = t_now - (self.period + 2) * self.periods
+        data_list = self.metrics
+        while data_list and data_list[0]['timestamp'] < start_time:
+            self._sample_keys.discard(data_list.popleft().sample_key())
+
+    def values(self, func, t_now):
+        """Get the value of func in each period, the latest period first.
+
+        An empty list is returned when the window has no metrics.
+        """
+        cached = self._values.get(func)
+        if cached and cached[0] == t_now:
+            return cached[1]
+
+        self.expire(t_now)
+        value_in_periods = []
+        data_list = self.metrics
+        if data_list:
+            period = self.period
+            left = t_now - period
+            temp_data = []
+            for i in range(len(data_list) - 1, -1, -1):
+                if data_list[i]['timestamp'] >= left:
+                    temp_data.append(data_list[i]['value'])
+                else:
+                    value_in_periods.append(
+                        calculator.calc_value(func, temp_data))
+                    left -= period
+                    temp_data = []
+            value_in_periods.append(calculator.calc_value(func, temp_data))
+        self._values[func] = (t_now, value_in_periods)
+        return value_in_periods
+
+
+class RemoteWindow(object):
+    """A window of a series evaluated by ElasticSearch.
+
+    The metrics are not kept, the engine sets the statistics of each period
+    from an aggregation over the metrics saved in ElasticSearch instead, so
+    the memory of a window does not grow with its length.
+    """
+    # the statistic of an aggregation holding the value of each function
+    STATS = {'AVG': 'avg', 'MAX': 'max', 'MIN': 'min', 'SUM': 'sum',
+             'COUNT': 'count'}
+
+    def __init__(self, period, periods):
+        self.period = float(period)
+        self.periods = int(periods)
+        self.metrics = ()
+        self.refs = 0
+        self.stats = []
+
+    def append(self, metric):
+        pass
+
+    def expire(self, t_now):
+        pass
+
+    def set_stats(self, stats):
+        """Set the statistics of each period, the latest period first.
+
+        A period without metrics has None instead of its statistics.
+        """
+        self.stats = stats
+
+    def values(self, func, t_now):
+        """Get the value of func in each period, the latest period first.
+
+        The values are the ones of the last aggregation, an empty list when
+        it found no metrics.
+        """
+        key = self.STATS.get(func)
+        return [stats.get(key) if stats and stats.get('count') else None
+                for stats in self.stats]
+
+
+class WindowStore(object):
+    """The windows of the sub expressions of a set of alarm definitions.
+
+    A window is keyed by the canonical form of its sub expression, the
+    metric name, dimensions, period and periods, together with the match_by
+    dimensions and values of its series. Windows are reference counted and
+    deleted when no definition uses them anymore.
+    """
+    def __init__(self):
+        self._windows = {}
+
+    def __len__(self):
+        return len(self._windows)
+
+    def acquire(self, key, period, periods, remote=False):
+        window = self._windows.get(key)
+        if window is None:
+            window_cls = RemoteWindow if remote else Window
+            window = self._windows[key] = window_cls(period, periods)
+        window.refs += 1
+        return window
+
+    def release(self, key):
+        window = self._windows.get(key)
+        if window is not None:
+            window.refs -= 1
+            if window.refs <= 0:
+                del self._windows[key]
+
+    def remote_windows(self):
+        """Group the remote windows by sub expression and match_by.
+
+        Returns a dict of the key of the windows without the series, that
+        is (name, dimensions, period, periods, match_by), to a dict of the
+        series to their window.
+        """
+        groups = {}
+        for key, window in self._windows.items():
+            if isinstance(window, RemoteWindow):
+                groups.setdefault(key[:-1], {})[key[-1]] = window
+        return groups
+
 
 class ThresholdingProcessor(object):
-    def __init__(self, alarm_def):
-        """One processor instance hold one alarm definition."""
+    def __init__(self, alarm_def, window_store=None, idle_windows=0,
+                 max_series=0, evict_state=None, clock=time.time,
+                 remote_window_seconds=0):
+        """One processor instance hold one alarm definition.
+
+        :param alarm_def: the alarm definition, as a message or decoded.
+        :param window_store: the WindowStore shared with the processors of
+            other alarm definitions, a private one when None.
+        :param idle_windows: series without metrics for this many windows
+            of the definition are evicted, 0 to keep them forever.
+        :param max_series: the maximum number of series, the least recently
+            updated ones are evicted beyond it. 0 for no limit.
+        :param evict_state: the state to report in a last alarm of an
+            evicted series, None to evict series silently.
+        :param clock: returns the current time in seconds, the time of the
+            metrics when they are replayed.
+        :param remote_window_seconds: the sub expressions with windows of at
+            least this many seconds get RemoteWindows, which the engine
+            evaluates in ElasticSearch. 0 keeps all the windows in memory.
+        """
         LOG.debug('initializing ThresholdProcessor!')
         super(ThresholdingProcessor, self).__init__()
-        self.alarm_definition = json.loads(alarm_def)
+        if isinstance(alarm_def, dict):
+            self.alarm_definition = alarm_def
+        else:
+            self.alarm_definition = codec.decode(alarm_def)
         self.expression = self.alarm_definition['expression']
         self.match_by = self.alarm_definition['match_by']
         self.expr_data_queue = {}
         if len(self.match_by) == 0:
             self.match_by = None
-        self.parse_result = (
-            parser.AlarmExprParser(self.expression).parse_result)
+        self._match_by = tuple(self.match_by or ())
+        self.parse_result = parse_expression(self.expression)
         self.sub_expr_list = self.parse_result.operands_list
+        # the normalized metric name and the compiled dimension matcher of
+        # each sub expression
+        self._matchers = [
+            (expr, _normalize(expr.normalized_metric_name),
+             DimensionMatcher(expr.dimensions_as_dict))
+            for expr in self.sub_expr_list]
+        self.metric_names = set(name for e, name, m in self._matchers)
+        self.window_store = (WindowStore() if window_store is None
+                             else window_store)
+        # the canonical form of each sub expression, keyed by its string
+        self._window_keys = {}
+        for expr, name, matcher in self._matchers:
+            self._window_keys[expr.fmtd_sub_expr_str] = (
+                expr, (name, matcher.key,
+                       float(expr.period), int(expr.periods),
+                       self._match_by))
+        # the sub expressions with windows evaluated by ElasticSearch
+        self._remote_exprs = set(
+            e.fmtd_sub_expr_str for e in self.sub_expr_list
+            if remote_window_seconds and
+            float(e.period) * int(e.periods) >= remote_window_seconds)
+        self._definition_id = self.alarm_definition.get('id', '')
+        self.clock = clock
+        self.idle_windows = idle_windows
+        self.max_series = max_series
+        self.evict_state = evict_state
+        # the seconds of the longest window of the sub expressions
+        self.window_seconds = max(
+            [float(e.period) * int(e.periods) for e in self.sub_expr_list])
+        self.evicted = 0
+        self._evicted_alarms = []
         LOG.debug('successfully initialize ThresholdProcessor!')
 
     def process_metrics(self, metrics):
-        """Add new metrics to matched expr."""
+        """Add new metrics to matched expr.
+
+        :param metrics: a message of one metric or a list of metrics, or
+            the Metrics already decoded from it by decode_metrics.
+        """
         try:
-            data = json.loads(metrics)
-            self.add_expr_metrics(data)
+            if isinstance(metrics, basestring):
+                metrics = decode_metrics(metrics)
+            elif isinstance(metrics, dict):
+                metrics = [metrics]
+            for data in metrics:
+                self.add_expr_metrics(data)
         except Exception:
             LOG.exception('process metrics error')
 
-    def process_alarms(self):
-        """Run every minute to produce alarm."""
+    def process_alarms(self, t_now=None):
+        """Run every minute to produce alarm.
+
+        :param t_now: the evaluation time, the processors sharing a window
+            store should be given the same one so that the values of the
+            shared windows are computed only once.
+        """
         try:
-            alarm_list = []
-            for m in self.expr_data_queue.keys():
-                if_updated = self.update_state(self.expr_data_queue[m])
-                if if_updated:
-                    alarm_list.append(self.build_alarm(m))
-            return alarm_list
+            with EVAL_TIME.time():
+                if t_now is None:
+                    t_now = self.clock()
+                alarm_list = self._evicted_alarms
+                self._evicted_alarms = []
+                if self.idle_windows > 0:
+                    self.evict_idle(t_now)
+                    alarm_list.extend(self._evicted_alarms)
+                    self._evicted_alarms = []
+                for m in self.expr_data_queue.keys():
+                    if_updated = self.update_state(self.expr_data_queue[m],
+                                                   t_now)
+                    if if_updated:
+                        alarm_list.append(self.build_alarm(m))
+                SERIES.labels(alarm_definition=self._definition_id).set(
+                    len(self.expr_data_queue))
+                return alarm_list
         except Exception:
             LOG.exception('process metrics error')
             return []
 
-    def update_state(self, expr_data):
+    def update_state(self, expr_data, t_now=None):
         """Update the state of each alarm under this alarm definition."""
 
         def _calc_state(operand):
@@ -74,148 +470,175 @@ class ThresholdingProcessor(object):
             else:
                 return expr_data['data'][operand.fmtd_sub_expr_str]['state']
 
+        if t_now is None:
+            t_now = self.clock()
         for sub_expr in self.sub_expr_list:
-            self.update_sub_expr_state(sub_expr, expr_data)
+            self.update_sub_expr_state(sub_expr, expr_data, t_now)
         state_new = _calc_state(self.parse_result)
         if state_new != expr_data['state']:
+            expr_data['old_state'] = expr_data['state']
             expr_data['state'] = state_new
+            expr_data['update_timestamp'] = t_now
             return True
         else:
             return False
 
-    def update_sub_expr_state(self, expr, expr_data):
-        def _update_metrics():
-            """Delete metrics not in period."""
-            data_list = expr_data['data'][expr.fmtd_sub_expr_str]['metrics']
-            start_time = t_now - (float(expr.period) + 2) * int(expr.periods)
-            while (len(data_list) != 0
-                   and data_list[0]['timestamp'] < start_time):
-                data_list.popleft()
-
-        def _update_state():
-            """Update state of a sub expr."""
-            data_sub = expr_data['data'][expr.fmtd_sub_expr_str]
-            data_list = data_sub['metrics']
-            if len(data_list) == 0:
-                data_sub['state'] = 'UNDETERMINED'
-            else:
-                period = float(expr.period)
-                right = t_now
-                left = right - period
-                temp_data = []
-                value_in_periods = []
-                for i in range(len(data_list) - 1, -1, -1):
-                    if data_list[i]['timestamp'] >= left:
-                        temp_data.append(data_list[i]['value'])
-                    else:
-                        value = calculator.calc_value(
-                            expr.normalized_func, temp_data)
-                        value_in_periods.append(value)
-                        right = left
-                        left = right - period
-                        temp_data = []
-                value = calculator.calc_value(
-                    expr.normalized_func, temp_data)
-                value_in_periods.append(value)
-                expr_data['data'][expr.fmtd_sub_expr_str]['state'] = (
-                    calculator.compare_thresh(
-                        value_in_periods,
-                        expr.normalized_operator,
-                        float(expr.threshold)))
-
-        t_now = time.time()
-        _update_metrics()
-        _update_state()
+    def update_sub_expr_state(self, expr, expr_data, t_now):
+        """Update state of a sub expr."""
+        data_sub = expr_data['data'][expr.fmtd_sub_expr_str]
+        value_in_periods = data_sub['window'].values(expr.normalized_func,
+                                                     t_now)
+        data_sub['values'] = value_in_periods
+        if not value_in_periods:
+            data_sub['state'] = 'UNDETERMINED'
+        else:
+            data_sub['state'] = calculator.compare_thresh(
+                value_in_periods,
+                expr.normalized_operator,
+                float(expr.threshold))
 
     def add_expr_metrics(self, data):
         """Add new metrics to matched place."""
-        for sub_expr in self.sub_expr_list:
-            self.add_sub_expr_metrics(sub_expr, data)
+        if not isinstance(data, Metric):
+            data = Metric(data)
+        if data.match_name not in self.metric_names:
+            return
+        for expr, name, matcher in self._matchers:
+            if self._has_match_expr(data, name, matcher):
+                self.add_sub_expr_metrics(expr, data)
+
+    @staticmethod
+    def _has_match_expr(data, name, matcher):
+        return data.match_name == name and matcher(data.match_dimensions)
 
     def add_sub_expr_metrics(self, expr, data):
         """Add new metrics to sub expr place."""
-
-        def _has_match_expr():
-            if (data['name'].lower().encode('utf8') !=
-                    expr.normalized_metric_name.encode('utf8')):
-                return False
-            metrics_dimensions = {}
-            if 'dimensions' in data:
-                metrics_dimensions = data['dimensions']
-            def_dimensions = expr.dimensions_as_dict
-            for dimension_key in def_dimensions.keys():
-                if dimension_key in metrics_dimensions:
-                    if (metrics_dimensions[
-                            dimension_key].lower().encode('utf8')
-                            != def_dimensions[
-                            dimension_key].lower().encode('utf8')):
-                        return False
-                else:
-                    return False
-            return True
-
-        def _add_metrics():
-            if self.match_by:
-                q_name = self.get_matched_data_queue_name(data)
-                if q_name:
-                    temp = self.expr_data_queue[q_name]['data']
-                    data_list = temp[expr.fmtd_sub_expr_str]['metrics']
-                    data_list.append(data)
-            else:
-                if None not in self.expr_data_queue:
-                    self.create_data_item(None)
-                temp = self.expr_data_queue[None]['data']
-                data_list = temp[expr.fmtd_sub_expr_str]['metrics']
-                data_list.append(data)
-
-        if _has_match_expr():
-            _add_metrics()
+        if self.match_by:
+            q_name = self.get_matched_data_queue_name(data)
+            if q_name is None:
+                return
+        else:
+            q_name = None
+            if None not in self.expr_data_queue:
+                self.create_data_item(None)
+        item = self.expr_data_queue[q_name]
+        item['data'][expr.fmtd_sub_expr_str]['window'].append(data)
+        timestamp = data.get('timestamp')
+        if timestamp > item['last_seen']:
+            item['last_seen'] = timestamp
 
     def create_data_item(self, name):
         """If not exist in dict, create one item."""
-        ts = time.time()
+        ts = self.clock()
         self.expr_data_queue[name] = {
             'data': {},
             'state': 'UNDETERMINED',
+            'old_state': 'UNDETERMINED',
             'create_timestamp': ts,
-            'update_timestamp': ts}
-        for expr in self.sub_expr_list:
-            self.expr_data_queue[name]['data'][expr.fmtd_sub_expr_str] = {
+            'update_timestamp': ts,
+            'last_seen': ts}
+        for sub_expr_str, (expr, key) in self._window_keys.items():
+            window = self.window_store.acquire(
+                key + (name,), expr.period, expr.periods,
+                remote=sub_expr_str in self._remote_exprs)
+            self.expr_data_queue[name]['data'][sub_expr_str] = {
                 'state': 'UNDETERMINED',
-                'metrics': collections.deque()}
+                'values': [],
+                'window': window}
+
+    def delete_data_item(self, name):
+        """Delete an item and release its windows."""
+        if self.expr_data_queue.pop(name, None) is None:
+            return
+        for expr, key in self._window_keys.values():
+            self.window_store.release(key + (name,))
+
+    def close(self):
+        """Release the windows of all the items and the series gauge.
+
+        A processor replacing this one sets the gauge again the next time
+        it evaluates.
+        """
+        for name in list(self.expr_data_queue):
+            self.delete_data_item(name)
+        SERIES.remove(alarm_definition=self._definition_id)
+
+    def evict(self, name, reason):
+        """Evict an item, with a last alarm if evict_state is set."""
+        item = self.expr_data_queue.get(name)
+        if item is None:
+            return
+        if self.evict_state and item['state'] != self.evict_state:
+            item['old_state'] = item['state']
+            item['state'] = self.evict_state
+            item['update_timestamp'] = self.clock()
+            self._evicted_alarms.append(self.build_alarm(name))
+        self.delete_data_item(name)
+        self.evicted += 1
+        EVICTED.labels(reason=reason).inc()
+
+    def evict_idle(self, t_now):
+        """Evict the items without metrics for idle_windows windows."""
+        deadline = t_now - self.idle_windows * self.window_seconds
+        for name, item in self.expr_data_queue.items():
+            if item['last_seen'] < deadline:
+                self.evict(name, 'idle')
+
+    def evict_lru(self, count):
+        """Evict the count least recently updated items."""
+        if count <= 0:
+            return
+        names = sorted(self.expr_data_queue,
+                       key=lambda n: self.expr_data_queue[n]['last_seen'])
+        for name in names[:count]:
+            self.evict(name, 'limit')
 
     def get_matched_data_queue_name(self, data):
-        name = ''
-        for m in self.match_by:
-            if m in data['dimensions']:
-                name = name + data['dimensions'][m]
-            else:
-                return None
-        if name in self.expr_data_queue:
+        if not isinstance(data, Metric):
+            data = Metric(data)
+        name = data.series_key(self._match_by)
+        if name is None or name in self.expr_data_queue:
             return name
         else:
+            if (self.max_series and
+                    len(self.expr_data_queue) >= self.max_series):
+                # evict a tenth more than needed, so that the items are not
+                # sorted again for every new one
+                self.evict_lru(len(self.expr_data_queue) -
+                               self.max_series + 1 + self.max_series // 10)
             self.create_data_item(name)
             return name
 
     def build_alarm(self, name):
-        """Build alarm json."""
+        """Build alarm json.
+
+        The alarm refers to its alarm definition by id and version, and
+        only carries the dimensions of its series and the state and values
+        of each sub expression, the consumers look the definition up.
+        """
+        item = self.expr_data_queue[name]
+        if self.match_by is None:
+            dimensions = {}
+        elif len(self.match_by) == 1:
+            dimensions = {self.match_by[0]: name}
+        else:
+            dimensions = dict(zip(self.match_by, name))
         alarm = {}
-        id = str(uuid.uuid4())
-        alarm['id'] = id
-        alarm['alarm-definition'] = self.alarm_definition
-        alarm['metrics'] = self.get_all_metrics(name)
-        alarm['state'] = self.expr_data_queue[name]['state']
-        t = self.expr_data_queue[name]['update_timestamp']
+        alarm['id'] = str(uuid.uuid4())
+        alarm['alarm_definition_id'] = self.alarm_definition.get('id')
+        alarm['alarm_definition_version'] = self.alarm_definition.get(
+            'version')
+        alarm['dimensions'] = dimensions
+        alarm['state'] = item['state']
+        alarm['old_state'] = item['old_state']
+        alarm['sub_alarms'] = [
+            {'sub_expression': sub_expr_str,
+             'state': data_sub['state'],
+             'values': data_sub['values']}
+            for sub_expr_str, data_sub in item['data'].items()]
+        t = item['update_timestamp']
         alarm['state_updated_timestamp'] = t
         alarm['updated_timestamp'] = t
-        alarm['created_timestamp'] = (
-            self.expr_data_queue[name]['create_timestamp'])
-        return json.dumps(alarm)
-
-    def get_all_metrics(self, name):
-        """Get all metrics related to one alarm."""
-        metrics_list = []
-        for expr in self.expr_data_queue[name]['data'].keys():
-            for metrics in self.expr_data_queue[name]['data'][expr]['metrics']:
-                metrics_list.append(metrics)
-        return metrics_list
+        alarm['created_timestamp'] = item['create_timestamp']
+        return codec.encode(alarm, schema=ALARM_SCHEMA,
+                            version=ALARM_VERSION)
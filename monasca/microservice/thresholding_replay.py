@@ -0,0 +1,176 @@
+# Copyright 2015 CMU
+# Author: Yihan Wang <wangff9@gmail.com>
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+# replays a recorded stream of metrics through the thresholding engine in
+# event time, as fast as it can be processed. The metrics file holds one
+# metric, or one list of metrics, per line, the way they are posted to the
+# metrics topic. The alarm definitions file holds a json list of alarm
+# definitions or one alarm definition per line. usage:
+#
+#     monasca-thresholding-replay --definitions definitions.json \
+#         --metrics metrics.ndjson --interval 60 --alarms-output alarms.ndjson
+#
+
+import argparse
+import json
+import time
+
+from oslo.config import cfg
+
+from monasca.common import codec
+from monasca.microservice import thresholding_engine as engine
+from monasca.microservice import thresholding_processor as processor
+from monasca.openstack.common import log
+
+LOG = log.getLogger(__name__)
+
+
+class ReplayClock(object):
+    """A clock which shows the time of the metrics replayed.
+
+    The time only moves forward, metrics arriving late do not turn it back.
+    """
+    def __init__(self, now=0):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+    def advance(self, now):
+        if now > self.now:
+            self.now = now
+
+
+def load_definitions(lines):
+    """Read a json list of alarm definitions or one definition per line."""
+    text = ''.join(lines).strip()
+    if text.startswith('['):
+        return json.loads(text)
+    return [json.loads(line) for line in text.splitlines() if line.strip()]
+
+
+def replay(th_engine, lines, interval):
+    """Feed the metrics of lines to an engine and evaluate in event time.
+
+    The engine has to use a ReplayClock. The alarms are evaluated each time
+    the metrics cross a multiple of interval seconds, and once more after
+    the last metric. Returns the statistics of the replay and the alarms.
+    """
+    clock = th_engine.clock
+    alarms = []
+    count = 0
+    first = None
+    next_evaluation = None
+    start = time.time()
+    for line in lines:
+        if not line.strip():
+            continue
+        try:
+            metrics = processor.decode_metrics(line)
+        except Exception:
+            LOG.exception('Invalid metrics %s' % line)
+            continue
+        for metric in metrics:
+            timestamp = metric.get('timestamp')
+            if timestamp is None:
+                continue
+            if next_evaluation is None:
+                first = timestamp
+                next_evaluation = (timestamp // interval + 1) * interval
+            while timestamp >= next_evaluation:
+                clock.advance(next_evaluation)
+                alarms.extend(th_engine.evaluate(next_evaluation))
+                next_evaluation += interval
+            clock.advance(timestamp)
+            th_engine.process_metric(metric)
+            count += 1
+    if count:
+        alarms.extend(th_engine.evaluate(clock()))
+    wall = time.time() - start
+
+    states = {}
+    for alarm in alarms:
+        state = codec.decode(alarm).get('state')
+        states[state] = states.get(state, 0) + 1
+    event_seconds = clock() - first if count else 0
+    stats = {'metrics': count,
+             'alarms': len(alarms),
+             'alarm_states': states,
+             'wall_seconds': round(wall, 3),
+             'metrics_per_sec': round(count / wall, 1) if wall else 0,
+             'event_seconds': round(event_seconds, 3),
+             'speedup': round(event_seconds / wall, 1) if wall else 0}
+    return stats, alarms
+
+
+def create_engine(definitions):
+    """Create an engine running on a ReplayClock with the definitions.
+
+    The engine neither loads the definitions from ElasticSearch nor sends
+    the alarms to kafka, they are only returned by the replay. All the
+    windows are kept in memory, since the metrics replayed are not in
+    ElasticSearch.
+    """
+    cfg.CONF.set_override('uri', 'memory://replay', group='kafka_opts')
+    cfg.CONF.set_override('drop_data', True, group='kafka_opts')
+    cfg.CONF.set_override('bootstrap', False, group='thresholding_engine')
+    cfg.CONF.set_override('remote_window_seconds', 0,
+                          group='thresholding_engine')
+    th_engine = engine.ThresholdingEngine(clock=ReplayClock())
+    for alarm_def in definitions:
+        th_engine.add_processor(alarm_def['name'], alarm_def)
+    th_engine.index_processors()
+    return th_engine
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Replay recorded metrics through the thresholding '
+                    'engine in event time.')
+    parser.add_argument('--definitions', required=True,
+                        help='file of the alarm definitions')
+    parser.add_argument('--metrics', required=True,
+                        help='file of the metrics, one json per line')
+    parser.add_argument('--interval', type=float,
+                        help='seconds of event time between evaluations, '
+                             'evaluation_interval by default')
+    parser.add_argument('--alarms-output',
+                        help='write the alarms to a file, one per line')
+    parser.add_argument('--config-file', action='append', default=[],
+                        help='monasca configuration files')
+    args = parser.parse_args()
+
+    conf_args = []
+    for config_file in args.config_file:
+        conf_args.extend(['--config-file', config_file])
+    cfg.CONF(args=conf_args, project='monasca')
+    log.setup('monasca')
+
+    with open(args.definitions) as f:
+        th_engine = create_engine(load_definitions(f))
+    interval = (args.interval or
+                cfg.CONF.thresholding_engine.evaluation_interval)
+    with open(args.metrics) as f:
+        stats, alarms = replay(th_engine, f, interval)
+
+    if args.alarms_output:
+        with open(args.alarms_output, 'w') as f:
+            for alarm in alarms:
+                f.write(alarm + '\n')
+    print(json.dumps(stats, indent=2, sort_keys=True))
+
+
+if __name__ == '__main__':
+    main()
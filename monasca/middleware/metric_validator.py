@@ -15,13 +15,15 @@
 # under the License.
 
 
-import datetime
-import StringIO
 try:
     import ujson as json
 except ImportError:
     import json
 
+from monasca.common import json_stream
+from monasca.common import metric_util
+from monasca.openstack.common import strutils
+
 
 class MetricValidator(object):
     """middleware that validate the metric input stream.
@@ -31,10 +33,39 @@ class MetricValidator(object):
     is valid json and compliant with the spec, then the request will forward
     the request to the next in the pipeline, otherwise, it will reject the
     request with response code of 400 or 406.
+
+    The body is parsed only once. The validated metrics are normalized and
+    serialized here and handed to the next in the pipeline through the wsgi
+    environment, so neither the dispatcher nor the persister has to parse
+    them again.
+
+    The following options can be set in the filter section of the paste
+    configuration:
+
+        [filter:validator]
+        use = egg: monasca#metric_validator
+        # maximum size in bytes of a metric post, 0 means no limit
+        max_body_size = 10485760
+        # validate large bodies metric by metric instead of all at once
+        streaming = true
+        # number of validated metrics handed on at a time when streaming
+        chunk_size = 1000
+        # region added to the metrics, with the tenantId of the request
+        region = region-a
+
+    In streaming mode the body is never held in memory as a whole. The
+    validated metrics are handed to the next in the pipeline as an iterator
+    of chunks, and a chunk is only parsed when the previous one has been
+    consumed. A request with an invalid metric is still rejected, but the
+    chunks before that metric may have been accepted already.
     """
     def __init__(self, app, conf):
         self.app = app
         self.conf = conf
+        self.max_body_size = int(conf.get('max_body_size', 10485760))
+        self.streaming = strutils.bool_from_string(conf.get('streaming'))
+        self.chunk_size = int(conf.get('chunk_size', 1000))
+        self.region = conf.get('region') or None
 
     def _is_valid_metric(self, metric):
         """Validate a message
@@ -50,18 +81,9 @@ class MetricValidator(object):
            "value":1.0
         }
 
-        Once this is validated, the message needs to be transformed into
-        the following internal format:
-
-        The current valid message format is as follows (interna):
-        {
-            "metric": {"something": "The metric as a JSON object"},
-            "meta": {
-                "tenantId": "the tenant ID acquired",
-                "region": "the region that the metric was submitted under",
-            },
-            "creation_time": "the time when the API received the metric",
-        }
+        Once this is validated, the timestamp and the dimensions_hash of the
+        message are fixed up, see metric_util.normalize, and the tenantId
+        and region the metric was posted under are added to it.
         """
         if (metric.get('name') and metric.get('dimensions') and
                 metric.get('timestamp') and metric.get('value')):
@@ -69,6 +91,37 @@ class MetricValidator(object):
         else:
             return False
 
+    def _serialize(self, metric, env):
+        """Normalize and serialize a valid metric with its tenant and region.
+
+        The tenantId is the project the request was authenticated for, not
+        the one posted with the metric.
+        """
+        metric = metric_util.normalize(metric)
+        metric['tenantId'] = env.get('HTTP_X_PROJECT_ID')
+        metric['region'] = self.region
+        return metric_util.serialize(metric)
+
+    def _validate_chunks(self, reader, env):
+        """Validate the metrics read so far and yield them in chunks."""
+        chunk = []
+        for metric in reader:
+            if not self._is_valid_metric(metric):
+                raise ValueError('Invalid metric %s' % metric)
+            chunk.append(self._serialize(metric, env))
+            if len(chunk) >= self.chunk_size:
+                yield chunk
+                chunk = []
+        if chunk:
+            yield chunk
+
+    @staticmethod
+    def _content_length(env):
+        try:
+            return int(env.get('CONTENT_LENGTH'))
+        except (TypeError, ValueError):
+            return None
+
     def __call__(self, env, start_response):
         # if request starts with /datapoints/, then let it go on.
         # this login middle
@@ -77,35 +130,40 @@ class MetricValidator(object):
             # We only check the requests which are posting against metrics
             # endpoint
             try:
-                body = env['wsgi.input'].read()
+                if self.streaming:
+                    reader = json_stream.ItemReader(
+                        env['wsgi.input'], self._content_length(env),
+                        self.max_body_size)
+                    env[metric_util.ENV_METRICS] = (
+                        self._validate_chunks(reader, env))
+                    return self.app(env, start_response)
+
+                length = self._content_length(env)
+                if length is None:
+                    body = env['wsgi.input'].read()
+                elif self.max_body_size and length > self.max_body_size:
+                    raise json_stream.TooLarge()
+                else:
+                    body = env['wsgi.input'].read(length)
+                if self.max_body_size and len(body) > self.max_body_size:
+                    raise json_stream.TooLarge()
                 metrics = json.loads(body)
-                # Do business logic validation here.
-                is_valid = True
-                if isinstance(metrics, list):
-                    for metric in metrics:
-                        if not self._is_valid_metric(metric):
-                            is_valid = False
-                            break
+                if not isinstance(metrics, list):
+                    metrics = [metrics]
+
+                # Do business logic validation here, normalize and serialize
+                # each metric in the same pass.
+                validated = []
+                for metric in metrics:
+                    if not self._is_valid_metric(metric):
+                        break
+                    validated.append(self._serialize(metric, env))
                 else:
-                    is_valid = self._is_valid_metric(metrics)
-
-                if is_valid:
-                    # If the message is valid, then wrap it into this internal
-                    # format. The tenantId should be available from the
-                    # request since this should have been authenticated.
-                    # ideally this transformation should be done somewhere
-                    # else. For the sake of simplicity, do the simple one
-                    # here to make the life a bit easier.
-
-                    # TODO(HP) Add logic to get region id from request header
-                    # HTTP_X_SERVICE_CATALOG, then find endpoints, then region
-                    region_id = None
-                    msg = {'metric': metrics,
-                           'meta': {'tenantId': env.get('HTTP_X_PROJECT_ID'),
-                                    'region': region_id},
-                           'creation_time': datetime.datetime.now()}
-                    env['wsgi.input'] = StringIO.StringIO(json.dumps(msg))
+                    env[metric_util.ENV_METRICS] = validated
                     return self.app(env, start_response)
+            except json_stream.TooLarge:
+                start_response("413 Request Entity Too Large", [], '')
+                return []
             except Exception:
                 pass
             # It is either invalid or exceptioned out while parsing json
@@ -232,6 +232,18 @@ class BaseLoggerAdapter(logging.LoggerAdapter):
     def audit(self, msg, *args, **kwargs):
         self.log(logging.AUDIT, msg, *args, **kwargs)
 
+    def debug(self, msg, *args, **kwargs):
+        # NOTE: logging.LoggerAdapter processes the message before the
+        # level is checked, check it first so that a disabled debug call
+        # costs no more than the check. Pass the values to format as args
+        # so that the formatting is deferred as well.
+        if self.isEnabledFor(logging.DEBUG):
+            self.log(logging.DEBUG, msg, *args, **kwargs)
+
+    def info(self, msg, *args, **kwargs):
+        if self.isEnabledFor(logging.INFO):
+            self.log(logging.INFO, msg, *args, **kwargs)
+
     def isEnabledFor(self, level):
         if _PY26:
             # This method was added in python 2.7 (and it does the exact
@@ -579,6 +591,25 @@ def getLazyLogger(name='unknown', version='unknown'):
     return LazyAdapter(name, version)
 
 
+class Lazy(object):
+    """A log argument which is only computed if the record is emitted.
+
+    For example, the following only dumps the object when debug is on::
+
+        LOG.debug('Sending %s', log.Lazy(json.dumps, obj))
+    """
+    def __init__(self, func, *args, **kwargs):
+        self.func = func
+        self.args = args
+        self.kwargs = kwargs
+
+    def __str__(self):
+        return str(self.func(*self.args, **self.kwargs))
+
+    def __unicode__(self):
+        return six.text_type(self.func(*self.args, **self.kwargs))
+
+
 class WritableLogger(object):
     """A thin wrapper that responds to `write` and logs."""
 
@@ -0,0 +1,47 @@
+# Copyright 2014 IBM Corp
+#
+# Author: Tong Li <litong01@us.ibm.com>
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+import mock
+from oslotest import base
+
+from monasca.api import server
+
+
+class TestServer(base.BaseTestCase):
+
+    def test_workers_configured(self):
+        self.assertEqual(3, server.get_workers(3, 'sync'))
+        self.assertEqual(3, server.get_workers(3, 'eventlet'))
+
+    def test_workers_from_cores(self):
+        with mock.patch.object(server.multiprocessing, 'cpu_count',
+                               return_value=4):
+            self.assertEqual(9, server.get_workers(0, 'sync'))
+            self.assertEqual(4, server.get_workers(0, 'eventlet'))
+            self.assertEqual(4, server.get_workers(0, 'gevent'))
+
+    def test_main_parses_command_line(self):
+        argv = ['monasca-api', '--config-file', '/etc/monasca/monasca.conf']
+        with mock.patch.object(server, 'cfg') as cfg, \
+                mock.patch.object(server, '_conf_parsed', False), \
+                mock.patch.object(server, 'gunicorn_base', None), \
+                mock.patch.object(server, 'simple_server'), \
+                mock.patch.object(server, 'load_app'), \
+                mock.patch.object(server.sys, 'argv', argv):
+            server.main()
+            cfg.CONF.assert_called_once_with(args=argv[1:],
+                                             project='monasca')
+            self.assertTrue(server._conf_parsed)
@@ -0,0 +1,66 @@
+#!/usr/bin/python
+# Copyright 2013 IBM Corp
+#
+# Author: Tong Li <litong01@us.ibm.com>
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+# this script compares the throughput of decoding kafka messages with
+# ast.literal_eval against the json codec. usage:
+#
+#     python bench_codec.py [number of messages]
+#
+
+import ast
+import json
+import sys
+import time
+
+from monasca.common import codec
+
+
+MOLD = {"alarm_definition": {"id": "f9935bcc-9641-4cbf-8224-0993a947ea83",
+                             "name": "cpu usage",
+                             "expression": "avg(cpu.usage{os=linux}) > 90",
+                             "alarm_actions": ["c60ec47e-5038-4bf1-9f95",
+                                               "c60ec47e-5038-4bf1-9f96"],
+                             "severity": "LOW"},
+        "metrics": [{"name": "cpu.usage",
+                     "dimensions": {"os": "linux", "host": "h1"}}],
+        "state": "ALARM",
+        "reason": "The alarm threshold(s) have been exceeded.",
+        "updated_timestamp": 1424123456.123,
+        "created_timestamp": 1424123400.456}
+
+
+def bench(func, msgs):
+    start = time.time()
+    for msg in msgs:
+        func(msg)
+    return len(msgs) / (time.time() - start)
+
+
+def bench_codec(argv):
+    count = int(argv[0]) if argv else 100000
+    msgs = [json.dumps(MOLD)] * count
+
+    result = {'messages': count,
+              'literal_eval_per_sec': bench(ast.literal_eval, msgs),
+              'codec_per_sec': bench(codec.decode, msgs)}
+    result['speedup'] = (result['codec_per_sec'] /
+                         result['literal_eval_per_sec'])
+    print(json.dumps(result, indent=2))
+
+
+if __name__ == '__main__':
+    bench_codec(sys.argv[1:])
@@ -0,0 +1,225 @@
+#!/usr/bin/python
+# Copyright 2014 IBM Corp
+#
+# Author: Tong Li <litong01@us.ibm.com>
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+# this script measures the sustained throughput of the metric ingest path,
+# from the api down to ElasticSearch, without a kafka or ElasticSearch
+# server. The metrics are generated like setup_metrics does and posted to
+# the api in process. The api sends them to the in memory kafka of
+# monasca.common.memory_kafka, from where the persister consumes them and
+# writes them in bulk to the local ElasticSearch of monasca.common.local_es.
+# For each stage the throughput, the p50/p99 latency and the memory are
+# printed as json, so that runs can be compared. usage:
+#
+#     python -m monasca.tests.benchmarks.bench_ingest --names 100 \
+#         --dimensions 10 --batch 50 --concurrency 4 --requests 2000
+#
+
+import argparse
+import json
+import random
+import resource
+import string
+import threading
+import time
+
+from falcon import testing
+from oslo.config import cfg
+
+from monasca.common import kafka_conn
+from monasca.common import local_es
+from monasca.common import resource_api
+from monasca.microservice import es_persister
+from monasca.microservice import metrics_fixer
+from monasca.middleware import metric_validator
+from monasca.v2.elasticsearch import metrics
+
+
+MOLD = {"name": "name1",
+        "timestamp": '2014-12-01',
+        "value": 100
+        }
+
+
+def _random_str(size=6):
+    return ''.join(random.sample(string.ascii_uppercase * size, size))
+
+
+def generate_bodies(args):
+    """Generate the request bodies, names x dimensions distinct series."""
+    series = []
+    for n in range(args.names):
+        name = 'bench.%s' % _random_str()
+        for d in range(args.dimensions):
+            series.append((name, {'hostname': 'host%d' % d,
+                                  'service': 'monitoring',
+                                  'key_%d' % (d % 10): _random_str()}))
+
+    bodies = []
+    the_time = time.time()
+    for r in range(args.requests):
+        batch = []
+        for b in range(args.batch):
+            name, dimensions = series[(r * args.batch + b) % len(series)]
+            metric = dict(MOLD)
+            metric['name'] = name
+            metric['dimensions'] = dimensions
+            metric['timestamp'] = the_time + r
+            metric['value'] = round(random.random() * 100, 2) + 1
+            batch.append(metric)
+        bodies.append(json.dumps(batch if args.batch > 1 else batch[0]))
+    return len(series), bodies
+
+
+def _percentile(latencies, p):
+    if not latencies:
+        return 0
+    return latencies[min(len(latencies) - 1, int(len(latencies) * p))]
+
+
+def _stage_result(count, elapsed, latencies, rss_before):
+    latencies = sorted(latencies)
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return {'metrics': count,
+            'seconds': round(elapsed, 3),
+            'metrics_per_sec': round(count / elapsed, 1) if elapsed else 0,
+            'p50_ms': round(_percentile(latencies, 0.50) * 1000, 3),
+            'p99_ms': round(_percentile(latencies, 0.99) * 1000, 3),
+            'max_rss_kb': rss,
+            'rss_growth_kb': rss - rss_before}
+
+
+def bench_api(args, app, bodies):
+    """Post the bodies to the api from args.concurrency threads."""
+    latencies = []
+    errors = []
+    lock = threading.Lock()
+
+    def _post(part):
+        local = []
+        for body in part:
+            env = testing.create_environ('/v2.0/metrics/', method='POST',
+                                         body=body)
+            start_response = testing.StartResponseMock()
+            start = time.time()
+            app(env, start_response)
+            local.append(time.time() - start)
+            if not start_response.status.startswith('20'):
+                errors.append(start_response.status)
+        with lock:
+            latencies.extend(local)
+
+    rss_before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    threads = [threading.Thread(target=_post,
+                                args=(bodies[i::args.concurrency],))
+               for i in range(args.concurrency)]
+    start = time.time()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    result = _stage_result(len(bodies) * args.batch, time.time() - start,
+                           latencies, rss_before)
+    result['requests'] = len(bodies)
+    result['errors'] = len(errors)
+    return result
+
+
+def bench_persister(args, sent, server):
+    """Consume the metrics from kafka and write them to ElasticSearch."""
+    persister = es_persister.ESPersister()
+    persister.msg_processor = metrics_fixer.MetricsFixer()
+    batches = persister._kafka_conn.get_message_batches(args.bulk, 0.1)
+    latencies = []
+    consumed = 0
+    rss_before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    start = time.time()
+    while consumed < sent:
+        batch_start = time.time()
+        msgs = next(batches)
+        if not msgs:
+            break
+        persister.handle_msgs(msgs)
+        latencies.append(time.time() - batch_start)
+        consumed += len(msgs)
+    result = _stage_result(consumed, time.time() - start, latencies,
+                           rss_before)
+    result['bulk_requests'] = len(latencies)
+    result['documents_written'] = server.count()
+    return result
+
+
+def build_app(args):
+    server = local_es.LocalES()
+    cfg.CONF(args=[], project='monasca', default_config_files=[])
+    cfg.CONF.set_override('uri', 'memory://bench_ingest', group='kafka_opts')
+    cfg.CONF.set_override('uri', server.start(), group='es')
+    cfg.CONF.set_override('mapping_refresh', 0, group='metrics')
+
+    dispatcher = metrics.MetricDispatcher({})
+    app = resource_api.ResourceAPI()
+    app.add_route(None, dispatcher)
+    app = metric_validator.MetricValidator(
+        app, {'streaming': str(args.streaming),
+              'chunk_size': str(args.chunk_size)})
+    return app, server
+
+
+def bench_ingest(args):
+    series, bodies = generate_bodies(args)
+    app, server = build_app(args)
+    sent = kafka_conn.MESSAGES_OUT.labels(topic='metrics')
+
+    result = {'config': dict(vars(args), series=series),
+              'stages': {}}
+    result['stages']['api'] = bench_api(args, app, bodies)
+    result['stages']['persister'] = bench_persister(
+        args, int(sent.value), server)
+    server.stop()
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Benchmark the metric ingest path.')
+    parser.add_argument('--names', type=int, default=100,
+                        help='number of metric names')
+    parser.add_argument('--dimensions', type=int, default=10,
+                        help='dimension combinations per metric name')
+    parser.add_argument('--batch', type=int, default=10,
+                        help='metrics per request')
+    parser.add_argument('--requests', type=int, default=1000,
+                        help='number of requests')
+    parser.add_argument('--concurrency', type=int, default=1,
+                        help='number of threads posting requests')
+    parser.add_argument('--bulk', type=int, default=500,
+                        help='metrics per bulk request to ElasticSearch')
+    parser.add_argument('--streaming', action='store_true',
+                        help='validate the posts in streaming mode')
+    parser.add_argument('--chunk-size', type=int, default=1000,
+                        help='metrics per chunk in streaming mode')
+    parser.add_argument('--output', help='also write the result to a file')
+    args = parser.parse_args()
+
+    result = json.dumps(bench_ingest(args), indent=2, sort_keys=True)
+    print(result)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(result + '\n')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,77 @@
+#!/usr/bin/python
+# Copyright 2013 IBM Corp
+#
+# Author: Tong Li <litong01@us.ibm.com>
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+# this script measures the per message cost of the debug logging on the hot
+# paths, with debug on and off, for eagerly built messages and for messages
+# formatted by the logger. usage:
+#
+#     python -m monasca.tests.benchmarks.bench_logging [number of messages]
+#
+
+import json
+import logging
+import os
+import sys
+import time
+
+from monasca.openstack.common import log
+
+
+VALUE = json.dumps({"name": "cpu.usage",
+                    "dimensions": {"os": "linux", "host": "h1"},
+                    "timestamp": 1424123456.123,
+                    "value": 93.5})
+
+
+def eager(logger, count):
+    for i in range(count):
+        logger.debug('Message received: ' + VALUE)
+
+
+def deferred(logger, count):
+    for i in range(count):
+        logger.debug('Message received: %s', VALUE)
+
+
+def guarded(logger, count):
+    debug = logger.isEnabledFor(logging.DEBUG)
+    for i in range(count):
+        if debug:
+            logger.debug('Message received: %s', VALUE)
+
+
+def bench_logging(argv):
+    count = int(argv[0]) if argv else 100000
+    logger = log.getLogger('monasca.bench')
+    handler = logging.StreamHandler(open(os.devnull, 'w'))
+    logger.logger.addHandler(handler)
+    logger.logger.propagate = False
+
+    result = {'messages': count}
+    for level in (logging.DEBUG, logging.INFO):
+        logger.logger.setLevel(level)
+        mode = 'debug_on' if level == logging.DEBUG else 'debug_off'
+        for func in (eager, deferred, guarded):
+            start = time.time()
+            func(logger, count)
+            result['%s_%s_usec' % (mode, func.__name__)] = (
+                (time.time() - start) * 1000000.0 / count)
+    print(json.dumps(result, indent=2, sort_keys=True))
+
+
+if __name__ == '__main__':
+    bench_logging(sys.argv[1:])
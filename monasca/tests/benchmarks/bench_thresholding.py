@@ -0,0 +1,186 @@
+#!/usr/bin/python
+# Copyright 2015 CMU
+# Author: Yihan Wang <wangff9@gmail.com>
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+# this script measures the thresholding processor at scale. For every
+# combination of the given numbers of alarm definitions, match_by
+# cardinalities, points per window and sub expressions per alarm expression,
+# it feeds the metrics of full windows to one processor per alarm definition
+# and evaluates the alarms. Each combination runs in its own process so that
+# the memory of one does not count for the next, the results are printed as
+# a json list. usage:
+#
+#     python -m monasca.tests.benchmarks.bench_thresholding \
+#         --definitions 1,10 --cardinality 1,100 --points 10 --complexity 1,4
+#
+
+import argparse
+import itertools
+import json
+import resource
+import subprocess
+import sys
+import time
+
+from monasca.microservice import thresholding_processor as processor
+
+MODULE = 'monasca.tests.benchmarks.bench_thresholding'
+
+OPERATORS = ['>', '<', '>=', '<=']
+FUNCTIONS = ['avg', 'max', 'min', 'sum', 'count']
+
+
+def _expression(index, complexity, period, periods):
+    """An expression of complexity sub expressions joined with or."""
+    subs = []
+    for c in range(complexity):
+        subs.append('%s(cpu%d{service=monitoring}, %d) %s %d times %d' % (
+            FUNCTIONS[(index + c) % len(FUNCTIONS)], c, period,
+            OPERATORS[(index + c) % len(OPERATORS)], 50, periods))
+    return ' or '.join(subs)
+
+
+def _definition(index, args):
+    return json.dumps({
+        'id': 'bench-%d' % index,
+        'name': 'bench %d' % index,
+        'expression': _expression(index, args.complexity, args.period,
+                                  args.periods),
+        'match_by': ['hostname'] if args.cardinality > 1 else [],
+        'severity': 'LOW',
+        'ok_actions': [],
+        'alarm_actions': [],
+        'undetermined_actions': []})
+
+
+def _metrics(args, now):
+    """The metrics of a full window of every series, oldest first."""
+    window = args.period * args.periods
+    metrics = []
+    for p in range(args.points):
+        timestamp = now - window + window * (p + 1) / float(args.points + 1)
+        for host in range(args.cardinality):
+            for c in range(args.complexity):
+                metrics.append(json.dumps({
+                    'name': 'cpu%d' % c,
+                    'dimensions': {'service': 'monitoring',
+                                   'hostname': 'host%d' % host},
+                    'timestamp': timestamp,
+                    'value': (host * 7 + p * 13 + c) % 100}))
+    return metrics
+
+
+def _percentile(latencies, p):
+    latencies = sorted(latencies)
+    if not latencies:
+        return 0
+    return latencies[min(len(latencies) - 1, int(len(latencies) * p))]
+
+
+def run_case(args):
+    rss_start = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    processors = [processor.ThresholdingProcessor(_definition(i, args))
+                  for i in range(args.definitions)]
+    metrics = _metrics(args, time.time())
+    rss_before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    start = time.time()
+    for metric in metrics:
+        for tp in processors:
+            tp.process_metrics(metric)
+    ingest_time = time.time() - start
+    rss_after = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    latencies = []
+    alarms = 0
+    start = time.time()
+    for r in range(args.rounds):
+        for tp in processors:
+            eval_start = time.time()
+            alarms += len(tp.process_alarms())
+            latencies.append(time.time() - eval_start)
+    eval_time = time.time() - start
+
+    series = sum(len(tp.expr_data_queue) for tp in processors)
+    calls = len(metrics) * len(processors)
+    return {'definitions': args.definitions,
+            'cardinality': args.cardinality,
+            'points': args.points,
+            'complexity': args.complexity,
+            'series': series,
+            'process_metrics_calls': calls,
+            'process_metrics_per_sec': round(calls / ingest_time, 1),
+            'process_alarms_calls': len(latencies),
+            'process_alarms_per_sec': round(len(latencies) / eval_time, 1),
+            'eval_p50_ms': round(_percentile(latencies, 0.5) * 1000, 3),
+            'eval_p99_ms': round(_percentile(latencies, 0.99) * 1000, 3),
+            'alarms': alarms,
+            'base_rss_kb': rss_start,
+            'rss_per_series_kb': round(
+                float(rss_after - rss_before) / series, 3) if series else 0}
+
+
+def _ints(value):
+    return [int(v) for v in value.split(',')]
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Benchmark the thresholding processor.')
+    parser.add_argument('--definitions', type=_ints, default=[1, 10],
+                        help='numbers of alarm definitions')
+    parser.add_argument('--cardinality', type=_ints, default=[1, 100],
+                        help='numbers of distinct match_by values')
+    parser.add_argument('--points', type=_ints, default=[10],
+                        help='numbers of points per series per window')
+    parser.add_argument('--complexity', type=_ints, default=[1, 4],
+                        help='numbers of sub expressions per expression')
+    parser.add_argument('--period', type=int, default=60,
+                        help='seconds of a period of the sub expressions')
+    parser.add_argument('--periods', type=int, default=3,
+                        help='periods of the sub expressions')
+    parser.add_argument('--rounds', type=int, default=5,
+                        help='evaluations of every alarm definition')
+    parser.add_argument('--single', action='store_true',
+                        help='run the first combination in this process')
+    parser.add_argument('--output', help='also write the result to a file')
+    args = parser.parse_args()
+
+    if args.single:
+        for name in ('definitions', 'cardinality', 'points', 'complexity'):
+            setattr(args, name, getattr(args, name)[0])
+        print(json.dumps(run_case(args)))
+        return
+
+    results = []
+    for d, c, p, x in itertools.product(args.definitions, args.cardinality,
+                                        args.points, args.complexity):
+        out = subprocess.check_output([
+            sys.executable, '-m', MODULE, '--single',
+            '--definitions', str(d), '--cardinality', str(c),
+            '--points', str(p), '--complexity', str(x),
+            '--period', str(args.period), '--periods', str(args.periods),
+            '--rounds', str(args.rounds)])
+        results.append(json.loads(out.strip().splitlines()[-1]))
+
+    result = json.dumps(results, indent=2, sort_keys=True)
+    print(result)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(result + '\n')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,50 @@
+# Copyright 2013 IBM Corp
+#
+# Author: Tong Li <litong01@us.ibm.com>
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+from monasca.common import codec
+from monasca.openstack.common import log
+from monasca import tests
+
+LOG = log.getLogger(__name__)
+
+
+class TestCodec(tests.BaseTestCase):
+
+    def test_decode_json(self):
+        obj = codec.decode('{"a": true, "b": false, "c": null, "d": [1]}')
+        self.assertEqual({'a': True, 'b': False, 'c': None, 'd': [1]}, obj)
+
+    def test_decode_legacy_literal(self):
+        obj = codec.decode("{'a': True, 'b': u'x'}")
+        self.assertEqual({'a': True, 'b': 'x'}, obj)
+
+    def test_decode_invalid(self):
+        self.assertRaises(ValueError, codec.decode, '{"a": ')
+
+    def test_round_trip(self):
+        obj = {'id': 'abc', 'state': 'ALARM', 'value': 1.5}
+        self.assertEqual(obj, codec.decode(codec.encode(obj)))
+
+    def test_envelope(self):
+        msg = codec.encode({'id': 'abc'}, schema='alarm', version=2)
+        self.assertEqual({'id': 'abc'}, codec.decode(msg))
+        self.assertEqual({'id': 'abc'},
+                         codec.decode(msg, schema='alarm', max_version=2))
+
+    def test_envelope_rejected(self):
+        msg = codec.encode({'id': 'abc'}, schema='alarm', version=2)
+        self.assertRaises(ValueError, codec.decode, msg, schema='metric')
+        self.assertRaises(ValueError, codec.decode, msg, max_version=1)
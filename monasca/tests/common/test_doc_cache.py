@@ -0,0 +1,67 @@
+# Copyright 2015 Carnegie Mellon University
+#
+# Author: Han Chen <hanc@andrew.cmu.edu>
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+import mock
+import time
+
+from monasca.common import doc_cache
+from monasca.openstack.common import log
+from monasca import tests
+
+LOG = log.getLogger(__name__)
+
+
+class TestDocumentCache(tests.BaseTestCase):
+
+    def setUp(self):
+        super(TestDocumentCache, self).setUp()
+        self.es_conn = mock.Mock()
+        res = mock.Mock()
+        res.status_code = 200
+        res.json.return_value = {"hits": {"hits": [
+            {"_id": "id1", "_source": {"type": "EMAIL", "address": "a@b.c"}},
+            {"_id": "id2", "_source": {"type": "EMAIL", "address": "d@e.f"}}
+        ]}}
+        self.es_conn.get_messages_by_ids.return_value = res
+        self.cache = doc_cache.DocumentCache(self.es_conn, 300,
+                                             'notification methods')
+
+    def test_get(self):
+        docs = self.cache.get(['id1', 'id2', 'id1', 'id3'])
+        self.assertEqual(['id1', 'id2'], sorted(docs.keys()))
+        self.assertEqual('a@b.c', docs['id1']['address'])
+        # all the missing ids are loaded in one query
+        self.assertEqual(1, self.es_conn.get_messages_by_ids.call_count)
+        self.assertEqual(
+            ['id1', 'id2', 'id3'],
+            sorted(self.es_conn.get_messages_by_ids.call_args[0][0]))
+
+        docs = self.cache.get(['id1', 'id2'])
+        self.assertEqual(2, len(docs))
+        self.assertEqual(1, self.es_conn.get_messages_by_ids.call_count)
+
+    def test_expire_and_invalidate(self):
+        self.cache.get(['id1', 'id2'])
+        self.cache.invalidate('id1')
+        self.cache.get(['id1', 'id2'])
+        self.assertEqual(['id1'],
+                         self.es_conn.get_messages_by_ids.call_args[0][0])
+
+        with mock.patch.object(time, 'time', return_value=time.time() + 301):
+            self.cache.get(['id1', 'id2'])
+        self.assertEqual(
+            ['id1', 'id2'],
+            sorted(self.es_conn.get_messages_by_ids.call_args[0][0]))
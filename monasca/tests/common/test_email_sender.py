@@ -0,0 +1,140 @@
+# Copyright 2015 Carnegie Mellon University
+#
+# Author: Han Chen <hanc@andrew.cmu.edu>
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+import asyncore
+import email
+import smtpd
+import smtplib
+import socket
+import threading
+import time
+
+from oslo.config import fixture as fixture_config
+
+from monasca.common import email_sender
+from monasca.openstack.common import log
+from monasca import tests
+
+LOG = log.getLogger(__name__)
+
+
+class FakeSMTPServer(smtpd.SMTPServer):
+    """Local SMTP server which keeps the received emails in memory."""
+    def __init__(self):
+        smtpd.SMTPServer.__init__(self, ('127.0.0.1', 0), None)
+        self.port = self.socket.getsockname()[1]
+        self.emails = []
+
+    def process_message(self, peer, mailfrom, rcpttos, data):
+        self.emails.append((rcpttos, email.message_from_string(data)))
+
+
+class TestEmailSender(tests.BaseTestCase):
+
+    def setUp(self):
+        super(TestEmailSender, self).setUp()
+        self.server = FakeSMTPServer()
+        self.loop = threading.Thread(
+            target=asyncore.loop, kwargs={'timeout': 0.1})
+        self.loop.daemon = True
+        self.loop.start()
+        self.addCleanup(self.server.close)
+
+        self.CONF = self.useFixture(fixture_config.Config()).conf
+        self.CONF.set_override('host', '127.0.0.1', group='email')
+        self.CONF.set_override('port', self.server.port, group='email')
+        self.CONF.set_override('starttls', False, group='email')
+        self.CONF.set_override('workers', 1, group='email')
+        self.CONF.set_override('retry_interval', 0.01, group='email')
+
+    def _wait(self, count):
+        for i in range(100):
+            if len(self.server.emails) >= count:
+                break
+            time.sleep(0.05)
+
+    def test_send_merged(self):
+        sender = email_sender.EmailSender()
+        self.assertTrue(sender.send(['a@b.c'], 'alarm 1', 'content 1'))
+        self.assertTrue(sender.send(['a@b.c', 'd@e.f'], 'alarm 2',
+                                    'content 2'))
+        sender.start()
+        self._wait(2)
+        sender.stop()
+
+        # the two emails to a@b.c are merged into one
+        self.assertEqual(2, len(self.server.emails))
+        by_addr = dict((rcpttos[0], msg) for rcpttos, msg in
+                       self.server.emails)
+        self.assertEqual('alarm 1 (and 1 more)', by_addr['a@b.c']['Subject'])
+        self.assertIn('content 2', by_addr['a@b.c'].get_payload())
+        self.assertEqual('alarm 2', by_addr['d@e.f']['Subject'])
+
+    def test_callback(self):
+        sender = email_sender.EmailSender()
+        results = []
+        sender.send(['a@b.c', 'd@e.f'], 'alarm 1', 'content 1',
+                    results.append)
+        sender.send(['a@b.c'], 'alarm 2', 'content 2', results.append)
+        sender.start()
+        self._wait(2)
+        for i in range(100):
+            if len(results) >= 2:
+                break
+            time.sleep(0.05)
+        sender.stop()
+
+        # called once per email, after all of its addresses
+        self.assertEqual([True, True], results)
+
+    def test_reconnect(self):
+        sender = email_sender.EmailSender()
+        sender.start()
+        sender.send(['a@b.c'], 'alarm 1', 'content 1')
+        self._wait(1)
+
+        # drop the connection of the worker, the next email still arrives
+        for channel in asyncore.socket_map.values():
+            if isinstance(channel, smtpd.SMTPChannel):
+                channel.close()
+        sender.send(['a@b.c'], 'alarm 2', 'content 2')
+        self._wait(2)
+        sender.stop()
+
+        self.assertEqual(['alarm 1', 'alarm 2'],
+                         [msg['Subject'] for r, msg in self.server.emails])
+
+    def test_queue_full(self):
+        self.CONF.set_override('queue_size', 1, group='email')
+        sender = email_sender.EmailSender()
+        self.assertTrue(sender.send(['a@b.c'], 'alarm 1', 'content 1'))
+        self.assertFalse(sender.send(['a@b.c'], 'alarm 2', 'content 2'))
+
+    def test_timeout(self):
+        # a server which accepts connections but never answers
+        listener = socket.socket()
+        listener.bind(('127.0.0.1', 0))
+        listener.listen(1)
+        self.addCleanup(listener.close)
+        self.CONF.set_override('port', listener.getsockname()[1],
+                               group='email')
+        self.CONF.set_override('timeout', 0.2, group='email')
+
+        conn = email_sender.SMTPConnection()
+        start = time.time()
+        self.assertRaises(smtplib.SMTPServerDisconnected, conn.sendmail,
+                          'a@b.c', ['d@e.f'], 'content')
+        self.assertLess(time.time() - start, 5)
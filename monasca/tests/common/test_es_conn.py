@@ -0,0 +1,133 @@
+# Copyright 2013 IBM Corp
+#
+# Author: Tong Li <litong01@us.ibm.com>
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+import json
+import mock
+from oslo.config import fixture as fixture_config
+from oslotest import base
+
+from monasca.common import es_conn
+from monasca.common import local_es
+from monasca.openstack.common import log
+
+LOG = log.getLogger(__name__)
+
+
+def _lines(body):
+    return [json.loads(line) for line in body.splitlines()]
+
+
+class TestBulkBatch(base.BaseTestCase):
+
+    def test_collapse(self):
+        batch = es_conn.BulkBatch()
+        batch.index('a', {'id': 'a', 'state': 'OK'})
+        batch.index('a', {'id': 'a', 'state': 'ALARM'})
+        batch.index('b', {'id': 'b'})
+        batch.delete('b')
+        batch.update('c', {'state': 'OK'})
+        batch.update('c', {'reason': 'r'})
+        self.assertEqual(3, len(batch))
+        self.assertEqual([{'index': {'_id': 'a'}},
+                          {'id': 'a', 'state': 'ALARM'},
+                          {'delete': {'_id': 'b'}},
+                          {'update': {'_id': 'c'}},
+                          {'doc': {'state': 'OK', 'reason': 'r'}}],
+                         _lines(batch.body()))
+
+    def test_update_after_index_and_delete(self):
+        batch = es_conn.BulkBatch()
+        batch.index('a', {'id': 'a', 'state': 'OK'})
+        batch.update('a', {'state': 'ALARM'})
+        batch.delete('b')
+        batch.update('b', {'state': 'ALARM'})
+        self.assertEqual([{'index': {'_id': 'a'}},
+                          {'id': 'a', 'state': 'ALARM'},
+                          {'delete': {'_id': 'b'}}],
+                         _lines(batch.body()))
+
+    def test_update_merges_objects(self):
+        batch = es_conn.BulkBatch()
+        batch.index('a', {'id': 'a', 'dimensions': {'h': 'h1', 'az': '1'}})
+        batch.update('a', {'dimensions': {'az': '2'}, 'state': 'OK'})
+        batch.update('b', {'dimensions': {'h': 'h1'}})
+        batch.update('b', {'dimensions': {'az': '1'}, 'tags': ['x']})
+        batch.update('b', {'tags': ['y']})
+        self.assertEqual([{'index': {'_id': 'a'}},
+                          {'id': 'a', 'state': 'OK',
+                           'dimensions': {'h': 'h1', 'az': '2'}},
+                          {'update': {'_id': 'b'}},
+                          {'doc': {'dimensions': {'h': 'h1', 'az': '1'},
+                                   'tags': ['y']}}],
+                         _lines(batch.body()))
+
+    def test_add_request(self):
+        batch = es_conn.BulkBatch()
+        self.assertEqual(('POST', 'a'),
+                         batch.add_request({'id': 'a', 'request': 'POST'}))
+        self.assertEqual(('DEL', 'a'),
+                         batch.add_request({'id': 'a', 'request': 'DEL'}))
+        self.assertEqual((None, None),
+                         batch.add_request({'id': 'b', 'request': 'GET'}))
+        self.assertEqual([{'delete': {'_id': 'a'}}], _lines(batch.body()))
+
+    def test_add_message(self):
+        batch = es_conn.BulkBatch()
+        self.assertEqual((None, None), batch.add_message('not json'))
+        self.assertEqual((None, None), batch.add_message('[1]'))
+        self.assertEqual(('POST', 'a'), batch.add_message(
+            json.dumps({'id': 'a', 'request': 'POST', 'state': 'OK'})))
+        self.assertEqual([{'index': {'_id': 'a'}}, {'id': 'a', 'state': 'OK'}],
+                         _lines(batch.body()))
+
+
+class TestESConnection(base.BaseTestCase):
+
+    def setUp(self):
+        super(TestESConnection, self).setUp()
+        self.CONF = self.useFixture(fixture_config.Config()).conf
+        self.CONF.set_override('uri', 'http://fake_es:9200', group='es')
+        self.conn = es_conn.ESConnection('alarms')
+
+    def test_bulk_messages(self):
+        batch = es_conn.BulkBatch()
+        batch.index('a', {'id': 'a'})
+        res = mock.Mock(status_code=200)
+        res.json.return_value = {'errors': False, 'items': []}
+        with mock.patch.object(es_conn.requests, 'post',
+                               return_value=res) as post:
+            self.conn.bulk_messages(batch)
+            self.conn.bulk_messages(es_conn.BulkBatch())
+        post.assert_called_once_with(self.conn.base_path + '/_bulk',
+                                     data=batch.body())
+
+    def test_scan_clears_scroll(self):
+        server = local_es.LocalES()
+        self.CONF.set_override('uri', server.start(), group='es')
+        self.addCleanup(server.stop)
+        for i in range(5):
+            server.store.index('monasca_1', 'alarms', 'a%d' % i, {'n': i})
+        conn = es_conn.ESConnection('alarms')
+
+        self.assertEqual(5, len(list(conn.scan({'match_all': {}}, 2))))
+        self.assertEqual({}, server.app._scrolls)
+
+        # stopping early clears the scroll as well
+        hits = conn.scan({'match_all': {}}, 2)
+        next(hits)
+        self.assertEqual(1, len(server.app._scrolls))
+        hits.close()
+        self.assertEqual({}, server.app._scrolls)
@@ -0,0 +1,145 @@
+# Copyright 2013 IBM Corp
+#
+# Author: Tong Li <litong01@us.ibm.com>
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+import json
+import os
+import shutil
+import tempfile
+
+import mock
+from oslo.config import fixture as fixture_config
+
+from monasca.common import instrument
+from monasca.openstack.common import log
+from monasca import tests
+
+LOG = log.getLogger(__name__)
+
+
+class TestInstrument(tests.BaseTestCase):
+
+    def setUp(self):
+        super(TestInstrument, self).setUp()
+        self.registry = instrument.Registry()
+
+    def test_counter(self):
+        c = self.registry.register(instrument.Counter, 'sent_total',
+                                   'Sent.', ['topic'])
+        c.labels(topic='a').inc()
+        c.labels('a').inc(2)
+        c.labels(topic='b').inc()
+        self.assertEqual('# HELP sent_total Sent.\n'
+                         '# TYPE sent_total counter\n'
+                         'sent_total{topic="a"} 3.0\n'
+                         'sent_total{topic="b"} 1.0\n',
+                         self.registry.render())
+        self.assertRaises(ValueError, c.inc)
+
+        c.remove(topic='a')
+        c.remove('c')
+        self.assertEqual('# HELP sent_total Sent.\n'
+                         '# TYPE sent_total counter\n'
+                         'sent_total{topic="b"} 1.0\n',
+                         self.registry.render())
+
+    def test_register_twice(self):
+        g = self.registry.register(instrument.Gauge, 'g', 'G.')
+        self.assertIs(g, self.registry.register(instrument.Gauge, 'g', 'G.'))
+        self.assertRaises(ValueError, self.registry.register,
+                          instrument.Counter, 'g', 'G.')
+
+    def test_histogram(self):
+        h = self.registry.register(instrument.Histogram, 'h', 'H.',
+                                   buckets=(1, 5))
+        h.observe(0.5)
+        h.observe(1)
+        h.observe(3)
+        h.observe(10)
+        self.assertEqual('# HELP h H.\n'
+                         '# TYPE h histogram\n'
+                         'h_bucket{le="1.0"} 2\n'
+                         'h_bucket{le="5.0"} 3\n'
+                         'h_bucket{le="+Inf"} 4\n'
+                         'h_sum 14.5\n'
+                         'h_count 4\n',
+                         self.registry.render())
+
+    def test_timed(self):
+        h = self.registry.register(instrument.Histogram, 'h', 'H.',
+                                   ['endpoint'])
+
+        @instrument.timed(h, endpoint='GET /')
+        def func(x):
+            return x + 1
+
+        self.assertEqual(2, func(1))
+        self.assertIn('h_count{endpoint="GET /"} 1',
+                      self.registry.render())
+
+    def test_metrics_app(self):
+        instrument.counter('monasca_test_total', 'Test.').inc()
+        start_response = mock.Mock()
+        body = ''.join(instrument.metrics_app({'PATH_INFO': '/metrics'},
+                                              start_response))
+        self.assertEqual('200 OK', start_response.call_args[0][0])
+        self.assertIn('monasca_test_total 1.0', body)
+        instrument.metrics_app({'PATH_INFO': '/other'}, start_response)
+        self.assertEqual('404 Not Found', start_response.call_args[0][0])
+
+    def test_merge(self):
+        other = instrument.Registry()
+        for registry, amount in ((self.registry, 1), (other, 2)):
+            registry.register(instrument.Counter, 'c_total', 'C.',
+                              ['topic']).labels('a').inc(amount)
+            registry.register(instrument.Gauge, 'g', 'G.').set(amount)
+            registry.register(instrument.Histogram, 'h', 'H.',
+                              buckets=[1]).observe(amount)
+        merged = instrument.Registry()
+        merged.merge(json.loads(json.dumps(self.registry.snapshot())))
+        merged.merge(json.loads(json.dumps(other.snapshot())),
+                     gauges=False)
+        body = merged.render()
+        self.assertIn('c_total{topic="a"} 3.0', body)
+        self.assertIn('g 1.0', body)
+        self.assertIn('h_bucket{le="1.0"} 1', body)
+        self.assertIn('h_count 2', body)
+        self.assertIn('h_sum 3.0', body)
+
+    def test_multiprocess_render(self):
+        path = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, path)
+        conf = self.useFixture(fixture_config.Config()).conf
+        conf.set_override('multiprocess_dir', path, group='instrument')
+        self.assertNotIn('monasca_worker_total 5.0', instrument.render())
+
+        # the metrics of a worker which exited
+        worker = instrument.Registry()
+        worker.register(instrument.Counter, 'monasca_worker_total',
+                        'W.').inc(5)
+        worker.register(instrument.Gauge, 'monasca_worker_busy',
+                        'W.').set(1)
+        with open(os.path.join(path, '999999999.json'), 'w') as f:
+            json.dump(worker.snapshot(), f)
+        instrument.counter('monasca_worker_total', 'W.').inc()
+
+        with mock.patch.object(instrument, '_multiprocess_pid', os.getpid()):
+            body = instrument.render()
+        self.assertIn('monasca_worker_total 6.0', body)
+        self.assertNotIn('monasca_worker_busy', body)
+        self.assertIn('%d.json' % os.getpid(), os.listdir(path))
+
+        instrument.clear_multiprocess()
+        self.assertEqual([], os.listdir(path))
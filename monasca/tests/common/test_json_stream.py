@@ -0,0 +1,57 @@
+# Copyright 2013 IBM Corp
+#
+# Author: Tong Li <litong01@us.ibm.com>
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+import json
+import StringIO
+
+from monasca.common import json_stream
+from monasca.openstack.common import log
+from monasca import tests
+
+LOG = log.getLogger(__name__)
+
+
+class TestItemReader(tests.BaseTestCase):
+
+    def _read(self, body, **kwargs):
+        return list(json_stream.ItemReader(StringIO.StringIO(body), **kwargs))
+
+    def test_array(self):
+        items = [{'name': 'name%d' % i, 'value': i * 1.5,
+                  'dimensions': {'key': 'a, "b" ]}'}} for i in range(100)]
+        body = json.dumps(items)
+        # a tiny read size makes items span multiple reads
+        self.assertEqual(items, self._read(body, read_size=7))
+        self.assertEqual(items, self._read(body, length=len(body)))
+
+    def test_single_object_and_scalars(self):
+        self.assertEqual([{'name': 'a'}], self._read(' {"name": "a"} '))
+        self.assertEqual([], self._read('[ ]'))
+        self.assertEqual([12345, 6], self._read('[12345, 6]', read_size=3))
+
+    def test_invalid(self):
+        self.assertRaises(ValueError, self._read, '')
+        self.assertRaises(ValueError, self._read, '[{"name": "a"}')
+        self.assertRaises(ValueError, self._read, '[{"name": "a"} {}]')
+        self.assertRaises(ValueError, self._read, '{"name": "a"} x')
+
+    def test_too_large(self):
+        body = json.dumps([{'name': 'a'}] * 100)
+        self.assertRaises(json_stream.TooLarge, self._read, body,
+                          max_size=100)
+        self.assertRaises(json_stream.TooLarge, self._read, body,
+                          length=len(body), max_size=100)
+        self.assertEqual(100, len(self._read(body, max_size=len(body))))
@@ -0,0 +1,151 @@
+# Copyright 2013 IBM Corp
+#
+# Author: Tong Li <litong01@us.ibm.com>
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+import json
+import requests
+
+from monasca.common import local_es
+from monasca.openstack.common import log
+from monasca import tests
+
+LOG = log.getLogger(__name__)
+
+BULK = ('{"index":{"_id":"1"}}\n'
+        '{"name":"cpu","dimensions":{"host":"h1"},"timestamp":10,'
+        '"value":1.0}\n'
+        '{"index":{"_id":"2"}}\n'
+        '{"name":"cpu","dimensions":{"host":"h2"},"timestamp":20,'
+        '"value":3.0}\n'
+        '{"index":{"_id":"3"}}\n'
+        '{"name":"mem","dimensions":{"host":"h1"},"timestamp":400,'
+        '"value":5.0}\n')
+
+
+class TestLocalES(tests.BaseTestCase):
+
+    def setUp(self):
+        super(TestLocalES, self).setUp()
+        self.server = local_es.LocalES()
+        self.uri = self.server.start()
+        self.addCleanup(self.server.stop)
+        res = requests.post(self.uri + 'data_1/metrics/_bulk', data=BULK)
+        self.assertEqual(200, res.status_code)
+        self.assertFalse(res.json()['errors'])
+
+    def _search(self, body, path='data_*/metrics/_search'):
+        res = requests.post(self.uri + path, data=json.dumps(body))
+        self.assertEqual(200, res.status_code)
+        return res.json()
+
+    def test_query(self):
+        obj = self._search({'query': {'bool': {'must': [
+            {'match': {'name': 'CPU'}},
+            {'range': {'timestamp': {'gte': 15, 'lt': 100}}}]}}})
+        self.assertEqual(['2'], [h['_id'] for h in obj['hits']['hits']])
+
+        obj = self._search({'query': {'ids': {'values': ['1', '3']}},
+                            'sort': [{'timestamp': 'desc'}]})
+        self.assertEqual(['3', '1'], [h['_id'] for h in obj['hits']['hits']])
+
+        res = requests.get(self.uri + 'data_1/metrics/_search?q=_id:2')
+        self.assertEqual(1, res.json()['hits']['total'])
+
+    def test_aggregations(self):
+        obj = self._search({'aggs': {'by_name': {
+            'terms': {'field': 'name', 'size': 10},
+            'aggs': {
+                'top': {'top_hits': {'size': 1, '_source': {
+                    'exclude': ['timestamp', 'value']}}},
+                'periods': {
+                    'date_histogram': {'field': 'timestamp',
+                                       'interval': '300s'},
+                    'aggs': {'statistics': {'stats': {'field': 'value'}}}}
+            }}}}, path='data_*/metrics/_search?search_type=count')
+        self.assertEqual([], obj['hits']['hits'])
+        buckets = obj['aggregations']['by_name']['buckets']
+        self.assertEqual(['cpu', 'mem'], [b['key'] for b in buckets])
+        self.assertEqual({'name': 'cpu', 'dimensions': {'host': 'h1'}},
+                         buckets[0]['top']['hits']['hits'][0]['_source'])
+        stats = buckets[0]['periods']['buckets'][0]['statistics']
+        self.assertEqual(2, stats['count'])
+        self.assertEqual(2.0, stats['avg'])
+        self.assertEqual([300],
+                         [b['key'] for b in buckets[1]['periods']['buckets']])
+
+    def test_filter_aggregations(self):
+        obj = self._search({'aggs': {
+            'cpu': {
+                'filter': {'bool': {'must': [
+                    {'match': {'name': 'cpu'}},
+                    {'wildcard': {'dimensions.host': 'h*'}}]}},
+                'aggs': {'periods': {
+                    'date_histogram': {'field': 'timestamp',
+                                       'interval': '10s', 'offset': '5s'},
+                    'aggs': {'statistics': {'stats': {'field': 'value'}}}}}},
+            'none': {'filter': {'wildcard': {'dimensions.host': 'H?'}}},
+            'h1': {'filter': {'regexp': {'dimensions.host': '[hH]1'}}},
+            'prefix': {'filter': {'regexp': {'dimensions.host': 'h'}}}}},
+            path='data_*/metrics/_search?search_type=count')
+        aggs = obj['aggregations']
+        self.assertEqual(2, aggs['cpu']['doc_count'])
+        self.assertEqual([5, 15], [b['key'] for b in
+                                   aggs['cpu']['periods']['buckets']])
+        self.assertEqual(0, aggs['none']['doc_count'])
+        self.assertEqual(2, aggs['h1']['doc_count'])
+        self.assertEqual(0, aggs['prefix']['doc_count'])
+
+    def test_documents(self):
+        bulk = ('{"update":{"_id":"1"}}\n{"doc":{"value":9.0}}\n'
+                '{"delete":{"_id":"2"}}\n'
+                '{"update":{"_id":"4"}}\n{"doc":{"value":9.0}}\n')
+        res = requests.post(self.uri + 'data_1/metrics/_bulk', data=bulk)
+        self.assertTrue(res.json()['errors'])
+        self.assertEqual(2, self.server.count())
+
+        res = requests.post(self.uri + 'data_1/metrics/_mget',
+                            data=json.dumps({'ids': ['1', '2']}))
+        docs = res.json()['docs']
+        self.assertEqual(9.0, docs[0]['_source']['value'])
+        self.assertFalse(docs[1]['found'])
+
+        res = requests.put(self.uri + 'data_1/metrics/5',
+                           data=json.dumps({'name': 'disk'}))
+        self.assertEqual(201, res.status_code)
+        res = requests.get(self.uri + 'data_1/metrics/5')
+        self.assertEqual({'name': 'disk'}, res.json()['_source'])
+        res = requests.delete(self.uri + 'data_1/metrics/5')
+        self.assertEqual(200, res.status_code)
+        res = requests.get(self.uri + 'data_1/metrics/5')
+        self.assertEqual(404, res.status_code)
+
+    def test_mapping(self):
+        res = requests.get(self.uri + 'data_*/_mappings/metrics')
+        props = res.json()['data_1']['mappings']['metrics']['properties']
+        self.assertEqual({'host': {'type': 'string'}},
+                         props['dimensions']['properties'])
+
+    def test_scroll(self):
+        res = requests.post(self.uri + 'data_*/metrics/_search?scroll=1m'
+                            '&size=2', data=json.dumps(
+                                {'query': {'match_all': {}}}))
+        obj = res.json()
+        self.assertEqual(2, len(obj['hits']['hits']))
+        res = requests.post(self.uri + '_search/scroll?scroll=1m',
+                            data=obj['_scroll_id'])
+        self.assertEqual(1, len(res.json()['hits']['hits']))
+        res = requests.post(self.uri + '_search/scroll?scroll=1m',
+                            data=obj['_scroll_id'])
+        self.assertEqual([], res.json()['hits']['hits'])
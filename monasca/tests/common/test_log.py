@@ -0,0 +1,52 @@
+# Copyright 2013 IBM Corp
+#
+# Author: Tong Li <litong01@us.ibm.com>
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+import logging
+import mock
+import StringIO
+
+from monasca.openstack.common import log
+from monasca import tests
+
+
+class TestLazyLogging(tests.BaseTestCase):
+
+    def setUp(self):
+        super(TestLazyLogging, self).setUp()
+        self.LOG = log.getLogger('monasca.tests.lazy')
+        self.stream = StringIO.StringIO()
+        handler = logging.StreamHandler(self.stream)
+        self.LOG.logger.addHandler(handler)
+        self.addCleanup(self.LOG.logger.removeHandler, handler)
+        self.addCleanup(self.LOG.logger.setLevel, logging.NOTSET)
+        self.LOG.logger.propagate = False
+        self.addCleanup(setattr, self.LOG.logger, 'propagate', True)
+
+    def test_debug_off(self):
+        self.LOG.logger.setLevel(logging.INFO)
+        func = mock.Mock(return_value='value')
+        with mock.patch.object(self.LOG, 'process') as process:
+            self.LOG.debug('dumped %s', log.Lazy(func))
+        self.assertFalse(process.called)
+        self.assertFalse(func.called)
+        self.assertEqual('', self.stream.getvalue())
+
+    def test_debug_on(self):
+        self.LOG.logger.setLevel(logging.DEBUG)
+        func = mock.Mock(return_value='value')
+        self.LOG.debug('dumped %s', log.Lazy(func, 1))
+        func.assert_called_once_with(1)
+        self.assertEqual('dumped value\n', self.stream.getvalue())
@@ -0,0 +1,93 @@
+# Copyright 2013 IBM Corp
+#
+# Author: Tong Li <litong01@us.ibm.com>
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+from oslo.config import fixture as fixture_config
+from oslotest import base
+
+from monasca.common import kafka_conn
+from monasca.common import memory_kafka
+from monasca.openstack.common import log
+
+LOG = log.getLogger(__name__)
+
+
+class TestMemoryKafka(base.BaseTestCase):
+
+    def setUp(self):
+        super(TestMemoryKafka, self).setUp()
+        self.CONF = self.useFixture(fixture_config.Config()).conf
+        self.CONF.set_override('uri', 'memory://test', group='kafka_opts')
+        self.CONF.set_override('group', 'g1', group='kafka_opts')
+        self.addCleanup(memory_kafka.reset)
+
+    def _values(self, msgs):
+        return [msg.message.value for msg in msgs]
+
+    def test_send_and_consume(self):
+        producer = kafka_conn.KafkaConnection('metrics')
+        self.assertEqual(204, producer.send_messages(['a', 'b', 'c']))
+
+        consumer = kafka_conn.KafkaConnection('metrics')
+        batches = consumer.get_message_batches(2, 0)
+        self.assertEqual(['a', 'b'], self._values(next(batches)))
+        self.assertEqual(['c'], self._values(next(batches)))
+        self.assertEqual([], next(batches))
+
+    def test_commit_resumes_group(self):
+        kafka_conn.KafkaConnection('metrics').send_messages(['a', 'b'])
+        consumer = kafka_conn.KafkaConnection('metrics')
+        self.assertEqual(['a'], self._values(
+            next(consumer.get_message_batches(1, 0))))
+        consumer.commit()
+
+        consumer = kafka_conn.KafkaConnection('metrics')
+        self.assertEqual(['b'], self._values(
+            next(consumer.get_message_batches(10, 0))))
+
+        # another group starts from the beginning
+        self.CONF.set_override('group', 'g2', group='kafka_opts')
+        consumer = kafka_conn.KafkaConnection('metrics')
+        self.assertEqual(['a', 'b'], self._values(
+            next(consumer.get_message_batches(10, 0))))
+
+    def test_partitions(self):
+        self.CONF.set_override('partitions', [0, 1], group='kafka_opts')
+        consumer = kafka_conn.KafkaConnection('alarms')
+        batches = consumer.get_message_batches(10, 0)
+        self.assertEqual([], next(batches))
+
+        kafka_conn.KafkaConnection('alarms').send_messages(['a', 'b', 'c'])
+        broker = memory_kafka.get_broker('memory://test')
+        self.assertEqual({0: 2, 1: 1}, broker.end_offsets('alarms', [0, 1]))
+        self.assertEqual(['a', 'c', 'b'], self._values(next(batches)))
+
+    def test_retention(self):
+        broker = memory_kafka.Broker(retention=2)
+        broker.append('t', ['a', 'b', 'c'])
+        positions = {0: 0}
+        msgs = broker.fetch('t', positions, 10, 0)
+        self.assertEqual([1, 2], [msg.offset for msg in msgs])
+        self.assertEqual({0: 3}, positions)
+
+    def test_forked_process_creates_own_client(self):
+        conn = kafka_conn.KafkaConnection('metrics')
+        conn.send_messages(['a'])
+        client = conn._client
+        self.assertIsNotNone(client)
+
+        conn._pid = -1
+        conn.send_messages(['b'])
+        self.assertIsNot(client, conn._client)
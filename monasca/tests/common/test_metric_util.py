@@ -0,0 +1,50 @@
+# Copyright 2013 IBM Corp
+#
+# Author: Tong Li <litong01@us.ibm.com>
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+import json
+
+from monasca.common import metric_util
+from monasca.openstack.common import log
+from monasca import tests
+
+LOG = log.getLogger(__name__)
+
+
+class TestMetricUtil(tests.BaseTestCase):
+
+    def test_normalize(self):
+        metric = metric_util.normalize(
+            {'name': 'name1', 'dimensions': {'key1': 'value1'},
+             'timestamp': '2015-01-31T13:35:00Z'})
+        self.assertEqual(1422711300.0, metric['timestamp'])
+        self.assertEqual(metric_util.dimensions_hash({'key1': 'value1'}),
+                         metric['dimensions_hash'])
+
+        metric = metric_util.normalize({'name': 'name1'})
+        self.assertTrue(metric['timestamp'])
+        self.assertFalse(metric.get('dimensions_hash'))
+
+    def test_serialize(self):
+        metric = metric_util.normalize(
+            {'name': 'name1', 'dimensions': {'key1': 'value1'},
+             'timestamp': 1422711300, 'value': 1.5})
+        msg = metric_util.serialize(metric)
+        self.assertTrue(metric_util.is_normalized(msg))
+        self.assertEqual(metric, json.loads(msg))
+
+        msg = metric_util.serialize({'name': 'name1', 'timestamp': 1})
+        self.assertFalse(metric_util.is_normalized(msg))
+        self.assertEqual({'name': 'name1', 'timestamp': 1}, json.loads(msg))
@@ -0,0 +1,102 @@
+# Copyright 2013 IBM Corp
+#
+# Author: Tong Li <litong01@us.ibm.com>
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+import os
+import shutil
+import tempfile
+
+from monasca.common import spool
+from monasca.openstack.common import log
+from monasca import tests
+
+LOG = log.getLogger(__name__)
+
+
+class TestSpool(tests.BaseTestCase):
+
+    def setUp(self):
+        super(TestSpool, self).setUp()
+        self.path = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.path)
+
+    def _segments(self):
+        return [name for name in os.listdir(self.path)
+                if name.endswith(spool.SEGMENT_SUFFIX)]
+
+    def test_replay_in_order(self):
+        s = spool.Spool(self.path, segment_size=20)
+        for i in range(5):
+            self.assertTrue(s.append('payload%d' % i))
+        self.assertEqual(5, len(self._segments()))
+
+        sent = []
+        self.assertEqual(5, s.replay(lambda p: sent.append(p) or True))
+        self.assertEqual(['payload%d' % i for i in range(5)], sent)
+        self.assertTrue(s.empty())
+        self.assertEqual([], self._segments())
+        self.assertEqual(0, s.size)
+
+        s.append('again')
+        self.assertEqual(1, s.replay(lambda p: sent.append(p) or True))
+        self.assertEqual('again', sent[-1])
+
+    def test_replay_resumes(self):
+        s = spool.Spool(self.path)
+        for i in range(3):
+            s.append('payload%d' % i)
+        sent = []
+
+        def _send(payload):
+            if payload == 'payload1' and 'payload1' not in sent:
+                sent.append(payload)
+                return False
+            sent.append(payload)
+            return True
+
+        self.assertEqual(1, s.replay(_send))
+        self.assertFalse(s.empty())
+
+        # a new spool on the same directory starts where the replay stopped
+        s = spool.Spool(self.path)
+        self.assertEqual(2, s.replay(_send))
+        self.assertEqual(['payload0', 'payload1', 'payload1', 'payload2'],
+                         sent)
+
+    def test_replay_limit(self):
+        s = spool.Spool(self.path)
+        for i in range(3):
+            s.append('payload%d' % i)
+        self.assertEqual(2, s.replay(lambda p: True, limit=2))
+        self.assertEqual(1, s.replay(lambda p: True))
+
+    def test_max_size(self):
+        s = spool.Spool(self.path, max_size=30)
+        self.assertTrue(s.append('x' * 10))
+        self.assertTrue(s.append('x' * 10))
+        self.assertFalse(s.append('x' * 10))
+        self.assertEqual(2, s.replay(lambda p: True))
+
+    def test_truncated_payload(self):
+        s = spool.Spool(self.path)
+        s.append('payload0')
+        s.append('payload1')
+        s._writer.truncate(s._writer.tell() - 3)
+        s._writer.close()
+        s = spool.Spool(self.path)
+        sent = []
+        self.assertEqual(1, s.replay(lambda p: sent.append(p) or True))
+        self.assertEqual(['payload0'], sent)
+        self.assertTrue(s.empty())
@@ -0,0 +1,95 @@
+# Copyright 2013 IBM Corp
+#
+# Author: Tong Li <litong01@us.ibm.com>
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+import mock
+from oslo.config import fixture as fixture_config
+import requests
+import shutil
+import tempfile
+
+from monasca.microservice import es_persister
+from monasca.openstack.common import log
+from monasca import tests
+
+LOG = log.getLogger(__name__)
+
+
+class TestESPersister(tests.BaseTestCase):
+
+    def setUp(self):
+        super(TestESPersister, self).setUp()
+        self.path = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.path)
+        self.CONF = self.useFixture(fixture_config.Config()).conf
+        self.CONF.set_override('uri', 'fake_url', group='kafka_opts')
+        self.CONF.set_override('uri', 'http://fake_es:9200', group='es')
+        self.CONF.set_override('spool_dir', self.path, group='es_persister')
+        self.CONF.set_override('spool_replay_rate', 0, group='es_persister')
+        self.CONF.set_override('spool_retry_interval', 0,
+                               group='es_persister')
+        self.persister = es_persister.ESPersister()
+
+    def _msgs(self, *values):
+        msgs = []
+        for value in values:
+            msg = mock.Mock()
+            msg.message.value = value
+            msgs.append(msg)
+        return msgs
+
+    def test_spool_when_es_is_down(self):
+        ok = mock.Mock(status_code=200)
+        send = self.persister._es_conn.send_messages = mock.Mock()
+
+        send.side_effect = requests.ConnectionError()
+        self.persister.handle_msgs(self._msgs('a\n', 'b'))
+        self.assertFalse(self.persister._spool.empty())
+
+        # while the spool has payloads, new ones go after them
+        send.side_effect = None
+        send.return_value = ok
+        self.persister.handle_msgs(self._msgs('c\n'))
+        self.assertEqual(1, send.call_count)
+
+        self.persister._replay()
+        self.assertTrue(self.persister._spool.empty())
+        self.assertEqual(['a\nb\n', 'c\n'],
+                         [c[0][0] for c in send.call_args_list[1:]])
+
+        self.persister.handle_msgs(self._msgs('d\n'))
+        send.assert_called_with('d\n')
+
+    def test_replay_limit(self):
+        self.CONF.set_override('spool_replay_limit', 2, group='es_persister')
+        send = self.persister._es_conn.send_messages = mock.Mock()
+        send.side_effect = requests.ConnectionError()
+        for value in ('a\n', 'b\n', 'c\n'):
+            self.persister.handle_msgs(self._msgs(value))
+
+        send.side_effect = None
+        send.return_value = mock.Mock(status_code=200)
+        send.reset_mock()
+        retry_time = self.persister._retry_time
+        self.persister._replay()
+        self.assertEqual(['a\n', 'b\n'],
+                         [c[0][0] for c in send.call_args_list])
+        self.assertFalse(self.persister._spool.empty())
+        # not a failure, the rest is replayed with the next batch
+        self.assertEqual(retry_time, self.persister._retry_time)
+
+        self.persister._replay()
+        self.assertEqual('c\n', send.call_args[0][0])
+        self.assertTrue(self.persister._spool.empty())
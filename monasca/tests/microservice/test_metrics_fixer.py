@@ -15,9 +15,11 @@
 # under the License.
 
 import json
+import mock
 import time
 
 
+from monasca.common import metric_util
 from monasca.microservice import metrics_fixer
 from monasca.openstack.common import log
 from monasca import tests
@@ -59,3 +61,15 @@ class TestMetricsFixer(tests.BaseTestCase):
         fixer = metrics_fixer.MetricsFixer()
         result = fixer.process_msg(json.dumps(items))
         self.assertTrue(isinstance(result, str))
+
+    def test_process_msg_normalized(self):
+        item = metric_util.normalize(
+            {'name': 'name1', 'dimensions': {'name1': 'value1'},
+             'timestamp': time.time()})
+        msg = metric_util.serialize(item)
+        fixer = metrics_fixer.MetricsFixer()
+        with mock.patch.object(json, 'loads') as loads:
+            result = fixer.process_msg(msg)
+            # the message has been normalized by the api, no parsing needed
+            self.assertFalse(loads.called)
+        self.assertEqual('{"index":{}}\n' + msg + '\n', result)
@@ -0,0 +1,244 @@
+# Copyright 2015 Carnegie Mellon University
+#
+# Author: Han Chen <hanc@andrew.cmu.edu>
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+import json
+import mock
+from oslo.config import fixture as fixture_config
+import time
+
+from monasca.common import codec
+from monasca.common import email_sender
+from monasca.common import kafka_conn
+from monasca.common import memory_kafka
+from monasca.microservice import notification_engine
+from monasca.openstack.common import log
+from monasca import tests
+
+LOG = log.getLogger(__name__)
+
+
+class TestNotificationEngine(tests.BaseTestCase):
+
+    def setUp(self):
+        super(TestNotificationEngine, self).setUp()
+        self.CONF = self.useFixture(fixture_config.Config()).conf
+        self.CONF.set_override('uri', 'fake_url', group='kafka_opts')
+        self.CONF.set_override('uri', 'fake_es_uri', group='es')
+        self.CONF.set_override('coalesce_window', 0, group='notification')
+        self.engine = notification_engine.NotificationEngine()
+
+    def _msg(self, state, actions, def_id='def1'):
+        msg = mock.Mock()
+        msg.message.value = json.dumps({
+            "state": state,
+            "alarm-definition": {
+                "id": def_id,
+                "name": "cpu",
+                "description": "The average CPU percent is greater than 10",
+                "alarm_actions": actions,
+                "ok_actions": [],
+                "undetermined_actions": []}})
+        return msg
+
+    def test_handle_alarm_msgs(self):
+        msgs = [self._msg('ALARM', ['id1', 'id2']),
+                self._msg('ALARM', ['id2', 'id3']),
+                self._msg('OK', ['id1'])]
+        methods = {'id1': {'type': 'EMAIL', 'address': 'a@b.c'},
+                   'id2': {'type': 'WEBHOOK', 'address': 'http://a.b'},
+                   'id3': {'type': 'EMAIL', 'address': 'd@e.f'}}
+        with mock.patch.object(self.engine._method_cache, 'get',
+                               return_value=methods) as get_methods:
+            with mock.patch.object(email_sender, 'send_emails') as send:
+                self.engine.handle_alarm_msgs(msgs)
+
+        # the notification methods of the whole batch are resolved once
+        get_methods.assert_called_once_with(set(['id1', 'id2', 'id3']))
+        self.assertEqual(2, send.call_count)
+        self.assertEqual(['a@b.c'], send.call_args_list[0][0][0])
+        self.assertEqual(['d@e.f'], send.call_args_list[1][0][0])
+
+    def test_coalesce(self):
+        self.engine._coalescer.window = 10
+        methods = {'id1': {'type': 'EMAIL', 'address': 'a@b.c'}}
+        with mock.patch.object(self.engine._method_cache, 'get',
+                               return_value=methods):
+            with mock.patch.object(email_sender, 'send_emails') as send:
+                self.engine.handle_alarm_msgs(
+                    [self._msg('ALARM', ['id1']) for i in range(5)])
+                self.engine.handle_alarm_msgs(
+                    [self._msg('ALARM', ['id1'], def_id='def2')])
+                # nothing is sent before the window has passed
+                self.assertFalse(send.called)
+
+                with mock.patch.object(time, 'time',
+                                       return_value=time.time() + 10):
+                    self.engine.flush_notifications()
+
+        # one digest for each alarm definition
+        self.assertEqual(2, send.call_count)
+        self.assertEqual('5 alarms of cpu are ALARM',
+                         send.call_args_list[0][0][1])
+        self.assertEqual('Alarm to User', send.call_args_list[1][0][1])
+        self.assertEqual(0, len(self.engine._coalescer))
+
+    def test_failed_notification_does_not_drop_others(self):
+        broken = self._msg('ALARM', ['id1'], def_id='broken')
+        value = json.loads(broken.message.value)
+        del value['alarm-definition']['description']
+        broken.message.value = json.dumps(value)
+        methods = {'id1': {'type': 'EMAIL', 'address': 'a@b.c'}}
+        with mock.patch.object(self.engine._method_cache, 'get',
+                               return_value=methods):
+            with mock.patch.object(email_sender, 'send_emails') as send:
+                self.engine.handle_alarm_msgs(
+                    [broken, self._msg('ALARM', ['id1'])])
+        self.assertEqual(1, send.call_count)
+        self.assertEqual(0, len(self.engine._coalescer))
+
+    def test_commit_after_sent(self):
+        self.engine._coalescer.window = 10
+        conn = self.engine._kafka_conn = mock.Mock()
+        conn.offsets.side_effect = [{0: 1}, {0: 2}]
+        methods = {'id1': {'type': 'EMAIL', 'address': 'a@b.c'}}
+        with mock.patch.object(self.engine._method_cache, 'get',
+                               return_value=methods):
+            with mock.patch.object(email_sender, 'send_emails',
+                                   return_value=True) as send:
+                self.engine.handle_batch([self._msg('ALARM', ['id1'])])
+                self.engine.handle_batch(
+                    [self._msg('ALARM', ['id1'], def_id='def2')])
+                # the alarms are waiting in the coalescer, not committed yet
+                self.assertFalse(conn.commit_offsets.called)
+
+                with mock.patch.object(time, 'time',
+                                       return_value=time.time() + 10):
+                    self.engine.handle_batch([])
+        self.assertEqual(2, send.call_count)
+        callbacks = [c[0][3] for c in send.call_args_list]
+
+        # queued is not sent, and the batches are committed in order
+        self.assertFalse(conn.commit_offsets.called)
+        callbacks[1](True)
+        self.engine.handle_batch([])
+        self.assertFalse(conn.commit_offsets.called)
+        # given up on is as good as sent
+        callbacks[0](False)
+        self.engine.handle_batch([])
+        conn.commit_offsets.assert_called_once_with({0: 2})
+
+    def test_commit_without_notifications(self):
+        conn = self.engine._kafka_conn = mock.Mock()
+        conn.offsets.return_value = {0: 1}
+        methods = {'id1': {'type': 'WEBHOOK', 'address': 'http://a.b'}}
+        with mock.patch.object(self.engine._method_cache, 'get',
+                               return_value=methods):
+            with mock.patch.object(email_sender, 'send_emails',
+                                   return_value=False) as send:
+                self.engine.handle_batch([self._msg('ALARM', ['id1'])])
+        self.assertFalse(send.called)
+        conn.commit_offsets.assert_called_once_with({0: 1})
+
+    def test_slim_alarms(self):
+        definitions = {'def1': {
+            "id": "def1", "name": "cpu",
+            "description": "The average CPU percent is greater than 10",
+            "alarm_actions": ['id1'], "ok_actions": ['id2'],
+            "undetermined_actions": []}}
+        msgs = []
+        for def_id, state in (('def1', 'ALARM'), ('def1', 'OK'),
+                              ('gone', 'ALARM')):
+            msg = mock.Mock()
+            msg.message.value = codec.encode({
+                "alarm_definition_id": def_id,
+                "dimensions": {"hostname": "h1"},
+                "state": state}, schema='alarm', version=2)
+            msgs.append(msg)
+        methods = {'id1': {'type': 'EMAIL', 'address': 'a@b.c'},
+                   'id2': {'type': 'EMAIL', 'address': 'd@e.f'}}
+        with mock.patch.object(self.engine._definition_cache, 'get',
+                               return_value=definitions) as get_definitions:
+            with mock.patch.object(self.engine._method_cache, 'get',
+                                   return_value=methods) as get_methods:
+                with mock.patch.object(email_sender, 'send_emails') as send:
+                    self.engine.handle_alarm_msgs(msgs)
+
+        # the definitions of the whole batch are resolved once
+        get_definitions.assert_called_once_with(set(['def1', 'gone']))
+        get_methods.assert_called_once_with(set(['id1', 'id2']))
+        self.assertEqual([['a@b.c'], ['d@e.f']],
+                         [c[0][0] for c in send.call_args_list])
+
+
+class TestCoalescer(tests.BaseTestCase):
+
+    def test_rate_limit(self):
+        coalescer = notification_engine.Coalescer(0, 2)
+        method = {'type': 'EMAIL', 'address': 'a@b.c'}
+        for def_id in ['def1', 'def2', 'def3']:
+            coalescer.add(def_id, 'ALARM', 'id1', method, {}, now=100)
+        # only 2 notifications per minute through the method
+        self.assertEqual(2, len(coalescer.flush(now=100)))
+        coalescer.add('def3', 'ALARM', 'id1', method, {}, now=110)
+        self.assertEqual([], coalescer.flush(now=110))
+
+        # the held back alarms are sent together once a token is available
+        due = coalescer.flush(now=130)
+        self.assertEqual(1, len(due))
+        self.assertEqual(('def3', 'ALARM', 'id1'), due[0][0])
+        self.assertEqual(2, len(due[0][2]))
+
+
+class TestCacheInvalidation(tests.BaseTestCase):
+
+    def setUp(self):
+        super(TestCacheInvalidation, self).setUp()
+        self.CONF = self.useFixture(fixture_config.Config()).conf
+        self.CONF.set_override('uri', 'memory://test', group='kafka_opts')
+        self.CONF.set_override('uri', 'fake_es_uri', group='es')
+        self.addCleanup(memory_kafka.reset)
+        self.engine = notification_engine.NotificationEngine()
+        self.addCleanup(self.engine._stopped.set)
+
+    def _wait_for(self, check):
+        deadline = time.time() + 5
+        while not check() and time.time() < deadline:
+            time.sleep(0.01)
+        self.assertTrue(check())
+
+    def test_changed_methods_invalidated(self):
+        methods = self.engine._method_cache._docs
+        expire = time.time() + 300
+        methods['id1'] = (expire, {'type': 'EMAIL', 'address': 'a@b.c'})
+        methods['id2'] = (expire, {'type': 'EMAIL', 'address': 'd@e.f'})
+        topic = kafka_conn.KafkaConnection('notification_methods')
+        # changed before the engine started, its cache was empty then
+        topic.send_messages([json.dumps({'id': 'id2', 'request': 'PUT'})])
+
+        self.engine.start_watchers()
+        topic.send_messages(['not json', json.dumps(
+            {'id': 'id1', 'request': 'PUT', 'type': 'EMAIL',
+             'address': 'x@y.z'})])
+        self._wait_for(lambda: 'id1' not in methods)
+        self.assertIn('id2', methods)
+
+    def test_changed_definitions_invalidated(self):
+        definitions = self.engine._definition_cache._docs
+        definitions['def1'] = (time.time() + 300, {'id': 'def1'})
+        self.engine.start_watchers()
+        kafka_conn.KafkaConnection('alarmdefinitions').send_messages(
+            [json.dumps({'id': 'def1', 'request': 'DEL'})])
+        self._wait_for(lambda: 'def1' not in definitions)
@@ -0,0 +1,305 @@
+# Copyright 2015 CMU
+# Author: Yihan Wang <wangff9@gmail.com>
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+import json
+import mock
+from oslo.config import fixture as fixture_config
+import time
+
+from monasca.common import codec
+from monasca.common import local_es
+from monasca.common import memory_kafka
+from monasca.microservice import thresholding_engine as engine
+from monasca.microservice import thresholding_processor as processor
+from monasca import tests
+
+
+def _definition(name, expression):
+    return json.dumps({"id": name, "name": name, "expression": expression,
+                       "match_by": ["hostname"], "severity": "LOW",
+                       "ok_actions": [], "alarm_actions": [],
+                       "undetermined_actions": []})
+
+
+def _metrics(tp, name):
+    """The metrics in the windows of an item of a processor."""
+    return [m for data in tp.expr_data_queue[name]['data'].values()
+            for m in data['window'].metrics]
+
+
+class TestThresholdingEngine(tests.BaseTestCase):
+
+    def setUp(self):
+        super(TestThresholdingEngine, self).setUp()
+        self.CONF = self.useFixture(fixture_config.Config()).conf
+        self.CONF.set_override('uri', 'memory://test', group='kafka_opts')
+        self.addCleanup(memory_kafka.reset)
+        self.engine = engine.ThresholdingEngine()
+        for name, expression in (('cpu', 'max(cpu) > 10'),
+                                 ('cpu-mem', 'max(cpu) > 10 or max(mem) > 1'),
+                                 ('disk', 'max(disk) > 10')):
+            self.engine.add_processor(name, _definition(name, expression))
+        self.engine.index_processors()
+
+    def test_metrics_decoded_once(self):
+        now = time.time()
+        msg = json.dumps([
+            {"name": "cpu", "dimensions": {"hostname": "h1"},
+             "timestamp": now, "value": 20},
+            {"name": "mem", "dimensions": {"hostname": "h1"},
+             "timestamp": now, "value": 0}])
+        with mock.patch.object(processor.codec, 'decode',
+                               wraps=codec.decode) as decode:
+            self.engine.process_metrics_msg(msg)
+        self.assertEqual(1, decode.call_count)
+
+        tps = self.engine.thresholding_processors
+        self.assertEqual(['h1'], list(tps['cpu'].expr_data_queue))
+        self.assertEqual(['h1'], list(tps['cpu-mem'].expr_data_queue))
+        self.assertEqual({}, tps['disk'].expr_data_queue)
+
+        # both processors share the decoded metric
+        cpu = _metrics(tps['cpu'], 'h1')
+        self.assertIs(cpu[0], [m for m in _metrics(tps['cpu-mem'], 'h1')
+                               if m['name'] == 'cpu'][0])
+        self.assertEqual(2, len(_metrics(tps['cpu-mem'], 'h1')))
+        self.assertEqual(['ALARM'], [codec.decode(a)['state']
+                                     for a in tps['cpu'].process_alarms()])
+
+    def test_invalid_metrics_skipped(self):
+        now = time.time()
+        values = ['not json',
+                  json.dumps([{"name": "cpu", "dimensions": {"hostname": {}},
+                               "timestamp": now, "value": 20},
+                              {"name": "cpu", "dimensions": {"hostname": "h1"},
+                               "timestamp": now, "value": 20}]),
+                  json.dumps({"name": "cpu", "dimensions": {"hostname": "h2"},
+                              "timestamp": now, "value": 20})]
+        self.engine.handle_metrics_msgs(
+            [mock.Mock(message=mock.Mock(value=v)) for v in values])
+        self.assertEqual(['h1', 'h2'], sorted(
+            self.engine.thresholding_processors['cpu'].expr_data_queue))
+
+    def test_shared_windows(self):
+        self.engine.add_processor('cpu-low', _definition(
+            'cpu-low', 'max(cpu) > 5 or max(mem) > 1'))
+        self.engine.index_processors()
+        now = time.time()
+        self.engine.process_metrics_msg(json.dumps([
+            {"name": "cpu", "dimensions": {"hostname": "h1"},
+             "timestamp": now, "value": 8}]))
+
+        # one window for max(cpu) of h1, one for max(mem) of h1
+        self.assertEqual(2, len(self.engine.window_store))
+        tps = self.engine.thresholding_processors
+        self.assertEqual(1, len(_metrics(tps['cpu'], 'h1')))
+
+        with mock.patch.object(processor.calculator, 'calc_value',
+                               wraps=processor.calculator.calc_value) as calc:
+            states = {}
+            for name, tp in tps.items():
+                tp.process_alarms(now)
+                states[name] = [d['state'] for d in
+                                tp.expr_data_queue.values()]
+        # max of the cpu window once, the mem window is empty
+        self.assertEqual(1, calc.call_count)
+        self.assertEqual(['ALARM'], states['cpu-low'])
+        self.assertEqual(['OK'], states['cpu'])
+        self.assertEqual([], states['disk'])
+
+    def test_replaced_processor_releases_windows(self):
+        now = time.time()
+        self.engine.process_metrics_msg(json.dumps(
+            {"name": "disk", "dimensions": {"hostname": "h1"},
+             "timestamp": now, "value": 8}))
+        self.assertEqual(1, len(self.engine.window_store))
+        self.engine.add_processor('disk', _definition(
+            'disk', 'max(disk) > 20'))
+        self.assertEqual(0, len(self.engine.window_store))
+
+    def test_max_series(self):
+        self.CONF.set_override('max_series', 2, group='thresholding_engine')
+        now = time.time()
+        for i, host in enumerate(['h1', 'h2', 'h3']):
+            self.engine.process_metrics_msg(json.dumps(
+                {"name": "disk", "dimensions": {"hostname": host},
+                 "timestamp": now + i, "value": 8}))
+        self.engine.enforce_series_limit()
+        self.assertEqual(['h2', 'h3'], sorted(
+            self.engine.thresholding_processors['disk'].expr_data_queue))
+        self.assertEqual(2, engine.ACTIVE_SERIES.labels().value)
+
+    def test_control_topics_first(self):
+        self.CONF.set_override('fetch_size', 1, group='thresholding_engine')
+        self.engine._queues.maxlen = 2
+        self.addCleanup(self.engine._stopped.set)
+        now = time.time()
+        metrics = self.engine._consume_kafka_conn['metrics']
+        metrics.send_messages([json.dumps(
+            {"name": "mem", "dimensions": {"hostname": "h%d" % i},
+             "timestamp": now, "value": 8}) for i in range(5)])
+        self.engine._consume_kafka_conn['alarmdefinitions'].send_messages(
+            [_definition('mem', 'max(mem) > 5')])
+
+        self.engine.start_fetchers()
+        deadline = time.time() + 5
+        while len(self.engine._queues) < 3 and time.time() < deadline:
+            time.sleep(0.01)
+
+        # the definition goes before the metrics fetched earlier
+        self.assertEqual('alarmdefinitions', self.engine.run_once(1))
+        self.assertIn('mem', self.engine.thresholding_processors)
+        topics = [self.engine.run_once(1) for i in range(5)]
+        self.assertEqual(['metrics'] * 5, topics)
+        self.assertEqual(5, len(
+            self.engine.thresholding_processors['mem'].expr_data_queue))
+
+    def test_commit_handled_offsets(self):
+        self.CONF.set_override('fetch_size', 1, group='thresholding_engine')
+        self.addCleanup(self.engine._stopped.set)
+        now = time.time()
+        metrics = self.engine._consume_kafka_conn['metrics']
+        metrics.send_messages([json.dumps(
+            {"name": "mem", "dimensions": {"hostname": "h%d" % i},
+             "timestamp": now, "value": 8}) for i in range(3)])
+        broker = memory_kafka.get_broker('memory://test')
+
+        def committed():
+            return broker.committed(metrics.group, 'metrics', 0)
+
+        self.engine.start_fetchers()
+        deadline = time.time() + 5
+        while len(self.engine._queues) < 3 and time.time() < deadline:
+            time.sleep(0.01)
+        # fetched and queued, but not handled yet
+        self.assertEqual(0, committed())
+
+        self.assertEqual('metrics', self.engine.run_once(1))
+        deadline = time.time() + 5
+        while committed() < 1 and time.time() < deadline:
+            time.sleep(0.01)
+        self.assertEqual(1, committed())
+
+    def test_bootstrap(self):
+        server = local_es.LocalES()
+        self.CONF.set_override('uri', server.start(), group='es')
+        self.addCleanup(server.stop)
+        for i in range(25):
+            server.store.index('monasca_1', 'alarmdefinitions', 'def%d' % i,
+                               json.loads(_definition(
+                                   'def%d' % i, 'max(cpu) > %d' % i)))
+        self.CONF.set_override('bootstrap_page_size', 10,
+                               group='thresholding_engine')
+        defs = self.engine._consume_kafka_conn['alarmdefinitions']
+        # changed in kafka, but not written to ElasticSearch yet
+        defs.send_messages([_definition('def0', 'max(mem) > 0')])
+
+        self.assertEqual(25, self.engine.bootstrap())
+        self.assertIn('def24', self.engine.thresholding_processors)
+        self.assertEqual(
+            2 + 25, len(self.engine._processors_by_name['cpu']))
+
+        defs.send_messages([_definition('new', 'max(cpu) > 1')])
+        self.engine.start_fetchers()
+        self.addCleanup(self.engine._stopped.set)
+        topics = set()
+        for i in range(10):
+            if 'new' in self.engine.thresholding_processors:
+                break
+            topics.add(self.engine.run_once(1))
+        self.assertEqual(set(['alarmdefinitions']), topics)
+        # the change of def0 is not lost
+        self.assertEqual('max(mem) > 0', self.engine.thresholding_processors[
+            'def0'].expression)
+        self.assertEqual(3 + 25 + 1, len(self.engine.thresholding_processors))
+        self.assertIsNone(self.engine.run_once(0.2))
+
+    def test_remote_windows(self):
+        server = local_es.LocalES()
+        self.CONF.set_override('uri', server.start(), group='es')
+        self.addCleanup(server.stop)
+        self.CONF.set_override('remote_window_seconds', 3600,
+                               group='thresholding_engine')
+        now = int(time.time())
+        # a day of hourly averages, h1 is busy in all of the hours and h2
+        # only in the last one
+        for hour in range(24):
+            for host, value in (('h1', 80), ('h2', 90 if hour == 0 else 10)):
+                server.store.index(
+                    'monasca_1', 'metrics', '%s-%d' % (host, hour),
+                    {'name': 'cpu', 'dimensions': {'hostname': host},
+                     'timestamp': now - hour * 3600 - 60, 'value': value})
+        self.engine.add_processor('daily', _definition(
+            'daily', 'avg(cpu, 3600) > 50 times 24'))
+        self.engine.index_processors()
+        self.engine.process_metrics_msg(json.dumps([
+            {"name": "cpu", "dimensions": {"hostname": host},
+             "timestamp": now, "value": 0} for host in ('h1', 'h2')]))
+
+        tp = self.engine.thresholding_processors['daily']
+        window = tp.expr_data_queue['h1']['data'][
+            'avg(cpu, 3600) > 50 times 24']['window']
+        self.assertIsInstance(window, processor.RemoteWindow)
+        self.assertEqual((), window.metrics)
+
+        alarms = [codec.decode(a) for a in self.engine.evaluate(now)]
+        daily = dict((a['dimensions']['hostname'], a['state'])
+                     for a in alarms if a['alarm_definition_id'] == 'daily')
+        self.assertEqual({'h1': 'ALARM', 'h2': 'OK'}, daily)
+        self.assertEqual(24, len(window.stats))
+
+    def test_remote_windows_mixed_case(self):
+        server = local_es.LocalES()
+        self.CONF.set_override('uri', server.start(), group='es')
+        self.addCleanup(server.stop)
+        self.CONF.set_override('remote_window_seconds', 3600,
+                               group='thresholding_engine')
+        now = int(time.time())
+        # saved the way they were posted, not lower-cased
+        for hour in range(24):
+            server.store.index(
+                'monasca_1', 'metrics', 'web-%d' % hour,
+                {'name': 'CPU.Load', 'dimensions': {'hostname': 'Web-1'},
+                 'timestamp': now - hour * 3600 - 60, 'value': 80})
+        self.engine.add_processor('daily', _definition(
+            'daily', 'avg(cpu.load{hostname=web-*}, 3600) > 50 times 24'))
+        self.engine.index_processors()
+        self.engine.process_metrics_msg(json.dumps(
+            {"name": "CPU.Load", "dimensions": {"hostname": "Web-1"},
+             "timestamp": now, "value": 1}))
+
+        alarms = [codec.decode(a) for a in self.engine.evaluate(now)]
+        self.assertEqual(['ALARM'], [a['state'] for a in alarms
+                                     if a['alarm_definition_id'] == 'daily'])
+
+    def test_es_regexp(self):
+        self.assertEqual(u'[cC][pP][uU]\\.[lL]1', engine.es_regexp('cpu.l1'))
+        self.assertEqual(u'[wW][eE][bB]-.*', engine.es_regexp('web-*', True))
+        self.assertEqual(u'[wW]\\*', engine.es_regexp('w*'))
+        self.assertEqual(u'[aA][zZ][1-2][^bB].',
+                         engine.es_regexp('az[1-2][!b]?', True))
+        self.assertEqual(u'[aA]\\[', engine.es_regexp('a[', True))
+
+
+class TestPriorityQueues(tests.BaseTestCase):
+
+    def test_priority(self):
+        queues = engine.PriorityQueues()
+        queues.put(1, 'm1')
+        queues.put(1, 'm2')
+        queues.put(0, 'd1')
+        self.assertEqual(['d1', 'm1', 'm2'],
+                         [queues.get(0) for i in range(3)])
+        self.assertIsNone(queues.get(0))
@@ -15,6 +15,7 @@
 # under the License.
 
 import json
+from monasca.common import codec
 from monasca.microservice import thresholding_processor as processor
 from monasca.openstack.common import log
 from monasca import tests
@@ -268,3 +269,167 @@ class TestThresholdingProcessor(tests.BaseTestCase):
         self.assertEqual(3, len(alarms))
         self.assertEqual('ALARM', tp.expr_data_queue['h1']['state'])
         self.assertEqual('ALARM', tp.expr_data_queue['h2']['state'])
+
+    def test_process_metrics_list(self):
+        tp = processor.ThresholdingProcessor(self.alarm_definition1)
+        metrics_list = [json.loads(m) for m in self.getMetric1()]
+        tp.process_metrics(json.dumps(metrics_list))
+        alarms = tp.process_alarms()
+        self.assertEqual(3, len(alarms))
+
+    def test_decode_metrics(self):
+        metrics = processor.decode_metrics(json.dumps(
+            [{"name": "BIZ", "dimensions": {"Hostname": "H1"}},
+             {"name": "baz"}]))
+        self.assertEqual(2, len(metrics))
+        self.assertEqual('biz', metrics[0].match_name)
+        self.assertEqual({'Hostname': 'h1'}, metrics[0].match_dimensions)
+        # the metric is kept as it was posted
+        self.assertEqual({"name": "BIZ", "dimensions": {"Hostname": "H1"}},
+                         metrics[0])
+        self.assertEqual({}, metrics[1].match_dimensions)
+
+        metrics = processor.decode_metrics(json.dumps({"name": "biz"}))
+        self.assertEqual(['biz'], [m.match_name for m in metrics])
+
+    def test_evict_idle_series(self):
+        tp = processor.ThresholdingProcessor(self.alarm_definition1,
+                                             idle_windows=2,
+                                             evict_state='UNDETERMINED')
+        for metrics in self.getMetric1():
+            tp.process_metrics(metrics)
+        self.assertEqual(3, len(tp.process_alarms()))
+
+        # max(biz) has a window of 60 seconds, h1 is idle after 120
+        now = time.time()
+        tp.expr_data_queue['h1']['last_seen'] = now - 121
+        alarms = tp.process_alarms(now)
+        self.assertEqual(['h2', 'h3'], sorted(tp.expr_data_queue))
+        self.assertEqual(1, tp.evicted)
+        self.assertEqual(1, len(alarms))
+        self.assertEqual('UNDETERMINED', codec.decode(alarms[0])['state'])
+        self.assertEqual(2, len(tp.window_store))
+
+    def test_max_series(self):
+        tp = processor.ThresholdingProcessor(self.alarm_definition1,
+                                             max_series=2)
+        for metrics in self.getMetric1():
+            tp.process_metrics(metrics)
+        # the least recently updated h1 made room for h3
+        self.assertEqual(['h2', 'h3'], sorted(tp.expr_data_queue))
+        self.assertEqual(1, tp.evicted)
+        # evicted silently
+        self.assertEqual(2, len(tp.process_alarms()))
+
+    def test_close_removes_series_gauge(self):
+        tp = processor.ThresholdingProcessor(self.alarm_definition1)
+        for metrics in self.getMetric1():
+            tp.process_metrics(metrics)
+        tp.process_alarms()
+        label = 'alarm_definition="%s"' % tp._definition_id
+        self.assertIn(label, '\n'.join(processor.SERIES.render()))
+
+        tp.close()
+        self.assertNotIn(label, '\n'.join(processor.SERIES.render()))
+
+    def test_series_keys_do_not_collide(self):
+        tp = processor.ThresholdingProcessor(json.dumps({
+            "id": "d1", "name": "d1", "expression": "max(biz) > 100",
+            "match_by": ["a", "b"], "severity": "LOW"}))
+        for a, b in (('ab', 'c'), ('a', 'bc')):
+            tp.process_metrics(json.dumps({
+                "name": "biz", "dimensions": {"a": a, "b": b},
+                "timestamp": time.time(), "value": 1}))
+        self.assertEqual([('a', 'bc'), ('ab', 'c')],
+                         sorted(tp.expr_data_queue))
+
+    def test_shared_window_fed_dicts(self):
+        store = processor.WindowStore()
+        tps = [processor.ThresholdingProcessor(json.dumps({
+            "id": name, "name": name, "expression": expression,
+            "match_by": ["hostname"], "severity": "LOW"}),
+            window_store=store)
+            for name, expression in (('d1', 'count(biz) > 1'),
+                                     ('d2', 'sum(biz) > 2'))]
+        now = time.time()
+        for value in (1, 2):
+            metric = {"name": "biz", "dimensions": {"hostname": "h1"},
+                      "timestamp": now - value, "value": value}
+            # each processor decodes its own copy of the sample
+            for tp in tps:
+                tp.process_metrics(metric)
+        self.assertEqual(1, len(store))
+        window = tps[0].expr_data_queue['h1']['data'][
+            'count(biz) > 1']['window']
+        self.assertEqual(2, len(window.metrics))
+        self.assertEqual([2], window.values('COUNT', now))
+        self.assertEqual([3], window.values('SUM', now))
+
+    def test_window_values_after_append(self):
+        window = processor.Window(60, 1)
+        now = time.time()
+        window.append(processor.Metric({"name": "biz", "timestamp": now,
+                                        "value": 1}))
+        self.assertEqual([1], window.values('SUM', now))
+        window.append(processor.Metric({"name": "biz", "timestamp": now,
+                                        "dimensions": {"a": "b"},
+                                        "value": 2}))
+        # the metrics appended since are not left out at the same time
+        self.assertEqual([3], window.values('SUM', now))
+
+    def test_series_key_shared(self):
+        metric = processor.decode_metrics(json.dumps({
+            "name": "biz", "dimensions": {"hostname": "h1"}}))[0]
+        key = metric.series_key(('hostname',))
+        self.assertEqual('h1', key)
+        self.assertIs(key, metric.series_key(('hostname',)))
+        self.assertIsNone(metric.series_key(('hostname', 'missing')))
+
+    def test_dimension_matcher(self):
+        matcher = processor.DimensionMatcher(
+            {u'Service': u'Monitoring', u'hostname': u'WEB-*',
+             u'az': u'az[12]'})
+        self.assertTrue(matcher({'Service': 'monitoring', 'hostname': 'web-1',
+                                 'az': 'az2'}))
+        self.assertFalse(matcher({'Service': 'monitoring',
+                                  'hostname': 'db-1', 'az': 'az2'}))
+        self.assertFalse(matcher({'Service': 'monitoring',
+                                  'hostname': 'web-1', 'az': 'az3'}))
+        self.assertFalse(matcher({'Service': 'monitoring', 'az': 'az1'}))
+        self.assertFalse(matcher({'hostname': 'web-1', 'az': 'az1'}))
+        self.assertEqual((('Service', 'monitoring'), ('az', 'az[12]'),
+                          ('hostname', 'web-*')), matcher.key)
+        self.assertTrue(processor.DimensionMatcher({})({'a': 'b'}))
+
+    def test_wildcard_dimensions(self):
+        tp = processor.ThresholdingProcessor(json.dumps({
+            "id": "d1", "name": "d1",
+            "expression": "max(biz{hostname=web-*}) > 100",
+            "match_by": ["hostname"], "severity": "LOW"}))
+        now = time.time()
+        for host, value in (('web-1', 200), ('WEB-2', 50), ('db-1', 200)):
+            tp.process_metrics(json.dumps({
+                "name": "biz", "dimensions": {"hostname": host},
+                "timestamp": now, "value": value}))
+        # one series per matching host, without a definition per host
+        self.assertEqual(['WEB-2', 'web-1'], sorted(tp.expr_data_queue))
+        tp.process_alarms(now)
+        self.assertEqual('ALARM', tp.expr_data_queue['web-1']['state'])
+        self.assertEqual('OK', tp.expr_data_queue['WEB-2']['state'])
+
+    def test_build_alarm(self):
+        tp = processor.ThresholdingProcessor(self.alarm_definition1)
+        for metrics in self.getMetric1():
+            tp.process_metrics(metrics)
+        alarms = [codec.decode(a, schema='alarm') for a in
+                  tp.process_alarms()]
+        alarm = [a for a in alarms if a['dimensions'] == {'hostname': 'h1'}][0]
+        self.assertEqual('f9935bcc-9641-4cbf-8224-0993a947ea83',
+                         alarm['alarm_definition_id'])
+        self.assertEqual('ALARM', alarm['state'])
+        self.assertEqual('UNDETERMINED', alarm['old_state'])
+        self.assertEqual([1500], alarm['sub_alarms'][0]['values'])
+        self.assertEqual('ALARM', alarm['sub_alarms'][0]['state'])
+        # neither the definition nor the metrics are sent along
+        self.assertNotIn('alarm-definition', alarm)
+        self.assertNotIn('metrics', alarm)
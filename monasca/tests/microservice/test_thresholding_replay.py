@@ -0,0 +1,94 @@
+# Copyright 2015 CMU
+# Author: Yihan Wang <wangff9@gmail.com>
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+import json
+from oslo.config import fixture as fixture_config
+
+from monasca.common import codec
+from monasca.common import memory_kafka
+from monasca.microservice import thresholding_replay as replay
+from monasca import tests
+
+# a recorded day long ago, the replay must not depend on the wall clock
+START = 1430000000
+
+
+def _definitions():
+    return [{"id": "cpu", "name": "cpu", "expression": "max(cpu) > 10",
+             "match_by": ["hostname"], "severity": "LOW",
+             "ok_actions": [], "alarm_actions": [],
+             "undetermined_actions": []}]
+
+
+def _metrics():
+    # cpu is high during the first two minutes and low afterwards, the
+    # evaluations in event time are at START + 40, 100, 160 and 220
+    lines = []
+    for t in range(START, START + 300, 10):
+        value = 20 if t < START + 120 else 1
+        lines.append(json.dumps([
+            {"name": "cpu", "dimensions": {"hostname": "h1"},
+             "timestamp": t, "value": value},
+            {"name": "mem", "dimensions": {"hostname": "h1"},
+             "timestamp": t, "value": 1}]))
+    lines.append('')
+    return lines
+
+
+class TestReplayClock(tests.BaseTestCase):
+
+    def test_advance(self):
+        clock = replay.ReplayClock()
+        clock.advance(10)
+        clock.advance(5)
+        self.assertEqual(10, clock())
+
+
+class TestThresholdingReplay(tests.BaseTestCase):
+
+    def setUp(self):
+        super(TestThresholdingReplay, self).setUp()
+        self.CONF = self.useFixture(fixture_config.Config()).conf
+        self.addCleanup(memory_kafka.reset)
+
+    def test_load_definitions(self):
+        definitions = _definitions()
+        self.assertEqual(definitions, replay.load_definitions(
+            [json.dumps(definitions)]))
+        self.assertEqual(definitions * 2, replay.load_definitions(
+            [json.dumps(d) + '\n' for d in definitions * 2]))
+
+    def test_replay(self):
+        th_engine = replay.create_engine(_definitions())
+        stats, alarms = replay.replay(th_engine, _metrics(), 60)
+
+        self.assertEqual(60, stats['metrics'])
+        self.assertEqual(290, stats['event_seconds'])
+        self.assertEqual(START + 290, th_engine.clock())
+        states = [(codec.decode(a)['state'], codec.decode(a)['old_state'])
+                  for a in alarms]
+        self.assertEqual([('ALARM', 'UNDETERMINED'), ('OK', 'ALARM')],
+                         states)
+        self.assertEqual({'ALARM': 1, 'OK': 1}, stats['alarm_states'])
+        self.assertEqual(START + 220, codec.decode(
+            alarms[1])['state_updated_timestamp'])
+
+    def test_replay_is_deterministic(self):
+        def _alarms():
+            alarms = replay.replay(replay.create_engine(_definitions()),
+                                   _metrics(), 60)[1]
+            # only the ids of the alarms are random
+            return [dict(codec.decode(a), id=None) for a in alarms]
+        self.assertEqual(_alarms(), _alarms())
@@ -0,0 +1,126 @@
+# Copyright 2013 IBM Corp
+#
+# Author: Tong Li <litong01@us.ibm.com>
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+import json
+import mock
+import StringIO
+
+from monasca.common import metric_util
+from monasca.middleware import metric_validator
+from monasca.openstack.common import log
+from monasca import tests
+
+LOG = log.getLogger(__name__)
+
+
+class TestMetricValidator(tests.BaseTestCase):
+
+    def setUp(self):
+        super(TestMetricValidator, self).setUp()
+        self.app = mock.Mock(return_value=['ok'])
+        self.start_response = mock.Mock()
+
+    def _env(self, body):
+        return {'PATH_INFO': '/v2.0/metrics',
+                'REQUEST_METHOD': 'POST',
+                'CONTENT_LENGTH': str(len(body)),
+                'wsgi.input': StringIO.StringIO(body)}
+
+    def _metrics(self, count):
+        return [{'name': 'name1', 'dimensions': {'key1': 'value%d' % i},
+                 'timestamp': 1422711300, 'value': i + 1}
+                for i in range(count)]
+
+    def test_valid(self):
+        validator = metric_validator.MetricValidator(self.app, {})
+        env = self._env(json.dumps(self._metrics(3)))
+        self.assertEqual(['ok'], validator(env, self.start_response))
+
+        metrics = env[metric_util.ENV_METRICS]
+        self.assertEqual(3, len(metrics))
+        self.assertTrue(metric_util.is_normalized(metrics[0]))
+
+    def test_tenant_and_region(self):
+        validator = metric_validator.MetricValidator(
+            self.app, {'region': 'region-a'})
+        metrics = self._metrics(2)
+        metrics[1]['tenantId'] = 'other'
+        env = self._env(json.dumps(metrics))
+        env['HTTP_X_PROJECT_ID'] = 'tenant-1'
+        validator(env, self.start_response)
+
+        for msg in env[metric_util.ENV_METRICS]:
+            metric = json.loads(msg)
+            self.assertEqual('tenant-1', metric['tenantId'])
+            self.assertEqual('region-a', metric['region'])
+
+        validator = metric_validator.MetricValidator(
+            self.app, {'streaming': 'true'})
+        env = self._env(json.dumps(metrics))
+        env['HTTP_X_PROJECT_ID'] = 'tenant-1'
+        validator(env, self.start_response)
+
+        chunk = next(env[metric_util.ENV_METRICS])
+        self.assertEqual('tenant-1', json.loads(chunk[1])['tenantId'])
+        self.assertIsNone(json.loads(chunk[1])['region'])
+
+    def test_invalid(self):
+        validator = metric_validator.MetricValidator(self.app, {})
+        metrics = self._metrics(3)
+        del metrics[1]['dimensions']
+        env = self._env(json.dumps(metrics))
+        self.assertEqual([], validator(env, self.start_response))
+        self.assertFalse(self.app.called)
+        self.assertEqual('400 Bad Request',
+                         self.start_response.call_args[0][0])
+
+    def test_too_large(self):
+        validator = metric_validator.MetricValidator(
+            self.app, {'max_body_size': '100'})
+        env = self._env(json.dumps(self._metrics(3)))
+        self.assertEqual([], validator(env, self.start_response))
+        self.assertEqual('413 Request Entity Too Large',
+                         self.start_response.call_args[0][0])
+
+    def test_streaming(self):
+        validator = metric_validator.MetricValidator(
+            self.app, {'streaming': 'true', 'chunk_size': '2'})
+        env = self._env(json.dumps(self._metrics(5)))
+        self.assertEqual(['ok'], validator(env, self.start_response))
+
+        chunks = list(env[metric_util.ENV_METRICS])
+        self.assertEqual([2, 2, 1], [len(chunk) for chunk in chunks])
+        self.assertTrue(metric_util.is_normalized(chunks[2][0]))
+
+    def test_streaming_invalid(self):
+        validator = metric_validator.MetricValidator(
+            self.app, {'streaming': 'true', 'chunk_size': '2',
+                       'max_body_size': '0'})
+        metrics = self._metrics(5)
+        del metrics[3]['name']
+        env = self._env(json.dumps(metrics))
+        validator(env, self.start_response)
+
+        chunks = env[metric_util.ENV_METRICS]
+        self.assertEqual(2, len(next(chunks)))
+        self.assertRaises(ValueError, next, chunks)
+
+        env = self._env(json.dumps(metrics))
+        validator = metric_validator.MetricValidator(
+            self.app, {'streaming': 'true', 'max_body_size': '100'})
+        self.assertEqual([], validator(env, self.start_response))
+        self.assertEqual('413 Request Entity Too Large',
+                         self.start_response.call_args[0][0])
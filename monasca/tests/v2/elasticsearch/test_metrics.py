@@ -19,6 +19,7 @@ import mock
 from oslo.config import fixture as fixture_config
 from oslotest import base
 import requests
+import threading
 
 from monasca.common import kafka_conn
 from monasca.v2.elasticsearch import metrics
@@ -78,6 +79,7 @@ class TestMetricDispatcher(base.BaseTestCase):
         self.CONF.kafka_opts.uri = 'fake_url'
         self.CONF.metrics.topic = 'fake'
         self.CONF.es.uri = 'fake_es_uri'
+        self.CONF.metrics.mapping_refresh = 0
         super(TestMetricDispatcher, self).setUp()
         res = mock.Mock()
         res.status_code = 200
@@ -90,9 +92,16 @@ class TestMetricDispatcher(base.BaseTestCase):
                 "name": {"type": "string", "index": "not_analyzed"},
                 "timestamp": {"type": "string", "index": "not_analyzed"},
                 "value": {"type": "double"}}}}}}
+        names = mock.Mock()
+        names.status_code = 200
+        names.json.return_value = {"aggregations": {"by_name": {"buckets": [
+            {"key": "cpu", "doc_count": 10}, {"key": "mem", "doc_count": 5}]}}}
         with mock.patch.object(requests, 'get',
                                return_value=res):
-            self.dispatcher = metrics.MetricDispatcher({})
+            with mock.patch.object(requests, 'post', return_value=names):
+                self.dispatcher = metrics.MetricDispatcher({})
+                # the names are loaded in the background
+                self.dispatcher._meta_cache._thread.join(5)
 
     def test_initialization(self):
         # test that the kafka connection uri should be 'fake' as it was passed
@@ -128,6 +137,36 @@ class TestMetricDispatcher(base.BaseTestCase):
         # test that the response code is 204
         self.assertEqual(getattr(falcon, 'HTTP_400'), res.status)
 
+    def test_post_data_validated(self):
+        req = mock.Mock()
+        req.env = {'monasca.metrics': ['{"name":"m1"}', '{"name":"m2"}']}
+        with mock.patch.object(kafka_conn.KafkaConnection, 'send_messages',
+                               return_value=204) as send:
+            res = mock.Mock()
+            self.dispatcher.post_data(req, res)
+
+        # the validated metrics are sent without reading the stream again
+        send.assert_called_once_with(['{"name":"m1"}', '{"name":"m2"}'])
+        self.assertFalse(req.stream.read.called)
+        self.assertEqual(getattr(falcon, 'HTTP_204'), res.status)
+
+    def test_post_data_chunks(self):
+        def _chunks():
+            yield ['{"name":"m1"}', '{"name":"m2"}']
+            yield ['{"name":"m3"}']
+            raise ValueError('Invalid metric')
+
+        req = mock.Mock()
+        req.env = {'monasca.metrics': _chunks()}
+        with mock.patch.object(kafka_conn.KafkaConnection, 'send_messages',
+                               return_value=204) as send:
+            res = mock.Mock()
+            self.dispatcher.post_data(req, res)
+
+        # the valid chunks are sent before the invalid metric is found
+        self.assertEqual(2, send.call_count)
+        self.assertEqual(getattr(falcon, 'HTTP_400'), res.status)
+
     def test_do_get_metrics(self):
         res = mock.Mock()
         req = mock.Mock()
@@ -175,6 +214,75 @@ class TestMetricDispatcher(base.BaseTestCase):
 
         self.assertEqual(getattr(falcon, 'HTTP_204'), res.status)
 
+    def test_do_get_metric_names(self):
+        res = mock.Mock()
+        with mock.patch.object(requests, 'post') as es_post:
+            self.dispatcher.do_get_metric_names(mock.Mock(), res)
+            # the names are served from the cache, not from ElasticSearch
+            self.assertFalse(es_post.called)
+
+        self.assertEqual(res.status, getattr(falcon, 'HTTP_200'))
+        self.assertEqual([{'name': 'cpu'}, {'name': 'mem'}],
+                         json.loads(res.body))
+
+    def test_do_get_dimension_names(self):
+        res = mock.Mock()
+        self.dispatcher.do_get_dimension_names(mock.Mock(), res)
+
+        self.assertEqual(res.status, getattr(falcon, 'HTTP_200'))
+        obj = json.loads(res.body)
+        self.assertEqual(6, len(obj))
+        self.assertEqual({'dimension_name': 'key1'}, obj[0])
+
+    def test_meta_cache_refresh_failure(self):
+        cache = self.dispatcher._meta_cache
+        res = mock.Mock()
+        res.status_code = 500
+        with mock.patch.object(requests, 'get', return_value=res):
+            with mock.patch.object(requests, 'post',
+                                   side_effect=Exception('down')):
+                cache.refresh()
+
+        # a failed refresh keeps the previously cached names
+        self.assertEqual(['cpu', 'mem'], cache.metric_names)
+        self.assertEqual(6, len(cache.dimension_names))
+
+    def test_meta_cache_loads_in_background(self):
+        loaded = threading.Event()
+        names = mock.Mock(status_code=200)
+        names.json.return_value = {"aggregations": {"by_name": {"buckets": [
+            {"key": "cpu", "doc_count": 10}]}}}
+
+        def _post(url, data=None, timeout=None):
+            loaded.wait(5)
+            return names
+        with mock.patch.object(requests, 'get',
+                               return_value=mock.Mock(status_code=500)):
+            with mock.patch.object(requests, 'post',
+                                   side_effect=_post) as post:
+                cache = metrics.MetaCache('mapping_url', 'query_url', 'fake',
+                                          10, timeout=3)
+                # an unresponsive ElasticSearch does not hold up the start
+                self.assertEqual([], cache.metric_names)
+                loaded.set()
+                cache._thread.join(5)
+        self.assertEqual(['cpu'], cache.metric_names)
+        self.assertEqual(3, post.call_args[1]['timeout'])
+
+    def test_meta_cache_restarts_thread_after_fork(self):
+        cache = self.dispatcher._meta_cache
+        cache.interval = 60
+        with mock.patch.object(metrics.threading, 'Thread') as thread:
+            with mock.patch.object(metrics.os, 'getpid', return_value=1):
+                cache.ensure_running()
+                cache.ensure_running()
+            self.assertEqual(1, thread.return_value.start.call_count)
+
+            # a forked worker starts its own refresh thread
+            with mock.patch.object(metrics.os, 'getpid', return_value=2):
+                cache.ensure_running()
+            self.assertEqual(2, thread.return_value.start.call_count)
+
     def test_do_get_measurements(self):
         res = mock.Mock()
         req = mock.Mock()
@@ -15,11 +15,11 @@
 # under the License.
 
 
-import ast
 import falcon
 from oslo.config import cfg
 import uuid
 
+from monasca.common import codec
 from monasca.common import es_conn
 from monasca.common import kafka_conn
 from monasca.common import resource_api
@@ -78,7 +78,7 @@ class AlarmDefinitionDispatcher(object):
     def post_data(self, req, res):
         LOG.debug('Creating the alarm definitions')
         msg = req.stream.read()
-        post_msg = ast.literal_eval(msg)
+        post_msg = codec.decode(msg)
 
         # random uuid genearation for alarm definition
         id = str(uuid.uuid4())
@@ -86,7 +86,7 @@ class AlarmDefinitionDispatcher(object):
         post_msg = AlarmDefinitionUtil.severityparsing(post_msg)
         post_msg["request"] = "POST"
         LOG.debug("Post Alarm Definition method: %s" % post_msg)
-        code = self._kafka_conn.send_messages(json.dumps(post_msg))
+        code = self._kafka_conn.send_messages(codec.encode(post_msg))
         res.status = getattr(falcon, 'HTTP_' + str(code))
 
     def put_data(self, req, res, id):
@@ -94,7 +94,7 @@ class AlarmDefinitionDispatcher(object):
 
         msg = req.stream.read()
 
-        put_msg = ast.literal_eval(msg)
+        put_msg = codec.decode(msg)
 
         put_msg["id"] = id
 
@@ -103,7 +103,7 @@ class AlarmDefinitionDispatcher(object):
         put_msg["request"] = "PUT"
 
         LOG.debug("Put Alarm Definitions method data: %s" % put_msg)
-        code = self._kafka_conn.send_messages(json.dumps(put_msg))
+        code = self._kafka_conn.send_messages(codec.encode(put_msg))
         res.status = getattr(falcon, 'HTTP_' + str(code))
 
     def del_data(self, req, res, id):
@@ -115,7 +115,7 @@ class AlarmDefinitionDispatcher(object):
         del_msg["request"] = "DEL"
 
         LOG.debug("Delete Alarm Definitions method data: %s" % del_msg)
-        code = self._kafka_conn.send_messages(json.dumps(del_msg))
+        code = self._kafka_conn.send_messages(codec.encode(del_msg))
         res.status = getattr(falcon, 'HTTP_' + str(code))
 
     def _get_alarm_definitions_response(self, res):
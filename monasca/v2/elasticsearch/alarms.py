@@ -15,11 +15,11 @@
 # under the License.
 
 
-import ast
 import falcon
 from oslo.config import cfg
 import uuid
 
+from monasca.common import codec
 from monasca.common import es_conn
 from monasca.common import kafka_conn
 from monasca.common import resource_api
@@ -76,7 +76,7 @@ class AlarmDispatcher(object):
     def post_data(self, req, res):
         LOG.debug('Creating the alarms')
         msg = req.stream.read()
-        post_msg = ast.literal_eval(msg)
+        post_msg = codec.decode(msg)
 
         # random uuid genearation for alarm definition
         id = str(uuid.uuid4())
@@ -84,7 +84,7 @@ class AlarmDispatcher(object):
         post_msg["request"] = "POST"
 
         LOG.debug("Post Alarm method: %s" % post_msg)
-        code = self._kafka_conn.send_messages(json.dumps(post_msg))
+        code = self._kafka_conn.send_messages(codec.encode(post_msg))
         res.status = getattr(falcon, 'HTTP_' + str(code))
 
     def _get_alarms_response(self, res):
@@ -16,12 +16,18 @@
 
 import datetime
 import falcon
+import os
 from oslo.config import cfg
 import requests
+import threading
 import time
+import types
 
 from monasca.common import es_conn
+from monasca.common import instrument
+from monasca.common import json_stream
 from monasca.common import kafka_conn
+from monasca.common import metric_util
 from monasca.common import resource_api
 from monasca.openstack.common import log
 from monasca.openstack.common import timeutils as tu
@@ -40,6 +46,14 @@ metrics_opts = [
                      'the limit will be discarded. To see all the matching '
                      'result, narrow your search by using a small time '
                      'window or strong matching name')),
+    cfg.IntOpt('mapping_refresh', default=60,
+               help=('The interval in seconds to refresh the cached metric '
+                     'names and dimension names from ElasticSearch. Set to '
+                     '0 to only load them once when the dispatcher starts.')),
+    cfg.FloatOpt('mapping_timeout', default=10.0,
+                 help=('The seconds to wait for ElasticSearch when the '
+                       'cached metric names and dimension names are '
+                       'loaded.')),
 ]
 
 metrics_group = cfg.OptGroup(name='metrics', title='metrics')
@@ -48,6 +62,10 @@ cfg.CONF.register_opts(metrics_opts, metrics_group)
 
 LOG = log.getLogger(__name__)
 
+REQUEST_TIME = instrument.histogram(
+    'monasca_api_request_seconds',
+    'Time spent serving api requests.', ['endpoint'])
+
 
 class ParamUtil(object):
 
@@ -124,6 +142,97 @@ class ParamUtil(object):
         return ['avg', 'count', 'max', 'min', 'sum']
 
 
+class MetaCache(object):
+    """In memory cache of metric names and dimension names.
+
+    Dimension names are read from the index mappings and metric names from a
+    terms aggregation, so neither lookup scans documents. A daemon thread
+    loads the cache in the background, and refreshes it when an interval is
+    given, so that neither the start of the api nor requests wait on
+    ElasticSearch. The cache is empty until the first load has finished.
+    """
+    def __init__(self, mapping_url, query_url, doc_type, size, interval=0,
+                 timeout=None):
+        self.mapping_url = mapping_url
+        self.query_url = query_url
+        self.doc_type = doc_type
+        self.size = size
+        self.interval = interval
+        self.timeout = timeout
+        self.metric_names = []
+        self.dimension_names = []
+        self._stopped = threading.Event()
+        self._thread = None
+        self._pid = None
+        self.ensure_running()
+
+    def ensure_running(self):
+        """Start the load thread in this process if it was not started.
+
+        Threads do not survive a fork, so a cache created before the api
+        workers were forked starts its thread again in each worker.
+        """
+        if self._pid == os.getpid():
+            return
+        self._pid = os.getpid()
+        self._thread = threading.Thread(target=self._run)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def _load_dimension_names(self):
+        # the mapping response looks like this:
+        # {"data_20150101000000": {"mappings": {"metrics": {"properties":
+        #     {"dimensions": {"properties": {"key1": {...}}}}}}}}
+        res = requests.get(self.mapping_url, timeout=self.timeout)
+        if res.status_code != 200:
+            return None
+        names = set()
+        for index in (res.json() or {}).values():
+            mapping = index.get('mappings', {}).get(self.doc_type, {})
+            dims = mapping.get('properties', {}).get('dimensions', {})
+            names.update(dims.get('properties', {}).keys())
+        return sorted(names)
+
+    def _load_metric_names(self):
+        body = ('{"aggs":{"by_name":{"terms":{"field":"name","size":%d}}}}' %
+                self.size)
+        res = requests.post(self.query_url, data=body, timeout=self.timeout)
+        if res.status_code != 200:
+            return None
+        obj = res.json() or {}
+        buckets = obj.get('aggregations', {}).get('by_name', {}).get(
+            'buckets', [])
+        return sorted([bucket['key'] for bucket in buckets])
+
+    def refresh(self):
+        # Each list is replaced as a whole, readers either see the old or
+        # the new list, so no locking is needed.
+        try:
+            names = self._load_dimension_names()
+            if names is not None:
+                self.dimension_names = names
+        except Exception:
+            LOG.exception('Failed to load dimension names from %s',
+                          self.mapping_url)
+        try:
+            names = self._load_metric_names()
+            if names is not None:
+                self.metric_names = names
+        except Exception:
+            LOG.exception('Failed to load metric names from %s',
+                          self.query_url)
+
+    def _run(self):
+        self.refresh()
+        if self.interval <= 0:
+            return
+        while not self._stopped.wait(self.interval):
+            self.refresh()
+
+    def stop(self):
+        self._stopped.set()
+
+
 class MetricDispatcher(object):
     def __init__(self, global_conf):
         LOG.debug('initializing V2API!')
@@ -157,6 +266,11 @@ class MetricDispatcher(object):
                                            '*/_mappings/',
                                            cfg.CONF.metrics.topic])
 
+        self._meta_cache = MetaCache(self._query_mapping_url, self._query_url,
+                                     cfg.CONF.metrics.topic, self.size,
+                                     cfg.CONF.metrics.mapping_refresh,
+                                     cfg.CONF.metrics.mapping_timeout)
+
         # Setup metrics query aggregation command. To see the structure of
         # the aggregation, copy and paste it to a json formatter.
         self._metrics_agg = """
@@ -188,11 +302,34 @@ class MetricDispatcher(object):
 
     def post_data(self, req, res):
         LOG.debug('Getting the call.')
-        msg = req.stream.read()
-
-        code = self._kafka_conn.send_messages(msg)
+        # If the metric validator is in the pipeline, the metrics have been
+        # parsed and serialized already, send them as they are.
+        msg = req.env.get(metric_util.ENV_METRICS)
+        if msg is None:
+            msg = req.stream.read()
+
+        if isinstance(msg, types.GeneratorType):
+            code = self._send_chunks(msg)
+        else:
+            code = self._kafka_conn.send_messages(msg)
         res.status = getattr(falcon, 'HTTP_' + str(code))
 
+    def _send_chunks(self, chunks):
+        # The chunks are validated by the metric validator while they are
+        # iterated, each one is sent before the next is parsed.
+        code = 204
+        try:
+            for chunk in chunks:
+                code = self._kafka_conn.send_messages(chunk)
+                if code != 204:
+                    break
+        except json_stream.TooLarge:
+            code = 413
+        except Exception:
+            LOG.exception('Invalid metrics in the request.')
+            code = 400
+        return code
+
     def _get_agg_response(self, res):
         if res and res.status_code == 200:
             obj = res.json()
@@ -203,6 +340,7 @@ class MetricDispatcher(object):
             return None
 
     @resource_api.Restify('/v2.0/metrics/', method='get')
+    @instrument.timed(REQUEST_TIME, endpoint='GET /v2.0/metrics/')
     def do_get_metrics(self, req, res):
         LOG.debug('The metrics GET request is received!')
 
@@ -217,11 +355,11 @@ class MetricDispatcher(object):
         else:
             body = '{"aggs":' + _metrics_ag + '}'
 
-        LOG.debug('Request body:' + body)
+        LOG.debug('Request body: %s', body)
         es_res = requests.post(self._query_url, data=body)
         res.status = getattr(falcon, 'HTTP_%s' % es_res.status_code)
 
-        LOG.debug('Query to ElasticSearch returned: %s' % es_res.status_code)
+        LOG.debug('Query to ElasticSearch returned: %s', es_res.status_code)
         res_data = self._get_agg_response(es_res)
         if res_data:
             # convert the response into monasca metrics format
@@ -250,10 +388,33 @@ class MetricDispatcher(object):
             res.body = ''
 
     @resource_api.Restify('/v2.0/metrics/', method='post')
+    @instrument.timed(REQUEST_TIME, endpoint='POST /v2.0/metrics/')
     def do_post_metrics(self, req, res):
         self.post_data(req, res)
 
+    @resource_api.Restify('/v2.0/metrics/names', method='get')
+    @instrument.timed(REQUEST_TIME, endpoint='GET /v2.0/metrics/names')
+    def do_get_metric_names(self, req, res):
+        LOG.debug('The metric names GET request is received!')
+        self._meta_cache.ensure_running()
+        res.body = json.dumps([{'name': name}
+                               for name in self._meta_cache.metric_names])
+        res.content_type = 'application/json;charset=utf-8'
+        res.status = falcon.HTTP_200
+
+    @resource_api.Restify('/v2.0/metrics/dimensions/names', method='get')
+    @instrument.timed(REQUEST_TIME,
+                      endpoint='GET /v2.0/metrics/dimensions/names')
+    def do_get_dimension_names(self, req, res):
+        LOG.debug('The dimension names GET request is received!')
+        self._meta_cache.ensure_running()
+        res.body = json.dumps([{'dimension_name': name}
+                               for name in self._meta_cache.dimension_names])
+        res.content_type = 'application/json;charset=utf-8'
+        res.status = falcon.HTTP_200
+
     @resource_api.Restify('/v2.0/metrics/measurements', method='get')
+    @instrument.timed(REQUEST_TIME, endpoint='GET /v2.0/metrics/measurements')
     def do_get_measurements(self, req, res):
         LOG.debug('The metrics measurements GET request is received!')
         # process query conditions
@@ -267,11 +428,11 @@ class MetricDispatcher(object):
         else:
             body = '{"aggs":' + _measure_ag + '}'
 
-        LOG.debug('Request body:' + body)
+        LOG.debug('Request body: %s', body)
         es_res = requests.post(self._query_url, data=body)
         res.status = getattr(falcon, 'HTTP_%s' % es_res.status_code)
 
-        LOG.debug('Query to ElasticSearch returned: %s' % es_res.status_code)
+        LOG.debug('Query to ElasticSearch returned: %s', es_res.status_code)
         res_data = self._get_agg_response(es_res)
         if res_data:
             # convert the response into monasca metrics format
@@ -314,6 +475,7 @@ class MetricDispatcher(object):
             res.body = ''
 
     @resource_api.Restify('/v2.0/metrics/statistics', method='get')
+    @instrument.timed(REQUEST_TIME, endpoint='GET /v2.0/metrics/statistics')
     def do_get_statistics(self, req, res):
         # process query conditions
         query = []
@@ -332,7 +494,7 @@ class MetricDispatcher(object):
         es_res = requests.post(self._query_url, data=body)
         res.status = getattr(falcon, 'HTTP_%s' % es_res.status_code)
 
-        LOG.debug('Query to ElasticSearch returned: %s' % es_res.status_code)
+        LOG.debug('Query to ElasticSearch returned: %s', es_res.status_code)
         res_data = self._get_agg_response(es_res)
         if res_data:
             # convert the response into monasca metrics format
@@ -14,7 +14,6 @@
 # License for the specific language governing permissions and limitations
 # under the License.
 
-import ast
 import datetime
 import falcon
 from oslo.config import cfg
@@ -23,6 +22,7 @@ import re
 import time
 import uuid
 
+from monasca.common import codec
 from monasca.common import es_conn
 from monasca.common import kafka_conn
 from monasca.common import resource_api
@@ -108,7 +108,7 @@ class NotificationMethodDispatcher(object):
         LOG.debug('In NotificationMethodDispatcher::post_data.')
         msg = req.stream.read()
         # convert msg to dict
-        dict_msg = ast.literal_eval(msg)
+        dict_msg = codec.decode(msg)
 
         # random uuid used for store the methods in database
         id = str(uuid.uuid4())
@@ -126,14 +126,14 @@ class NotificationMethodDispatcher(object):
         dict_msg["request"] = "POST"
 
         LOG.debug("post notification method: %s" % dict_msg)
-        code = self._kafka_conn.send_messages(json.dumps(dict_msg))
+        code = self._kafka_conn.send_messages(codec.encode(dict_msg))
         res.status = getattr(falcon, 'HTTP_' + str(code))
 
     def put_data(self, req, res, id):
         LOG.debug('In NotificationMethodDispatcher::put_data.')
         msg = req.stream.read()
 
-        dict_msg = ast.literal_eval(msg)
+        dict_msg = codec.decode(msg)
 
         # specify the id to match in elasticsearch for update
         dict_msg["id"] = id
@@ -142,7 +142,7 @@ class NotificationMethodDispatcher(object):
         dict_msg["request"] = "PUT"
 
         LOG.debug("delete notification method: %s" % dict_msg)
-        code = self._kafka_conn.send_messages(json.dumps(dict_msg))
+        code = self._kafka_conn.send_messages(codec.encode(dict_msg))
         res.status = getattr(falcon, 'HTTP_' + str(code))
 
     def del_data(self, req, res, id):
@@ -157,7 +157,7 @@ class NotificationMethodDispatcher(object):
         dict_msg["request"] = "DEL"
 
         LOG.debug("delete notification method: %s" % dict_msg)
-        code = self._kafka_conn.send_messages(json.dumps(dict_msg))
+        code = self._kafka_conn.send_messages(codec.encode(dict_msg))
         res.status = getattr(falcon, 'HTTP_' + str(code))
 
     def _get_notification_method_response(self, res):